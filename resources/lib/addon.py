@@ -6,15 +6,28 @@ from __future__ import absolute_import, division, unicode_literals
 from routing import Plugin
 
 try:  # Python 3
-    from urllib.parse import unquote_plus
+    from urllib.parse import unquote_plus, urlsplit
 except ImportError:  # Python 2
     from urllib import unquote_plus
+    from urlparse import urlsplit
 
-from kodiutils import end_of_directory, execute_builtin, get_global_setting, localize, log_access, notification, ok_dialog, refresh_caches
+from kodiutils import (end_of_directory, execute_builtin, get_global_setting, localize, log_access, log_http_stats, notification,
+                       ok_dialog, refresh_caches, reset_memory_cache, reset_network_config, save_http_stats, set_background,
+                       set_deadline)
 from utils import from_unicode, to_unicode
 
 plugin = Plugin()  # pylint: disable=invalid-name
 
+# Latency budgets in seconds, once spent requests fail fast and menus fall back to cached or partial data
+ROUTE_BUDGETS = (
+    ('/play/', 30),  # Playback may need a login, tokens and stream info
+    ('/iptv/', 60),  # IPTV Manager waits for the complete channel list and EPG
+    ('/favorites/refresh', 30),
+    ('/resumepoints/refresh', 30),
+    ('/', 15),
+)
+BACKGROUND_ROUTES = ('/iptv/',)  # Routes nobody is actively waiting for
+
 
 @plugin.route('/')
 def main_menu():
@@ -354,7 +367,21 @@ def show_settings_addons():
     execute_builtin('ActivateWindow(SystemSettings,addons)')
 
 
+def route_budget(route):
+    """Return the latency budget in seconds for a route"""
+    return next(budget for prefix, budget in ROUTE_BUDGETS if route.startswith(prefix))
+
+
 def run(argv):
     """Addon entry point from wrapper"""
+    import httpstats
+    route = urlsplit(argv[0]).path or '/'
+    httpstats.start(route=route)
+    set_deadline(route_budget(route))
+    set_background(route.startswith(BACKGROUND_ROUTES))
+    reset_network_config()
+    reset_memory_cache()
     log_access(argv)
     plugin.run(argv)
+    log_http_stats()
+    save_http_stats()
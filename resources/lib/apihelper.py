@@ -3,6 +3,7 @@
 """Implements an ApiHelper class with common VRT NU API functionality"""
 
 from __future__ import absolute_import, division, unicode_literals
+from functools import partial
 
 try:  # Python 3
     from urllib.parse import quote_plus, unquote
@@ -13,10 +14,10 @@ except ImportError:  # Python 2
 from data import CHANNELS
 from helperobjects import TitleItem
 from kodiutils import (delete_cached_thumbnail, get_cache, get_cached_url_json, get_global_setting,
-                       get_setting_bool, get_setting_int, get_url_json, has_addon, localize,
-                       localize_from_data, log, ttl, update_cache, url_for)
+                       get_setting_bool, get_setting_int, get_url_json, get_urls_json, has_addon, localize,
+                       localize_from_data, log, run_concurrently, ttl, update_cache, url_for)
 from metadata import Metadata
-from utils import (add_https_proto, html_to_kodi, find_entry, from_unicode, play_url_to_id,
+from utils import (add_https_proto, html_to_kodi, find_entry, from_unicode, merge_sorted, play_url_to_id,
                    program_to_url, realpage, url_to_program, youtube_to_plugin_url)
 
 
@@ -24,6 +25,8 @@ class ApiHelper:
     """A class with common VRT NU API functionality"""
 
     _VRTNU_SEARCH_URL = 'https://search.vrt.be/search'
+    _VRTNU_SEARCH_URL_MAX_LENGTH = 7000  # Stay well below the 8192 bytes web servers usually accept
+    _VRTNU_SEARCH_MAX_SIZE = 300  # The maximum page size of the Search API
     _VRTNU_SUGGEST_URL = 'https://search.vrt.be/suggest'
     _VRTNU_SCREENSHOT_URL = 'https://www.vrt.be/vrtnu-static/screenshots'
 
@@ -41,9 +44,11 @@ class ApiHelper:
             params['facets[categories]'] = category
             cache_file = 'category.{category}.json'.format(category=category)
 
+        tags = ['catalog']
         if channel:
             params['facets[programBrands]'] = channel
             cache_file = 'channel.{channel}.json'.format(channel=channel)
+            tags.append('channel:' + channel)
 
         if feature:
             params['facets[programTags.title]'] = feature
@@ -56,13 +61,23 @@ class ApiHelper:
 
         querystring = '&'.join('{}={}'.format(key, value) for key, value in list(params.items()))
         suggest_url = self._VRTNU_SUGGEST_URL + '?' + querystring
-        return get_cached_url_json(url=suggest_url, cache=cache_file, ttl=ttl('indirect'), fail=[])
+        return get_cached_url_json(url=suggest_url, cache=cache_file, ttl=ttl('indirect'), fail=[], tags=tags)
 
     def list_tvshows(self, category=None, channel=None, feature=None, programs=None, use_favorites=False):
         """List all TV shows for a given category, channel, feature or list of programNames, optionally filtered by favorites"""
 
-        # Get tvshows
-        tvshows = self.get_tvshows(category=category, channel=channel, feature=feature)
+        # Get tvshows and oneoffs concurrently
+        if get_setting_bool('showoneoff', default=True):
+            cache_file = 'oneoff.json'
+            tvshows, oneoffs = run_concurrently(
+                partial(self.get_tvshows, category=category, channel=channel, feature=feature),
+                partial(self.get_episodes, variety='oneoff', cache_file=cache_file),
+            )
+        else:
+            cache_file = None
+            tvshows = self.get_tvshows(category=category, channel=channel, feature=feature)
+            # Return empty list
+            oneoffs = []
 
         # Filter tvshows using a list of programNames
         if programs:
@@ -72,15 +87,6 @@ class ApiHelper:
                     filtered_tvshows.append(tvshow)
             tvshows = filtered_tvshows
 
-        # Get oneoffs
-        if get_setting_bool('showoneoff', default=True):
-            cache_file = 'oneoff.json'
-            oneoffs = self.get_episodes(variety='oneoff', cache_file=cache_file)
-        else:
-            cache_file = None
-            # Return empty list
-            oneoffs = []
-
         return self.__map_tvshows(tvshows, oneoffs, use_favorites=use_favorites, cache_file=cache_file)
 
     def tvshow_to_listitem(self, tvshow, program, cache_file):
@@ -123,7 +129,8 @@ class ApiHelper:
         # Get data from api or cache
         if sort_key:
             episodes = self.get_episodes(program=program, season=season, category=category, feature=feature, programtype=programtype,
-                                         use_favorites=use_favorites, variety=variety, cache_file=cache_file, whatson_id=whatson_id)
+                                         use_favorites=use_favorites, variety=variety, cache_file=cache_file, whatson_id=whatson_id,
+                                         sort_key=sort_key)
             episodes = sorted(episodes, key=lambda k: k[sort_key])[(page * items_per_page) - items_per_page:page * items_per_page]
         else:
             episodes = self.get_episodes(program=program, season=season, category=category, feature=feature, programtype=programtype,
@@ -506,8 +513,9 @@ class ApiHelper:
         return video
 
     def get_episodes(self, program=None, season=None, episodes=None, category=None, feature=None, programtype=None, keywords=None,
-                     whatson_id=None, video_id=None, video_url=None, page=None, use_favorites=False, variety=None, cache_file=None):
-        """Get episodes or season data from VRT NU Search API"""
+                     whatson_id=None, video_id=None, video_url=None, page=None, use_favorites=False, variety=None, cache_file=None,
+                     sort_key=None):
+        """Get episodes or season data from VRT NU Search API, sort_key is the ascending sort order of the listing if it has one"""
 
         # Contruct params
         if page:
@@ -529,7 +537,7 @@ class ApiHelper:
             all_items = True
             params = {
                 'i': 'video',
-                'size': '300',
+                'size': str(self._VRTNU_SEARCH_MAX_SIZE),
             }
             params['facets[allowedRegion]'] = '[BE,WORLD]'
 
@@ -604,13 +612,31 @@ class ApiHelper:
         if video_url:
             params['facets[url]'] = video_url
 
+        # Tag cached listings with the user data they depend on, so changes to that data only invalidate these
+        tags = ['episodes']
+        if use_favorites:
+            tags.append('favorites')
+        if variety in ('continue', 'watchlater'):
+            tags.append('resumepoints' if variety == 'continue' else 'watchlater')
+
         # Construct VRT NU Search API Url and get api data
-        querystring = '&'.join('{}={}'.format(key, value) for key, value in list(params.items()))
-        search_url = self._VRTNU_SEARCH_URL + '?' + querystring.replace(' ', '%20')  # Only encode spaces to minimize url length
-        if cache_file:
-            search_json = get_cached_url_json(url=search_url, cache=cache_file, ttl=ttl('indirect'), fail={})
+        search_urls = self.get_search_urls(params)
+        max_items = None
+        if len(search_urls) > 1 and page:
+            # Every shard needs all results up to this page to merge them in the right order, in pages the Search API allows
+            max_items = page * items_per_page
+            search_urls = self.get_search_urls(dict(params, **{'from': 1, 'size': min(max_items, self._VRTNU_SEARCH_MAX_SIZE)}))
+        search_url = search_urls[0]
+        if len(search_urls) > 1:
+            search_json = self.get_sharded_search_json(search_urls, all_items=all_items or max_items is not None, max_items=max_items,
+                                                       cache_file=cache_file, tags=tags, sort_key=sort_key)
+            if page:
+                results = search_json.get('results')
+                search_json = dict(search_json, results=results[(page - 1) * items_per_page:page * items_per_page])
+        elif cache_file:
+            search_json = get_cached_url_json(url=search_url, cache=cache_file, ttl=ttl('indirect'), fail={}, tags=tags, negative=True)
         else:
-            search_json = get_url_json(url=search_url, fail={})
+            search_json = get_url_json(url=search_url, fail={}, negative=True)
 
         # Check for multiple seasons
         seasons = []
@@ -620,7 +646,7 @@ class ApiHelper:
                 seasons = next((f.get('buckets', []) for f in facets if f.get('name') == 'seasons' and len(f.get('buckets', [])) > 1), None)
             # Experimental: VRT Search API only returns a maximum of 10 seasons, to get all seasons we need to use the "model.json" API
             if seasons and program and len(seasons) == 10:
-                season_json = get_url_json('https://www.vrt.be/vrtnu/a-z/%s.model.json' % program)
+                season_json = get_url_json('https://www.vrt.be/vrtnu/a-z/%s.model.json' % program, negative=True)
                 season_items = None
                 try:
                     season_items = season_json.get(':items').get('parsys').get(':items').get('container') \
@@ -644,15 +670,85 @@ class ApiHelper:
         total_results = search_json.get('meta').get('total_results')
 
         if all_items and total_results > api_page_size:
-            for api_page in range(1, api_pages):
-                api_page_url = search_url + '&from=' + str(api_page * api_page_size + 1)
-                api_page_json = get_url_json(api_page_url)
+            api_page_urls = [search_url + '&from=' + str(api_page * api_page_size + 1) for api_page in range(1, api_pages)]
+            for api_page_json in get_urls_json(api_page_urls):
                 if api_page_json is not None:
-                    episodes += api_page_json.get('results', [{}])
+                    episodes = episodes + api_page_json.get('results', [{}])
 
         # Return episodes
         return episodes
 
+    def get_search_urls(self, params):
+        """Return Search API urls for these params, long facet lists are split over multiple urls to limit the url length"""
+        querystring = '&'.join('{}={}'.format(key, value) for key, value in list(params.items()))
+        search_url = self._VRTNU_SEARCH_URL + '?' + querystring.replace(' ', '%20')  # Only encode spaces to minimize url length
+        if len(search_url) <= self._VRTNU_SEARCH_URL_MAX_LENGTH:
+            return [search_url]
+
+        # Split the longest facet list in two halves, the results of both queries together are the same
+        facet_lists = [(len(value), key) for key, value in params.items()
+                       if key.startswith('facets[') and str(value).startswith('[') and ',' in str(value)]
+        if not facet_lists:
+            return [search_url]
+        key = max(facet_lists)[1]
+        values = params.get(key)[1:-1].split(',')
+        half = len(values) // 2
+        return (self.get_search_urls(dict(params, **{key: '[%s]' % ','.join(values[:half])}))
+                + self.get_search_urls(dict(params, **{key: '[%s]' % ','.join(values[half:])})))
+
+    @staticmethod
+    def get_sharded_search_json(search_urls, all_items=True, max_items=None, cache_file=None, tags=None, sort_key=None):
+        """Return the merged Search API data of a query that was split over multiple urls, optionally only the first max_items of every url"""
+        if cache_file:
+            search_json = get_cache(cache_file, ttl=ttl('indirect'))
+            if search_json is not None:
+                return search_json
+
+        log(2, 'Splitting Search API query in {shards} requests', shards=len(search_urls))
+        shards = get_urls_json(search_urls)
+        # The results of every shard in the order the Search API returned them, its first page followed by its next pages
+        shard_results = [list(shard_json.get('results', [])) if shard_json else [] for shard_json in shards]
+        if all_items:
+            page_urls = []
+            page_shards = []
+            for index, (search_url, shard_json) in enumerate(zip(search_urls, shards)):
+                if not shard_json:
+                    continue
+                pages = shard_json.get('meta').get('pages')
+                for api_page in range(1, pages.get('total')):
+                    if max_items is None or api_page * pages.get('size') < max_items:
+                        page_urls.append(search_url + '&from=' + str(api_page * pages.get('size') + 1))
+                        page_shards.append(index)
+            for index, page_json in zip(page_shards, get_urls_json(page_urls)):
+                if page_json:
+                    shard_results[index] += page_json.get('results', [])
+        shards = [shard_json for shard_json in shards if shard_json]
+
+        # Merge the results of all shards without duplicates in the order of the listing, by default by broadcast date, most recent first.
+        # Only results of different shards are compared, so the order of the Search API is kept within every shard
+        if sort_key:
+            merged = merge_sorted(shard_results, key=lambda episode: episode.get(sort_key) or '')
+        else:
+            merged = merge_sorted(shard_results, key=lambda episode: episode.get('assetOnTime') or '', reverse=True)
+        episodes = []
+        seen = set()
+        for episode in merged:
+            key = episode.get('videoId') or episode.get('url')
+            if key in seen:
+                continue
+            seen.add(key)
+            episodes.append(episode)
+
+        search_json = dict(
+            meta=dict(total_results=len(episodes), pages=dict(total=1, size=len(episodes))),
+            results=episodes,
+            facets=shards[0].get('facets', {}) if shards else {},
+        )
+        if cache_file and shards:
+            from json import dumps
+            update_cache(cache_file, dumps(search_json), tags=tags)
+        return search_json
+
     def get_live_screenshot(self, channel):
         """Get a live screenshot for a given channel, only supports Eén, Canvas and Ketnet"""
         url = '%s/%s.jpg' % (self._VRTNU_SCREENSHOT_URL, channel)
@@ -822,7 +918,8 @@ class ApiHelper:
     def get_featured_from_web():
         """Return a list of featured items from VRT NU website using AEM JSON Exporter"""
         featured = []
-        data = get_url_json('https://www.vrt.be/vrtnu/jcr:content/par.model.json')
+        data = get_cached_url_json('https://www.vrt.be/vrtnu/jcr:content/par.model.json', cache='featured.web.json', ttl=ttl('indirect'),
+                                   tags=['catalog'], negative=True)
         if data is not None:
             items = data.get(':items')
             if items:
@@ -836,7 +933,8 @@ class ApiHelper:
     def get_featured_media_from_web(feature):
         """Return a list of featured media from VRT NU website using AEM JSON Exporter"""
         media = []
-        data = get_url_json('https://www.vrt.be/vrtnu/jcr:content/par/%s.model.json' % feature)
+        data = get_cached_url_json('https://www.vrt.be/vrtnu/jcr:content/par/%s.model.json' % feature, cache='featured.web.%s.json' % feature,
+                                   ttl=ttl('indirect'), tags=['catalog'], negative=True)
         if data is not None:
             for item in data.get('items'):
                 mediatype = 'tvshows'
@@ -871,7 +969,7 @@ class ApiHelper:
     def get_online_categories():
         """Return a list of categories from the VRT NU website"""
         categories = []
-        categories_json = get_url_json('https://www.vrt.be/vrtnu/categorieen/jcr:content/par/categories.model.json')
+        categories_json = get_url_json('https://www.vrt.be/vrtnu/categorieen/jcr:content/par/categories.model.json', negative=True)
         if categories_json is not None:
             categories = []
             for category in categories_json.get('items'):
@@ -895,7 +993,7 @@ class ApiHelper:
         categories = self.get_online_categories()
         if self.valid_categories(categories):
             from json import dumps
-            update_cache(cache_file, dumps(categories))
+            update_cache(cache_file, dumps(categories), tags=['catalog'])
             return categories
 
         # Fall back to internal hard-coded categories
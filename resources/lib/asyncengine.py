@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Runs independent blocking calls concurrently on a private asyncio event loop (Python 3 only)"""
+
+from __future__ import absolute_import, division, unicode_literals
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+def gather(calls, workers=4):
+    """Run calls (functions without arguments) concurrently and return their results, or raised exceptions, in the same order"""
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max(min(workers, len(calls)), 1))
+    try:
+        # urllib is blocking, so every call runs in the executor while the event loop bounds and collects them
+        futures = [loop.run_in_executor(executor, call) for call in calls]
+        return loop.run_until_complete(asyncio.gather(*futures, return_exceptions=True))
+    finally:
+        executor.shutdown(wait=True)
+        loop.close()
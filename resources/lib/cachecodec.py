@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Compresses cache entries depending on their size, and recognizes compressed entries when reading them"""
+
+from __future__ import absolute_import, division, unicode_literals
+import zlib
+
+ZLIB_MIN_SIZE = 4 * 1024  # Smaller entries fit in a few disk blocks anyway
+LZMA_MIN_SIZE = 8 * 1024 * 1024  # Only for huge entries lzma saves enough I/O to make up for decompressing more slowly than zlib
+LZMA_MAGIC = b'\xfd7zXZ\x00'
+
+
+def is_zlib(data):
+    """Whether data starts with a zlib header, JSON text never starts with an 'x'"""
+    header = bytearray(data[:2])
+    return len(header) == 2 and header[0] == 0x78 and (header[0] * 256 + header[1]) % 31 == 0
+
+
+def encode(text, compress=True):
+    """Return the body to store for a cache entry, either the text itself or compressed bytes"""
+    if not compress:
+        return text
+    data = text.encode('utf-8') if not isinstance(text, bytes) else text
+    if len(data) < ZLIB_MIN_SIZE:
+        return text
+    if len(data) >= LZMA_MIN_SIZE:
+        try:  # Python 3
+            import lzma
+            return lzma.compress(data, preset=1)
+        except ImportError:  # Python 2
+            pass
+    return zlib.compress(data, 6)
+
+
+def decode(data):
+    """Return the text of a cache entry, decompressing it if needed"""
+    if hasattr(data, 'encode') and not isinstance(data, bytes):
+        return data
+    data = bytes(data)  # SQLite returns a buffer on Python 2
+    if data.startswith(LZMA_MAGIC):
+        import lzma
+        data = lzma.decompress(data)
+    elif is_zlib(data):
+        data = zlib.decompress(data)
+    return data.decode('utf-8')
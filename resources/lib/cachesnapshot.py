@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements pre-parsed binary snapshots of large cache entries, which load much faster than their JSON"""
+
+from __future__ import absolute_import, division, unicode_literals
+import marshal
+import struct
+import sys
+from zlib import crc32
+
+SNAPSHOT_MIN_SIZE = 64 * 1024  # Smaller entries parse fast enough, a snapshot would only add disk writes
+MAGIC = b'VRTSNAP'
+VERSION = 2
+# Format version, marshal version, Python version, checksum of the payload, content hash and size of the JSON entry
+HEADER = struct.Struct('>7sBBBBI40sQ')
+
+
+def source_tag():
+    """Return the parts of the header that must match the running Python, since the marshal format differs between versions"""
+    return (MAGIC, VERSION, marshal.version, sys.version_info[0], sys.version_info[1])
+
+
+def dumps(json_data, version):
+    """Return a snapshot of parsed JSON data, valid as long as the JSON entry has the same content hash and size"""
+    payload = marshal.dumps(json_data)
+    digest, size = version
+    return HEADER.pack(*(source_tag() + (crc32(payload) & 0xffffffff, digest.encode('ascii'), size))) + payload
+
+
+def loads(data, version):
+    """Return the parsed JSON data of a snapshot, or None if it is corrupt, outdated or written by another Python version"""
+    if data is None or len(data) < HEADER.size:
+        return None
+    header = HEADER.unpack(data[:HEADER.size])
+    digest, size = version
+    if header[:5] != source_tag() or header[6:] != (digest.encode('ascii'), size):
+        return None
+    payload = data[HEADER.size:]
+    if crc32(payload) & 0xffffffff != header[5]:
+        return None
+    try:
+        return marshal.loads(payload)
+    except (EOFError, ValueError, TypeError):
+        return None
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements an HTTP cache store in a single SQLite database"""
+
+from __future__ import absolute_import, division, unicode_literals
+import sqlite3
+from json import dumps, loads
+from threading import Lock
+from time import time
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, body TEXT NOT NULL, fetched REAL NOT NULL, expires REAL, meta TEXT, hash TEXT, '
+    'accessed REAL)',
+    'CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)',
+    'CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))',
+    'CREATE INDEX IF NOT EXISTS tags_key ON tags (key)',
+)
+
+
+class SQLiteCache:
+    """A cache store keeping the body, fetch time, expiry, HTTP validators and tags of every entry in one database"""
+
+    def __init__(self, path):
+        """Initialize the SQLiteCache class"""
+        self.path = path
+        self._lock = Lock()  # The connection is shared by the threads of this process
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        # Readers never block the writer of another process, and commits do not wait for every disk sync
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+
+    def transaction(self):
+        """Return a context manager that runs statements in a single write transaction"""
+        return Transaction(self._conn, self._lock)
+
+    def get(self, key):
+        """Return the body and the time it was fetched of an entry, or None"""
+        with self._lock:
+            row = self._conn.execute('SELECT body, fetched FROM entries WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def stat(self, key):
+        """Return the time an entry was fetched and the size of its body, or None"""
+        with self._lock:
+            row = self._conn.execute('SELECT fetched, length(body) FROM entries WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def keys(self):
+        """Return the keys of all entries"""
+        with self._lock:
+            return set(row[0] for row in self._conn.execute('SELECT key FROM entries'))
+
+    def get_hash(self, key):
+        """Return the content hash of an entry, or None"""
+        with self._lock:
+            row = self._conn.execute('SELECT hash FROM entries WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, body, expires=None, tags=None, content_hash=None):
+        """Store an entry, keeping its HTTP validators only if the content did not change"""
+        now = time()
+        if isinstance(body, bytes):
+            body = sqlite3.Binary(body)  # Compressed data
+        with self.transaction() as cursor:
+            if content_hash is not None:
+                row = cursor.execute('SELECT hash FROM entries WHERE key = ?', (key,)).fetchone()
+                unchanged = row and row[0] == content_hash
+            else:
+                row = cursor.execute('SELECT body FROM entries WHERE key = ?', (key,)).fetchone()
+                unchanged = row and row[0] == body
+            if unchanged:
+                cursor.execute('UPDATE entries SET fetched = ?, expires = ? WHERE key = ?', (now, expires, key))
+            else:
+                cursor.execute('INSERT OR REPLACE INTO entries (key, body, fetched, expires, hash, accessed) VALUES (?, ?, ?, ?, ?, ?)',
+                               (key, body, now, expires, content_hash, now))
+            if tags is not None:
+                self._tag(cursor, key, tags)
+
+    def tag(self, key, tags):
+        """Replace the tags of an entry"""
+        with self.transaction() as cursor:
+            self._tag(cursor, key, tags)
+
+    @staticmethod
+    def _tag(cursor, key, tags):
+        """Replace the tags of an entry within a transaction, unless they did not change"""
+        if set(row[0] for row in cursor.execute('SELECT tag FROM tags WHERE key = ?', (key,))) == set(tags):
+            return
+        cursor.execute('DELETE FROM tags WHERE key = ?', (key,))
+        cursor.executemany('INSERT INTO tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in set(tags)])
+
+    def touch(self, key, content_hash=None, expires=None):
+        """Mark an entry as fetched just now, optionally only if it has this content hash, return whether it was touched"""
+        with self.transaction() as cursor:
+            # Keep the expiry of the entry when the new one is unknown
+            if content_hash is None:
+                return cursor.execute('UPDATE entries SET fetched = ?, expires = coalesce(?, expires) WHERE key = ?',
+                                      (time(), expires, key)).rowcount > 0
+            return cursor.execute('UPDATE entries SET fetched = ?, expires = coalesce(?, expires) WHERE key = ? AND hash = ?',
+                                  (time(), expires, key, content_hash)).rowcount > 0
+
+    def access(self, key, resolution=0):
+        """Record that an entry was read, unless that was already recorded less than resolution seconds ago"""
+        now = time()
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE entries SET accessed = ? WHERE key = ? AND (accessed IS NULL OR accessed < ?)', (now, key, now - resolution))
+
+    def get_meta(self, key):
+        """Return the metadata (e.g. HTTP validators) of an entry"""
+        with self._lock:
+            row = self._conn.execute('SELECT meta FROM entries WHERE key = ?', (key,)).fetchone()
+        if not row or not row[0]:
+            return {}
+        try:
+            return loads(row[0])
+        except ValueError:
+            return {}
+
+    def set_meta(self, key, meta):
+        """Store the metadata of an entry"""
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE entries SET meta = ? WHERE key = ?', (dumps(meta) if meta else None, key))
+
+    def delete(self, *patterns):
+        """Delete the entries matching glob patterns (e.g. 'my-recent-*.json'), return the number of deleted entries"""
+        if not patterns:
+            return 0
+        where = ' OR '.join(['key GLOB ?'] * len(patterns))
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM tags WHERE key IN (SELECT key FROM entries WHERE %s)' % where, patterns)
+            return cursor.execute('DELETE FROM entries WHERE %s' % where, patterns).rowcount
+
+    def invalidate_tags(self, *tags):
+        """Delete the entries having any of these tags, return the number of deleted entries"""
+        if not tags:
+            return 0
+        keys = 'SELECT key FROM tags WHERE tag IN (%s)' % ', '.join(['?'] * len(tags))
+        with self.transaction() as cursor:
+            deleted = cursor.execute('DELETE FROM entries WHERE key IN (%s)' % keys, tags).rowcount
+            cursor.execute('DELETE FROM tags WHERE key IN (%s)' % keys, tags)
+            return deleted
+
+    def purge_expired(self, now=None):
+        """Delete the entries past their expiry, return the number of deleted entries"""
+        now = time() if now is None else now
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM tags WHERE key IN (SELECT key FROM entries WHERE expires < ?)', (now,))
+            return cursor.execute('DELETE FROM entries WHERE expires < ?', (now,)).rowcount
+
+    def collect_garbage(self, max_size, max_entries, max_idle, now=None):
+        """Delete expired entries and entries not used for max_idle seconds, then evict the least recently used entries beyond the quotas"""
+        now = time() if now is None else now
+        expired = self.purge_expired(now)
+        with self.transaction() as cursor:
+            garbage = 'SELECT key FROM entries WHERE coalesce(accessed, fetched) < ?'
+            cursor.execute('DELETE FROM tags WHERE key IN (%s)' % garbage, (now - max_idle,))
+            expired += cursor.execute('DELETE FROM entries WHERE key IN (%s)' % garbage, (now - max_idle,)).rowcount
+            rows = cursor.execute('SELECT key, length(body) + coalesce(length(meta), 0) FROM entries '
+                                  'ORDER BY coalesce(accessed, fetched) DESC').fetchall()
+            size = 0
+            evicted = []
+            for index, (key, length) in enumerate(rows):
+                # Once the quota is reached, all less recently used entries go
+                if evicted or index >= max_entries or size + length > max_size:
+                    evicted.append((key,))
+                    continue
+                size += length
+            cursor.executemany('DELETE FROM tags WHERE key = ?', evicted)
+            cursor.executemany('DELETE FROM entries WHERE key = ?', evicted)
+        return dict(entries=len(rows) - len(evicted), size=size, expired=expired, evicted=len(evicted))
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+class Transaction:
+    """A write transaction that is committed when it succeeds, and rolled back when it fails"""
+
+    def __init__(self, conn, lock):
+        """Initialize the Transaction class"""
+        self._conn = conn
+        self._lock = lock
+        self._cursor = None
+
+    def __enter__(self):
+        """Take the write lock of the database right away, so concurrent writers wait instead of failing halfway"""
+        self._lock.acquire()
+        try:
+            self._cursor = self._conn.cursor()
+            self._cursor.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self._lock.release()
+            raise
+        return self._cursor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit or roll back the transaction"""
+        try:
+            self._cursor.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._cursor.close()
+            self._lock.release()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements persistent (keep-alive) HTTP(S) connections for urllib openers"""
+
+from __future__ import absolute_import, division, unicode_literals
+from socket import create_connection, error as socket_error, getaddrinfo, getdefaulttimeout, SOCK_STREAM, timeout
+from sys import version_info
+from threading import Lock
+from time import time
+
+try:  # Python 3
+    from http.client import BadStatusLine, HTTPConnection, HTTPSConnection
+    from urllib.error import URLError
+    from urllib.request import HTTPHandler, HTTPSHandler
+except ImportError:  # Python 2
+    from httplib import BadStatusLine, HTTPConnection, HTTPSConnection
+    from urllib2 import HTTPHandler, HTTPSHandler, URLError
+
+
+class ConnectionPool:
+    """A thread-safe pool of persistent HTTP(S) connections, keyed by scheme, host and tunnel host"""
+
+    def __init__(self, maxsize=4, max_idle=30):
+        """Initialize the ConnectionPool class"""
+        self._lock = Lock()
+        self._idle = {}  # Connections ready to be reused, with the time they became idle
+        self._busy = {}  # Connections with a response that may not have been read completely
+        self._orphans = []  # Busy connections that will not be reused, closed once their response is read
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _collect(self, key):
+        """Move connections whose response has been read completely back to the idle list"""
+        for orphan in list(self._orphans):
+            conn, response, since = orphan
+            # Responses nobody read for this long were abandoned, e.g. error responses
+            if response.isclosed() or time() - since > self.max_idle * 2:
+                self._orphans.remove(orphan)
+                conn.close()
+        busy = self._busy.get(key, [])
+        for conn, response in list(busy):
+            if response.isclosed():
+                busy.remove((conn, response))
+                if conn.sock is None:
+                    # The server asked to close the connection
+                    continue
+                self._idle.setdefault(key, []).append((conn, time()))
+
+    def acquire(self, key):
+        """Return an idle connection for this key, or None"""
+        with self._lock:
+            self._collect(key)
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, since = idle.pop()
+                if time() - since > self.max_idle:
+                    # Servers tend to close idle connections, so do not bother
+                    conn.close()
+                    self.discarded += 1
+                    continue
+                self.reused += 1
+                return conn
+            self.created += 1
+            return None
+
+    def release(self, key, conn, response):
+        """Hand a connection back to the pool, it is reused as soon as its response is read"""
+        with self._lock:
+            busy = self._busy.setdefault(key, [])
+            busy.append((conn, response))
+            # Never keep more connections than needed, close the oldest ones
+            while len(busy) + len(self._idle.get(key, [])) > self.maxsize:
+                self.discarded += 1
+                if self._idle.get(key):
+                    old_conn, _ = self._idle[key].pop(0)
+                    old_conn.close()
+                    continue
+                # Another thread may still be reading the response, closing the connection would break it
+                old_conn, old_response = busy.pop(0)
+                self._orphans.append((old_conn, old_response, time()))
+
+    def discard(self, response):
+        """Close the connection of a response that will not be read completely, so it is never reused"""
+        response = getattr(response, 'http_response', response)
+        with self._lock:
+            for busy in self._busy.values():
+                for conn, busy_response in list(busy):
+                    if busy_response is response:
+                        busy.remove((conn, busy_response))
+                        conn.close()
+                        self.discarded += 1
+            for orphan in list(self._orphans):
+                if orphan[1] is response:
+                    self._orphans.remove(orphan)
+                    orphan[0].close()
+
+    def close(self):
+        """Close all connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            for busy in self._busy.values():
+                for conn, _ in busy:
+                    conn.close()
+            for conn, _, _ in self._orphans:
+                conn.close()
+            self._idle = {}
+            self._busy = {}
+            self._orphans = []
+
+    def stats(self):
+        """Return connection statistics"""
+        requests = self.created + self.reused
+        return dict(
+            requests=requests,
+            created=self.created,
+            reused=self.reused,
+            discarded=self.discarded,
+            reuse_ratio=round(self.reused / requests, 2) if requests else 0.0,
+        )
+
+
+def timed_create_connection(timings):
+    """Return a socket.create_connection() replacement that records the duration of the DNS lookup and the connect"""
+    def _create_connection(address, *args, **kwargs):
+        """Resolve the host and connect to the first address that works"""
+        host, port = address
+        start = time()
+        addresses = getaddrinfo(host, port, 0, SOCK_STREAM)
+        timings['dns'] = time() - start
+        start = time()
+        error = None
+        for _, _, _, _, sockaddr in addresses:
+            try:
+                sock = create_connection(sockaddr[:2], *args, **kwargs)
+            except socket_error as exc:
+                error = exc
+                continue
+            timings['connect'] = time() - start
+            return sock
+        raise error or socket_error('getaddrinfo returns an empty list')
+    return _create_connection
+
+
+class PooledHandlerMixin:
+    """Shared implementation of the pooled HTTP and HTTPS handlers, based on urllib's AbstractHTTPHandler.do_open()"""
+
+    pool = None
+
+    def pooled_open(self, http_class, req, **http_conn_args):
+        """Send a request using a pooled connection and return the response"""
+        host = req.host if hasattr(req, 'host') else req.get_host()  # Python 3 / Python 2
+        if not host:
+            raise URLError('no host given')
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        key = (http_class.__name__, host, tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+        tunnel_headers = {}
+        if tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+        selector = req.selector if hasattr(req, 'selector') else req.get_selector()  # Python 3 / Python 2
+
+        # A pooled connection may have been closed by the server in the meantime, so retry once on a fresh connection
+        for attempt in (1, 2):
+            timings = {}
+            conn = self.pool.acquire(key)
+            reused = bool(conn)
+            if not reused:
+                conn = http_class(host, timeout=req.timeout, **http_conn_args)
+                conn.set_debuglevel(self._debuglevel)
+                if tunnel_host:
+                    conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+                if hasattr(conn, '_create_connection'):  # Python 3
+                    conn._create_connection = timed_create_connection(timings)  # pylint: disable=protected-access
+            else:
+                conn.timeout = req.timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(req.timeout if isinstance(req.timeout, (int, float)) else getdefaulttimeout())
+            try:
+                try:
+                    if conn.sock is None:
+                        start = time()
+                        conn.connect()
+                        # Includes the TLS handshake and proxy tunnel
+                        timings['connect'] = time() - start - timings.get('dns', 0)
+                    start = time()
+                    conn.request(req.get_method(), selector, req.data, headers)
+                except timeout:
+                    raise
+                except socket_error as exc:
+                    if reused and attempt == 1:
+                        conn.close()
+                        continue
+                    raise URLError(exc)
+                response = conn.getresponse()
+                timings['ttfb'] = time() - start
+            except timeout:
+                conn.close()
+                raise
+            except (BadStatusLine, socket_error):
+                conn.close()
+                if reused and attempt == 1:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            break
+
+        self.pool.release(key, conn, response)
+        return self.wrap_response(response, req, timings)
+
+    @staticmethod
+    def wrap_response(response, req, timings):
+        """Return a urllib compatible response object"""
+        if version_info.major > 2:
+            response.url = req.get_full_url()
+            response.msg = response.reason
+            response.timings = timings
+            return response
+        from socket import _fileobject  # pylint: disable=no-name-in-module
+        from urllib import addinfourl  # pylint: disable=no-name-in-module
+        response.recv = response.read
+        fdesc = _fileobject(response, close=True)
+        resp = addinfourl(fdesc, response.msg, req.get_full_url())
+        resp.http_response = response  # The response the pool knows, to discard its connection
+        resp.code = response.status
+        resp.msg = response.reason
+        resp.timings = timings
+        return resp
+
+
+class PooledHTTPHandler(PooledHandlerMixin, HTTPHandler):
+    """An urllib HTTP handler that reuses connections from a ConnectionPool"""
+
+    def __init__(self, pool, debuglevel=0):
+        """Initialize the PooledHTTPHandler class"""
+        HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        """Open an HTTP request"""
+        return self.pooled_open(HTTPConnection, req)
+
+
+class PooledHTTPSHandler(PooledHandlerMixin, HTTPSHandler):
+    """An urllib HTTPS handler that reuses connections from a ConnectionPool"""
+
+    def __init__(self, pool, debuglevel=0):
+        """Initialize the PooledHTTPSHandler class"""
+        HTTPSHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def https_open(self, req):
+        """Open an HTTPS request"""
+        context = getattr(self, '_context', None)
+        if context is None:
+            return self.pooled_open(HTTPSConnection, req)
+        return self.pooled_open(HTTPSConnection, req, context=context)
@@ -12,8 +12,8 @@ except ImportError:  # Python 2
     from urllib2 import unquote
 
 from kodiutils import (container_refresh, get_cache, get_setting_bool, get_url_json,
-                       has_credentials, input_down, invalidate_caches, localize, log_error,
-                       multiselect, notification, ok_dialog, update_cache)
+                       has_credentials, input_down, invalidate_tags, localize, log_error,
+                       modify_cache, multiselect, notification, ok_dialog, update_cache)
 from utils import program_to_id
 
 
@@ -61,7 +61,7 @@ class Favorites:
         if favorites_json is not None:
             from json import dumps
             self._data = favorites_json
-            update_cache('favorites.json', dumps(self._data))
+            update_cache('favorites.json', dumps(self._data), tags=['account'])
 
     def update(self, program, title, value=True):
         """Set a program as favorite, and update local copy"""
@@ -97,10 +97,15 @@ class Favorites:
             log_error("Failed to (un)follow program '{program}' at VRT NU ({error})", program=program, error=exc)
             notification(message=localize(30976, program=program))
             return False
+
+        def update_favorite(data):
+            """Update the favorite status of this program, keeping the changes other processes made in the meantime"""
+            data[program_id] = dict(value=payload)
+            return data
+
         # NOTE: Updates to favorites take a longer time to take effect, so we keep our own cache and use it
-        self._data[program_id] = dict(value=payload)
-        update_cache('favorites.json', dumps(self._data))
-        invalidate_caches('my-offline-*.json', 'my-recent-*.json')
+        self._data = modify_cache('favorites.json', update_favorite, default=self._data, tags=['account'])
+        invalidate_tags('favorites')
         return True
 
     def is_favorite(self, program):
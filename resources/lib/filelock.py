@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements lock files to coordinate work between Kodi processes"""
+
+from __future__ import absolute_import, division, unicode_literals
+import errno
+import os
+from time import sleep, time
+from uuid import uuid4
+
+
+class FileLock:
+    """An exclusive lock that works across processes, using a lock file that is created atomically"""
+
+    def __init__(self, path, timeout=10, stale=30):
+        """Initialize the FileLock class"""
+        self.path = path
+        self.timeout = timeout  # Maximum time to wait for another process to release the lock
+        self.stale = stale  # Lock files older than this were left behind by a process that got stuck or crashed
+        self.locked = False
+        self.waited = False
+        self.token = '{pid}-{id}'.format(pid=os.getpid(), id=uuid4().hex).encode()  # Tells our lock file apart from the lock file of others
+
+    def acquire(self):
+        """Acquire the lock, return False if another process did not release it in time"""
+        deadline = time() + self.timeout
+        while True:
+            try:
+                fdesc = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            else:
+                os.write(fdesc, self.token)
+                os.close(fdesc)
+                self.locked = True
+                return True
+            owner = self.stale_owner()
+            if owner is not None:
+                self.break_lock(owner)
+                continue
+            if time() >= deadline:
+                return False
+            self.waited = True
+            sleep(0.05)
+
+    def owner(self):
+        """Return the token of the process holding the lock, or None"""
+        try:
+            with open(self.path, 'rb') as fdesc:
+                return fdesc.read()
+        except (IOError, OSError):
+            return None
+
+    def stale_owner(self):
+        """Return the token of a lock file that was left behind, or None"""
+        try:
+            if time() - os.stat(self.path).st_mtime <= self.stale:
+                return None
+        except OSError:
+            return None
+        return self.owner()
+
+    def break_lock(self, owner):
+        """Remove the lock file, only if it still belongs to this owner so a lock that was taken over in the meantime stays"""
+        if self.owner() != owner:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def release(self):
+        """Release the lock, unless another process broke it because we held it too long"""
+        if self.locked:
+            self.break_lock(self.token)
+            self.locked = False
+
+    def __enter__(self):
+        """Acquire the lock when entering a with-statement, check locked to know whether it was acquired in time"""
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        """Release the lock when leaving a with-statement"""
+        self.release()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Collects HTTP statistics for the current add-on invocation"""
+
+from __future__ import absolute_import, division, unicode_literals
+from collections import deque
+from threading import Lock
+from time import time
+
+try:  # Python 3
+    from urllib.parse import urlparse
+except ImportError:  # Python 2
+    from urlparse import urlparse
+
+PHASES = ('dns', 'connect', 'ttfb', 'body', 'decode')
+MAX_REQUESTS = 500  # The service never starts a new route, so keep only the most recent requests
+
+_LOCK = Lock()
+_STATS = dict(route=None, started=None, hosts={}, requests=deque(maxlen=MAX_REQUESTS), cache={}, counters={}, settings={})
+
+
+def start(route):
+    """Start collecting statistics for a new route"""
+    with _LOCK:
+        _STATS['route'] = route
+        _STATS['started'] = time()
+        _STATS['hosts'] = {}
+        _STATS['requests'] = deque(maxlen=MAX_REQUESTS)
+        _STATS['cache'] = {}
+        _STATS['counters'] = {}
+        _STATS['settings'] = {}
+
+
+def count(url, **counters):
+    """Add counters (e.g. requests, wire_bytes, body_bytes) to the statistics of the url's host"""
+    host = urlparse(url).netloc
+    with _LOCK:
+        host_stats = _STATS.get('hosts').setdefault(host, {})
+        for key, value in counters.items():
+            host_stats[key] = host_stats.get(key, 0) + value
+
+
+def record(url, status=None, **values):
+    """Add a request to the statistics and return its record, so more values can be added to it later"""
+    parsed_url = urlparse(url)
+    request = dict(url=parsed_url.netloc + parsed_url.path, status=status)  # Leave out the query, it may be long or sensitive
+    add(request, **values)
+    with _LOCK:
+        _STATS.get('requests').append(request)
+    return request
+
+
+def add(request, **values):
+    """Add values (e.g. the duration of a phase in seconds, or bytes) to a request record"""
+    if request is None:
+        return
+    with _LOCK:
+        for key, value in values.items():
+            request[key] = round(request.get(key, 0) + value, 4)
+
+
+def cache(outcome):
+    """Count a cache lookup, outcome is one of 'hit', 'miss', 'stale' or 'negative'"""
+    with _LOCK:
+        _STATS.get('cache')[outcome] = _STATS.get('cache').get(outcome, 0) + 1
+
+
+def increment(name, value=1):
+    """Increment a general counter, e.g. the number of JSON-RPC calls saved"""
+    with _LOCK:
+        _STATS.get('counters')[name] = _STATS.get('counters').get(name, 0) + value
+
+
+def setting(name, value):
+    """Record a setting the statistics depend on, e.g. the time-to-live of negative cache entries"""
+    with _LOCK:
+        _STATS.get('settings')[name] = value
+
+
+def summary():
+    """Return the statistics of the current route"""
+    with _LOCK:
+        hosts = dict((host, dict(counters)) for host, counters in _STATS.get('hosts').items())
+        requests = [dict(request) for request in _STATS.get('requests')]
+        cache_stats = dict(_STATS.get('cache'))
+        counters = dict(_STATS.get('counters'))
+        settings = dict(_STATS.get('settings'))
+        started = _STATS.get('started')
+    totals = {}
+    for host_counters in hosts.values():
+        for key, value in host_counters.items():
+            totals[key] = totals.get(key, 0) + value
+    phases = dict((phase, round(sum(request.get(phase, 0) for request in requests), 4)) for phase in PHASES)
+    statuses = {}
+    for request in requests:
+        statuses[str(request.get('status'))] = statuses.get(str(request.get('status')), 0) + 1
+    slowest = sorted(requests, key=lambda request: sum(request.get(phase, 0) for phase in PHASES), reverse=True)[:3]
+    return dict(
+        route=_STATS.get('route'),
+        time=round(started, 3) if started else None,
+        duration=round(time() - started, 4) if started else None,
+        hosts=hosts,
+        totals=totals,
+        requests=len(requests),
+        statuses=statuses,
+        phases=phases,
+        cache=cache_stats,
+        counters=counters,
+        settings=settings,
+        slowest=slowest,
+    )
+
+
+def save(path, max_size=256 * 1024, backups=2):
+    """Append the summary of the current route to a JSON lines file, rotating it when it grows too large"""
+    import os
+    from json import dumps
+    stats = summary()
+    if not stats.get('requests') and not stats.get('cache'):
+        return
+    if os.path.exists(path) and os.path.getsize(path) >= max_size:
+        for index in range(backups, 0, -1):
+            source = path if index == 1 else '%s.%d' % (path, index - 1)
+            if os.path.exists(source):
+                target = '%s.%d' % (path, index)
+                if os.path.exists(target):
+                    os.remove(target)
+                os.rename(source, target)
+    with open(path, 'a') as fdesc:
+        fdesc.write(dumps(stats, sort_keys=True, separators=(',', ':')) + '\n')
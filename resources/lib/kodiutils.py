@@ -7,6 +7,7 @@ from contextlib import contextmanager
 from sys import version_info
 from socket import timeout
 from ssl import SSLError
+from threading import Lock, local
 
 import xbmc
 import xbmcplugin
@@ -26,6 +27,32 @@ except ImportError:  # Python 2
 
 ADDON = Addon()
 DEFAULT_CACHE_DIR = 'cache'
+NEGATIVE_CACHE_DIR = 'negative'  # Requests that recently failed or returned nothing, kept apart from the cache entries
+
+RETRY_ATTEMPTS = 3  # Idempotent requests are tried this many times
+RETRY_BACKOFF = 0.5  # Maximum delay in seconds before the first retry, doubled for every next retry
+RETRY_HTTP_CODES = (429, 500, 502, 503, 504)
+CIRCUIT_FAILURES = 3  # Failed requests in a row before a host is considered down
+CIRCUIT_COOLDOWN = 60  # Seconds to fail fast before trying a host that is down again
+HTTP_TIMEOUT = 30  # Socket timeout in seconds, lowered to the remaining latency budget of a route
+NETWORK_CONFIG_TTL = 300  # Seconds before the service resolves Kodi's network settings again
+HEDGE_LIMIT = 2  # Hedged requests in flight per host
+HEDGE_MIN_SAMPLES = 20  # Response times of a host needed before its percentiles are trusted
+LATENCY_SAMPLES = 100  # Response times remembered per host
+RATE_LIMIT = 10  # Requests per second to a host, shared by all add-on processes
+RATE_BURST = 20  # Requests to a host that may be sent at once after a quiet period
+RATE_RESERVE = 10  # Part of the burst that background work leaves for the user
+MEMORY_CACHE_SIZE = 8 * 1024 * 1024  # Cached bytes of which the parsed content is kept in memory, marshalled
+HASH_CHUNK_SIZE = 1024 * 1024  # Characters of a cache entry encoded at once to compute its content hash
+TAG_INDEX = 'tags.index'  # The cache files per tag, when cache entries are stored as files
+CACHE_SIDECARS = ('.meta', '.hash', '.snap')  # Files stored alongside a cache file
+CACHE_KEEP_EXPIRED = 24 * 60 * 60  # Keep expired cache entries this long, to revalidate them or fall back to them when requests fail
+CACHE_MAX_IDLE = 14 * 24 * 60 * 60  # Cache entries that were neither refreshed nor read for this long are garbage
+ACCESS_RESOLUTION = 60 * 60  # Access times are updated at most once an hour, to avoid a write on every cache hit
+HEDGES = dict(lock=Lock(), inflight={})
+DEADLINE = local()  # The latency budget of each thread, worker threads get the deadline of the thread that starts them
+REQUESTS = local()  # Why the last request of each thread was skipped before it was sent, if it was
+REFRESH_AHEAD = local()  # The refresh-ahead margin of each thread, other threads of the service keep the regular freshness
 
 SORT_METHODS = dict(
     # date=xbmcplugin.SORT_METHOD_DATE,
@@ -333,7 +360,8 @@ def play(stream, video=None):
 def get_search_string(search_string=None):
     """Ask the user for a search string"""
     keyboard = xbmc.Keyboard(search_string, localize(30134))
-    keyboard.doModal()
+    with suspend_deadline():
+        keyboard.doModal()
     if keyboard.isConfirmed():
         search_string = to_unicode(keyboard.getText())
     return search_string
@@ -344,9 +372,10 @@ def ok_dialog(heading='', message=''):
     from xbmcgui import Dialog
     if not heading:
         heading = addon_name()
-    if kodi_version_major() < 19:
-        return Dialog().ok(heading=heading, line1=message)
-    return Dialog().ok(heading=heading, message=message)
+    with suspend_deadline():
+        if kodi_version_major() < 19:
+            return Dialog().ok(heading=heading, line1=message)
+        return Dialog().ok(heading=heading, message=message)
 
 
 def notification(heading='', message='', icon='info', time=4000):
@@ -364,7 +393,8 @@ def multiselect(heading='', options=None, autoclose=0, preselect=None, use_detai
     from xbmcgui import Dialog
     if not heading:
         heading = addon_name()
-    return Dialog().multiselect(heading=heading, options=options, autoclose=autoclose, preselect=preselect, useDetails=use_details)
+    with suspend_deadline():
+        return Dialog().multiselect(heading=heading, options=options, autoclose=autoclose, preselect=preselect, useDetails=use_details)
 
 
 def set_locale():
@@ -530,11 +560,13 @@ def set_setting_float(key, value):
 
 def open_settings():
     """Open the add-in settings window, shows Credentials"""
-    ADDON.openSettings()
+    with suspend_deadline():
+        ADDON.openSettings()
 
 
 def get_global_setting(key):
     """Get a Kodi setting"""
+    get_global_setting.calls = getattr(get_global_setting, 'calls', 0) + 1
     result = jsonrpc(method='Settings.GetSettingValue', params=dict(setting=key))
     return result.get('result', {}).get('value')
 
@@ -636,8 +668,37 @@ def has_socks():
     return True
 
 
+def get_network_config():
+    """Return the network configuration resolved from Kodi settings, it is resolved only once per invocation"""
+    from time import time
+    config = getattr(get_network_config, 'cached', None)
+    if config and time() - config.get('resolved') < NETWORK_CONFIG_TTL:
+        import httpstats
+        httpstats.increment('jsonrpc_saved', config.get('jsonrpc_calls'))
+        return config
+    calls = getattr(get_global_setting, 'calls', 0)
+    proxies = resolve_proxies()
+    get_network_config.cached = dict(
+        proxies=proxies,
+        resolved=time(),
+        jsonrpc_calls=getattr(get_global_setting, 'calls', 0) - calls,
+    )
+    return get_network_config.cached
+
+
+def reset_network_config():
+    """Forget the resolved network configuration, for a new invocation or after a settings change"""
+    if hasattr(get_network_config, 'cached'):
+        del get_network_config.cached
+
+
 def get_proxies():
     """Return a usable proxies dictionary from Kodi proxy settings"""
+    return get_network_config().get('proxies')
+
+
+def resolve_proxies():
+    """Resolve a usable proxies dictionary from Kodi proxy settings"""
     usehttpproxy = get_global_setting('network.usehttpproxy')
     if usehttpproxy is not True:
         return None
@@ -985,30 +1046,63 @@ def human_delta(seconds):
     return '%d second%s' % (seconds, 's' if seconds != 1 else '')
 
 
-def get_cache(cache_file, ttl=None, cache_dir=DEFAULT_CACHE_DIR):  # pylint: disable=redefined-outer-name
-    """Get the content from cache, if it is still fresh"""
+def get_cache(cache_file, ttl=None, cache_dir=DEFAULT_CACHE_DIR, count=True):  # pylint: disable=redefined-outer-name
+    """Get the content from cache, if it is still fresh, count=False leaves a repeated lookup out of the statistics"""
     if not get_setting_bool('usehttpcaching', default=True):
         return None
 
-    fullpath = get_cache_path(cache_file, cache_dir)
-    if not exists(fullpath):
+    import httpstats
+    lookup = httpstats.cache if count else (lambda outcome: None)
+    store = cache_store(cache_dir)
+    if store:
+        fullpath = '{db}:{key}'.format(db=store.path, key=cache_file)
+    else:
+        fullpath = get_cache_path(cache_file, cache_dir)
+    stat = cache_stat(cache_file, cache_dir)
+    if stat is None:
+        lookup('miss')
         return None
+    mtime, size = stat
 
     if ttl is not None:
         from time import localtime, mktime
-        mtime = stat_file(fullpath).st_mtime()
         now = mktime(localtime())
-        if now >= mtime + ttl:
+        if now >= mtime + ttl - getattr(REFRESH_AHEAD, 'margin', 0):
+            lookup('stale')
             return None
 
 #    if ttl is None:
 #        log(3, "Cache '{path}' is forced from cache.", path=path)
 #    else:
 #        log(3, "Cache '{path}' is fresh, expires in {time}.", path=path, time=human_delta(mtime + ttl - now))
-    with open_file(fullpath, 'r') as fdesc:
-        json = get_json_data(fdesc)
+    # Reuse the parsed content while the cache entry did not change, file times have a resolution of a second
+    # so the content hash tells apart content written within the same second
+    digest = get_cache_hash(cache_file, cache_dir)
+    version = tuple(stat) + (digest,)
+    # The memory cache keeps a marshalled copy, so callers that change the content they get do not change the cached content
+    from marshal import dumps, loads
+    frozen = memory_cache().get((cache_dir, cache_file), version)
+    json = None if frozen is None else loads(frozen)
+    if json is not None:
+        httpstats.increment('memory_hits')
+    else:
+        # A refresh of unchanged content only updates the modification time, so snapshots follow the content hash
+        json = get_snapshot(cache_file, (digest, size), cache_dir)
+        if json is not None:
+            httpstats.increment('snapshot_hits')
+        else:
+            if store:
+                entry = store.get(cache_file)
+                json = load_cache(entry[0] if entry else None)
+            else:
+                json = load_cache(read_cache(fullpath))
+            if json is not None:
+                update_snapshot(cache_file, json, (digest, size), cache_dir)
+    if json is not None and frozen is None:
+        memory_cache().put((cache_dir, cache_file), dumps(json), version, size)
 
     if json is None:
+        lookup('miss')
         return None
 
     if ttl is None and isinstance(json, dict):
@@ -1021,41 +1115,631 @@ def get_cache(cache_file, ttl=None, cache_dir=DEFAULT_CACHE_DIR):  # pylint: dis
             exp = dateutil.parser.parse(expiration_date)
             if exp <= now:
                 log(2, "Cache expired: '{path}'", path=fullpath)
+                lookup('stale')
                 return None
     log(2, "Got item from cache '{path}'", path=fullpath)
+    lookup('hit')
+    record_access(cache_file, cache_dir)
     return json
 
 
-def update_cache(cache_file, data, cache_dir=DEFAULT_CACHE_DIR):
-    """Update the cache, if necessary"""
+def cache_stat(cache_file, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the time a cache entry was fetched and its size, or None"""
+    store = cache_store(cache_dir)
+    if store:
+        return store.stat(cache_file)
+    fullpath = get_cache_path(cache_file, cache_dir)
+    if not exists(fullpath):
+        return None
+    stat = stat_file(fullpath)
+    return (stat.st_mtime(), stat.st_size())
+
+
+def get_cache_age(cache_file, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the number of seconds since a cache entry was fetched, or None"""
+    stat = cache_stat(cache_file, cache_dir)
+    if stat is None:
+        return None
+    from time import localtime, mktime
+    return mktime(localtime()) - stat[0]
+
+
+@contextmanager
+def refresh_ahead(margin):
+    """Make cache entries count as stale margin seconds before they expire in this thread, so they are refreshed before anyone waits for them"""
+    REFRESH_AHEAD.margin = margin
+    try:
+        yield
+    finally:
+        REFRESH_AHEAD.margin = 0
+
+
+def update_cache(cache_file, data, cache_dir=DEFAULT_CACHE_DIR, tags=None, ttl=None):  # pylint: disable=redefined-outer-name
+    """Update the cache, if necessary, and record the tags (e.g. 'favorites') the cache entry depends on and its time-to-live"""
     if not get_setting_bool('usehttpcaching', default=True):
         return
 
+    memory_cache().pop((cache_dir, cache_file))
+    from cachecodec import encode
+    compress = get_setting_bool('compresscache', default=False)
+    digest = content_hash(data)
+    store = cache_store(cache_dir)
+    if store:
+        # Unchanged content only gets a new fetch time, new content drops the validators of the previous response
+        expires = cache_expiry(ttl)
+        if not store.touch(cache_file, content_hash=digest, expires=expires):
+            store.put(cache_file, encode(data, compress=compress), expires=expires, tags=tags, content_hash=digest)
+        elif tags is not None:
+            store.tag(cache_file, tags)
+        return
+
+    if tags is not None and not tag_cache(cache_file, tags, cache_dir):
+        # An entry missing from the tag index would never be invalidated
+        delete_cache(cache_file, cache_dir)
+        return
     fullpath = get_cache_path(cache_file, cache_dir)
-    if not exists(fullpath):
+    hash_path = get_cache_path(cache_file + '.hash', cache_dir)
+    if exists(fullpath):
+        # Avoid writes if possible (i.e. SD cards), the content hash saves reading back the old content
+        if get_cache_hash(cache_file, cache_dir) == digest:
+            update_timestamp(fullpath)
+            if ttl is not None:
+                update_cache_meta(cache_file, dict(get_cache_meta(cache_file, cache_dir), ttl=ttl), cache_dir)
+            return
+    else:
         # Create cache directory if missing
         directory = get_cache_dir(cache_dir)
         if not exists(directory):
             mkdirs(directory)
+
+    data = encode(data, compress=compress)
+    # Concurrent writers must not leave the content of one write and the hash of another behind
+    with cache_lock(cache_file + '.write', cache_dir) as lock:
+        if not lock.locked:
+            log_error("Cache '{file}' is being written by another process, not writing it", file=cache_file)
+            return
+        # An interrupted write must never leave the hash of the previous content behind
+        if exists(hash_path):
+            delete(hash_path)
         write_cache(fullpath, data)
+        write_cache(hash_path, digest)
+    # Validators of a previous HTTP response no longer apply to new content, the time-to-live makes expired files garbage
+    if ttl is None:
+        delete_cache_meta(cache_file, cache_dir)
+    else:
+        update_cache_meta(cache_file, dict(ttl=ttl), cache_dir)
+    # The snapshot of the previous content is of no use anymore
+    delete_snapshot(cache_file, cache_dir)
+
+
+def cache_expiry(ttl):  # pylint: disable=redefined-outer-name
+    """Return the time after which a cache entry with this time-to-live is garbage, or None"""
+    if ttl is None:
+        return None
+    from time import time
+    return time() + ttl + cache_grace()
+
+
+def cache_grace():
+    """Return how long cache entries are kept after their time-to-live"""
+    return get_setting_int('stalegrace', default=60) * 60 + CACHE_KEEP_EXPIRED
+
+
+def content_hash(data):
+    """Return a hash of the content of a cache entry, encoded in chunks to avoid another full copy in memory"""
+    from hashlib import sha1
+    digest = sha1()
+    if isinstance(data, bytes):
+        digest.update(data)
+    else:
+        for start in range(0, len(data), HASH_CHUNK_SIZE):
+            digest.update(data[start:start + HASH_CHUNK_SIZE].encode('utf-8'))
+    return digest.hexdigest()
+
+
+def tag_cache(cache_file, tags, cache_dir=DEFAULT_CACHE_DIR):
+    """Record the tags of a cache file in the tag index of its cache directory, return False if the tag index stayed locked"""
+    from filelock import FileLock
+    directory = get_cache_dir(cache_dir)
+    if not exists(directory):
+        mkdirs(directory)
+    fullpath = get_cache_path(TAG_INDEX, cache_dir)
+    with FileLock(fullpath + '.lock', timeout=5) as lock:
+        if not lock.locked:
+            log_error("Tag index is locked by another process, cannot tag cache '{file}'", file=cache_file)
+            return False
+        index = get_tag_index(cache_dir)
+        tagged = set(tag for tag, files in index.items() if cache_file in files)
+        if tagged == set(tags):
+            # Tags hardly ever change, avoid writes (i.e. SD cards)
+            return True
+        for tag in tagged - set(tags):
+            index[tag].remove(cache_file)
+        for tag in set(tags) - tagged:
+            index.setdefault(tag, []).append(cache_file)
+        write_tag_index(index, cache_dir)
+    return True
+
+
+def get_tag_index(cache_dir=DEFAULT_CACHE_DIR):
+    """Return the cache files per tag of a cache directory"""
+    fullpath = get_cache_path(TAG_INDEX, cache_dir)
+    if not exists(fullpath):
+        return {}
+    index = load_cache(read_cache(fullpath))
+    return index if isinstance(index, dict) else {}
+
+
+def write_tag_index(index, cache_dir=DEFAULT_CACHE_DIR):
+    """Store the cache files per tag of a cache directory, leaving out tags without cache files"""
+    from json import dumps
+    write_cache(get_cache_path(TAG_INDEX, cache_dir), dumps(dict((tag, files) for tag, files in index.items() if files)))
+
+
+def invalidate_tags(*tags):
+    """Invalidate the cache entries that depend on any of these tags, e.g. invalidate_tags('favorites') after following a program"""
+    if not tags:
+        return
+    memory_cache().clear()
+    # Negative cache entries are not tagged, and are few and short-lived anyway
+    clear_negative_cache()
+    store = cache_store()
+    if store:
+        deleted = store.invalidate_tags(*tags)
+        log(3, 'Invalidated {count} cache entries tagged {tags}', count=deleted, tags=', '.join(tags))
+        return
+    if not exists(get_cache_path(TAG_INDEX)):
         return
+    from filelock import FileLock
+    with FileLock(get_cache_path(TAG_INDEX) + '.lock', timeout=5) as lock:
+        index = get_tag_index()
+        removes = set()
+        for tag in tags:
+            removes.update(index.pop(tag, []))
+        if not removes:
+            return
+        if lock.locked:
+            for files in index.values():
+                files[:] = [filename for filename in files if filename not in removes]
+            write_tag_index(index)
+        else:
+            # Deleting the cache files is what matters, garbage collection prunes the tag index later
+            log_error('Tag index is locked by another process, invalidating {tags} without updating it', tags=', '.join(tags))
+    log(3, 'Invalidated {count} cache entries tagged {tags}', count=len(removes), tags=', '.join(tags))
+    for cache_file in removes:
+        delete_cache(cache_file)
+
+
+def get_cache_hash(cache_file, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the content hash stored alongside a cache file, or None"""
+    store = cache_store(cache_dir)
+    if store:
+        return store.get_hash(cache_file)
+    fullpath = get_cache_path(cache_file + '.hash', cache_dir)
+    if not exists(fullpath):
+        return None
+    digest = read_cache(fullpath)
+    return digest.decode('ascii').strip() if digest else None
+
 
+def get_cache_meta(cache_file, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the metadata (e.g. HTTP validators) stored alongside a cache file"""
+    store = cache_store(cache_dir)
+    if store:
+        return store.get_meta(cache_file)
+    fullpath = get_cache_path(cache_file + '.meta', cache_dir)
+    if not exists(fullpath):
+        return {}
     with open_file(fullpath, 'r') as fdesc:
-        cache = fdesc.read()
+        meta = get_json_data(fdesc)
+    return meta if isinstance(meta, dict) else {}
 
-    # Avoid writes if possible (i.e. SD cards)
-    if cache == data:
-        update_timestamp(fullpath)
-        return
 
+def update_cache_meta(cache_file, meta, cache_dir=DEFAULT_CACHE_DIR):
+    """Store metadata (e.g. HTTP validators) alongside a cache file"""
+    if not get_setting_bool('usehttpcaching', default=True):
+        return
+    store = cache_store(cache_dir)
+    if store:
+        store.set_meta(cache_file, meta)
+        return
+    if not meta:
+        delete_cache_meta(cache_file, cache_dir)
+        return
+    from json import dumps
+    fullpath = get_cache_path(cache_file + '.meta', cache_dir)
+    data = dumps(meta)
+    if get_cache_meta(cache_file, cache_dir) == meta:
+        return
     write_cache(fullpath, data)
 
 
+def delete_cache_meta(cache_file, cache_dir=DEFAULT_CACHE_DIR):
+    """Delete the metadata stored alongside a cache file"""
+    store = cache_store(cache_dir)
+    if store:
+        store.set_meta(cache_file, None)
+        return
+    fullpath = get_cache_path(cache_file + '.meta', cache_dir)
+    if exists(fullpath):
+        delete(fullpath)
+
+
+def conditional_headers(cache_file, headers=None, cache_dir=DEFAULT_CACHE_DIR):
+    """Add HTTP validators of a stale cache file to the request headers, so the server can answer 304 Not Modified"""
+    headers = dict(headers or {})
+    if not cache_store(cache_dir) and not exists(get_cache_path(cache_file, cache_dir)):
+        return headers
+    meta = get_cache_meta(cache_file, cache_dir)
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta.get('etag')
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta.get('last_modified')
+    return headers
+
+
+def get_validators(response):
+    """Return the HTTP validators of a response"""
+    info = response.info()
+    return dict((key, value) for key, value in (('etag', info.get('ETag')), ('last_modified', info.get('Last-Modified'))) if value)
+
+
+def get_freshness(response):
+    """Return the number of seconds a response stays fresh according to its Cache-Control, Expires and Age headers, or None"""
+    from email.utils import mktime_tz, parsedate_tz
+    from time import time
+    info = response.info()
+    directives = {}
+    for directive in (info.get('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        lifetime = 0
+    elif 'max-age' in directives:
+        try:
+            lifetime = int(directives.get('max-age'))
+        except ValueError:
+            return None
+    elif info.get('Expires'):
+        expires = parsedate_tz(info.get('Expires'))
+        if not expires:
+            # An invalid date, like 0, means the response has already expired
+            return 0
+        date = parsedate_tz(info.get('Date') or '')
+        lifetime = mktime_tz(expires) - (mktime_tz(date) if date else time())
+    else:
+        return None
+    try:
+        age = int(info.get('Age') or 0)
+    except ValueError:
+        age = 0
+    return max(int(lifetime) - age, 0)
+
+
+def get_response_meta(response):
+    """Return the metadata to store alongside the cache entry of a response, its HTTP validators and freshness"""
+    meta = get_validators(response)
+    max_age = get_freshness(response)
+    if max_age is not None:
+        meta['max_age'] = max_age
+    return meta
+
+
+def cache_ttl(cache_file, default, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the time-to-live of a cache entry, the freshness its HTTP response allowed limited by the settings, or the default"""
+    if default is None:
+        return None
+    return entry_ttl(get_cache_meta(cache_file, cache_dir).get('max_age'), default)
+
+
+def entry_ttl(max_age, default):
+    """Return the freshness a response allowed limited by the settings, or the default if it did not tell"""
+    if max_age is None or default is None:
+        return default
+    # Never shorter than the direct time-to-live, so responses that forbid caching are still reused a moment
+    return max(min(max_age, get_setting_int('httpcachettlmaximum', default=24) * 60 * 60), min(default, ttl('direct')))
+
+
 def write_cache(fullpath, data):
-    """Write data to cache"""
+    """Write data to cache, atomically so other processes read either the old or the new content, never a partial file"""
+    import os
+    from threading import current_thread
     log(3, "Write cache '{path}'.", path=fullpath)
-    with open_file(fullpath, 'w') as fdesc:
-        fdesc.write(data)
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    # The profile is a local directory, and a rename within a directory is atomic
+    tmppath = '{path}.{pid}.{thread}.tmp'.format(path=fullpath, pid=os.getpid(), thread=current_thread().ident)
+    try:
+        with open(tmppath, 'wb') as fdesc:
+            fdesc.write(data)
+        replace_file(tmppath, fullpath)
+    except (IOError, OSError):
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def replace_file(source, destination, attempts=5):
+    """Rename a file, replacing the destination if it exists"""
+    import os
+    from time import sleep
+    try:  # Python 3
+        from os import replace
+    except ImportError:  # Python 2
+        def replace(source, destination):
+            """Rename a file, on Windows the destination must be removed first"""
+            if os.name == 'nt' and os.path.exists(destination):
+                os.remove(destination)
+            os.rename(source, destination)
+    for attempt in range(attempts):
+        try:
+            replace(source, destination)
+            return
+        except OSError:
+            # Windows does not allow replacing a file that another process is reading
+            if attempt == attempts - 1:
+                raise
+            sleep(0.05)
+
+
+def modify_cache(cache_file, modify, default=None, ttl=None, cache_dir=DEFAULT_CACHE_DIR, tags=None):  # pylint: disable=redefined-outer-name
+    """Read, modify and write a cache entry under its lock, so concurrent processes do not lose each other's changes"""
+    from json import dumps
+    with cache_lock(cache_file, cache_dir) as lock:
+        # Another process may have changed it in the meantime
+        memory_cache().pop((cache_dir, cache_file))
+        data = get_cache(cache_file, ttl=ttl, cache_dir=cache_dir)
+        data = modify(default if data is None else data)
+        if not lock.locked:
+            # Writing now could lose the changes of the other process, without a cache entry the next read fetches both
+            log_error("Cache '{file}' is locked by another process, dropping it instead of changing it", file=cache_file)
+            delete_cache(cache_file, cache_dir)
+            return data
+        update_cache(cache_file, dumps(data), cache_dir, tags=tags, ttl=ttl)
+    return data
+
+
+def cache_lock(cache_file, cache_dir=DEFAULT_CACHE_DIR, max_wait=5):
+    """Return a lock that protects a read-modify-write of a cache entry against other processes"""
+    import os
+    from filelock import FileLock
+    lock_dir = get_cache_dir('locks')
+    if not exists(lock_dir):
+        mkdirs(lock_dir)
+    return FileLock(os.path.join(lock_dir, '{dir}-{file}.lock'.format(dir=cache_dir, file=cache_file)), timeout=max_wait)
+
+
+def read_cache(fullpath):
+    """Return the raw content of a cache file, which may be compressed, or None"""
+    try:
+        with open(fullpath, 'rb') as fdesc:
+            return fdesc.read()
+    except (IOError, OSError) as exc:  # Deleted in the meantime
+        log_error('Cache read error: {exc}', exc=exc)
+        return None
+
+
+def load_cache(body):
+    """Return the JSON content of a cache entry, or None"""
+    if body is None:
+        return None
+    from json import loads
+    from zlib import error as zlib_error
+    from cachecodec import decode
+    try:  # Python 3
+        from lzma import LZMAError
+    except ImportError:  # Python 2
+        LZMAError = zlib_error
+    try:
+        return loads(decode(body))
+    except ValueError as exc:  # No JSON object could be decoded
+        log_error('JSON ValueError: {exc}', exc=exc)
+    except (LZMAError, zlib_error) as exc:  # Corrupt compressed data
+        log_error('Cache decompression error: {exc}', exc=exc)
+    return None
+
+
+def touch_cache(cache_file, cache_dir=DEFAULT_CACHE_DIR, ttl=None):  # pylint: disable=redefined-outer-name
+    """Mark a cache entry as fresh again"""
+    store = cache_store(cache_dir)
+    if store:
+        store.touch(cache_file, expires=cache_expiry(ttl))
+        return
+    update_timestamp(get_cache_path(cache_file, cache_dir))
+
+
+def get_snapshot(cache_file, version, cache_dir=DEFAULT_CACHE_DIR):
+    """Return the parsed content of a cache entry with this content hash and size from its binary snapshot, or None"""
+    if not get_setting_bool('usecachesnapshots', default=False) or version[0] is None:
+        return None
+    fullpath = get_cache_path(cache_file + '.snap', cache_dir)
+    if not exists(fullpath):
+        return None
+    from cachesnapshot import loads
+    json_data = loads(read_cache(fullpath), version)
+    if json_data is None:
+        log(3, "Snapshot '{path}' is outdated.", path=fullpath)
+    return json_data
+
+
+def update_snapshot(cache_file, json_data, version, cache_dir=DEFAULT_CACHE_DIR):
+    """Write a binary snapshot next to a large cache entry with this content hash and size, the JSON remains the source of truth"""
+    from cachesnapshot import SNAPSHOT_MIN_SIZE, dumps
+    if not get_setting_bool('usecachesnapshots', default=False) or version[0] is None or version[1] < SNAPSHOT_MIN_SIZE:
+        return
+    directory = get_cache_dir(cache_dir)
+    if not exists(directory):
+        mkdirs(directory)
+    try:
+        write_cache(get_cache_path(cache_file + '.snap', cache_dir), dumps(json_data, version))
+    except (IOError, OSError, ValueError) as exc:  # Full disk, or data marshal cannot handle
+        log_error('Snapshot write error: {exc}', exc=exc)
+
+
+def delete_snapshot(cache_file, cache_dir=DEFAULT_CACHE_DIR):
+    """Delete the binary snapshot of a cache entry"""
+    fullpath = get_cache_path(cache_file + '.snap', cache_dir)
+    if exists(fullpath):
+        delete(fullpath)
+
+
+def record_access(cache_file, cache_dir=DEFAULT_CACHE_DIR):
+    """Record that a cache entry was read, so the least recently used entries are evicted first"""
+    if cache_dir != DEFAULT_CACHE_DIR:
+        # Tokens are few and never evicted
+        return
+    store = cache_store(cache_dir)
+    if store:
+        store.access(cache_file, resolution=ACCESS_RESOLUTION)
+        return
+    import os
+    from time import time
+    fullpath = get_cache_path(cache_file, cache_dir)
+    try:
+        stat = os.stat(fullpath)
+        # The access time is updated explicitly, because profiles are often on file systems mounted with noatime
+        if stat.st_atime < time() - ACCESS_RESOLUTION:
+            os.utime(fullpath, (time(), stat.st_mtime))
+    except OSError as exc:  # Deleted in the meantime
+        log(3, 'Cache access time error: {exc}', exc=exc)
+
+
+def collect_cache_garbage(now=None):
+    """Delete expired and unused cache entries, and evict the least recently used entries beyond the size and entry quotas"""
+    from time import time
+    now = time() if now is None else now
+    max_size = get_setting_int('cachesizelimit', default=50) * 1024 * 1024
+    max_entries = get_setting_int('cacheentrylimit', default=1000)
+    store = cache_store()
+    if store:
+        stats = store.collect_garbage(max_size, max_entries, CACHE_MAX_IDLE, now)
+        collect_sidecar_garbage(store.keys())
+    else:
+        stats = collect_cache_file_garbage(max_size, max_entries, now)
+    stats['negative'] = clear_negative_cache(max_age=ttl('negative'), now=now)
+    log(2, 'Cache garbage collection: {expired} expired and {evicted} evicted entries, {entries} entries of {size} KiB left, '
+        '{negative} expired negative entries', expired=stats.get('expired'), evicted=stats.get('evicted'), entries=stats.get('entries'),
+        size=stats.get('size') // 1024, negative=stats.get('negative'))
+    return stats
+
+
+def collect_sidecar_garbage(keys):
+    """Delete the sidecars (e.g. snapshots) stored next to the SQLite store of entries it no longer has"""
+    directory = get_cache_dir()
+    if not exists(directory):
+        return
+    _, files = listdir(directory)
+    names = set(files)
+    for filename in files:
+        for suffix in CACHE_SIDECARS:
+            # Leave the sidecars of cache files alone, they are used again when cache files are used again
+            if filename.endswith(suffix) and filename[:-len(suffix)] not in keys and filename[:-len(suffix)] not in names:
+                delete(get_cache_path(filename))
+
+
+def collect_cache_file_garbage(max_size, max_entries, now):
+    """Delete expired and unused cache files, and evict the least recently used cache files beyond the size and entry quotas"""
+    import os
+    stats = dict(entries=0, size=0, expired=0, evicted=0)
+    directory = get_cache_dir()
+    if not exists(directory):
+        return stats
+    _, files = listdir(directory)
+    # Every cache file, with the total size of its sidecars, the last time it was refreshed or read and the time it was refreshed
+    entries = {}
+    for filename in files:
+        if filename == TAG_INDEX or filename.endswith('.lock'):
+            continue
+        if filename.endswith('.tmp'):
+            # Left behind by a write that was interrupted
+            try:
+                if os.stat(os.path.join(directory, filename)).st_mtime < now - 60 * 60:
+                    os.remove(os.path.join(directory, filename))
+            except OSError:  # Renamed in the meantime
+                pass
+            continue
+        cache_file = filename
+        for suffix in CACHE_SIDECARS:
+            if filename.endswith(suffix):
+                cache_file = filename[:-len(suffix)]
+        try:
+            stat = os.stat(os.path.join(directory, filename))
+        except OSError:  # Deleted in the meantime
+            continue
+        size, used, fetched = entries.get(cache_file, (0, 0, 0))
+        if cache_file == filename:
+            used, fetched = max(stat.st_atime, stat.st_mtime), stat.st_mtime
+        entries[cache_file] = (size + stat.st_size, used, fetched)
+    grace = cache_grace()
+    kept = []
+    for cache_file, (size, used, fetched) in sorted(entries.items(), key=lambda item: item[1][1], reverse=True):
+        # The time-to-live of a cache file is kept in its metadata
+        ttl = get_cache_meta(cache_file).get('ttl') if cache_file + '.meta' in files else None  # pylint: disable=redefined-outer-name
+        if cache_file not in files or used < now - CACHE_MAX_IDLE or (ttl is not None and fetched + ttl + grace < now):
+            # Expired and unused cache files, and sidecars left behind by a cache file that was deleted
+            stats['expired'] += 1
+        elif stats.get('evicted') or len(kept) >= max_entries or stats.get('size') + size > max_size:
+            # Once the quota is reached, all less recently used cache files go
+            stats['evicted'] += 1
+        else:
+            kept.append(cache_file)
+            stats['size'] += size
+            continue
+        delete_cache(cache_file)
+    stats['entries'] = len(kept)
+    prune_tag_index(set(kept))
+    return stats
+
+
+def prune_tag_index(cache_files, cache_dir=DEFAULT_CACHE_DIR):
+    """Remove the cache files that no longer exist from the tag index"""
+    if not exists(get_cache_path(TAG_INDEX, cache_dir)):
+        return
+    from filelock import FileLock
+    with FileLock(get_cache_path(TAG_INDEX, cache_dir) + '.lock', timeout=5) as lock:
+        if not lock.locked:
+            log_error('Tag index is locked by another process, not pruning it')
+            return
+        index = get_tag_index(cache_dir)
+        pruned = dict((tag, [filename for filename in files if filename in cache_files]) for tag, files in index.items())
+        if pruned != index:
+            write_tag_index(pruned, cache_dir)
+
+
+def memory_cache():
+    """Return the in-memory cache of parsed cache entries, shared by all threads of this process"""
+    if not hasattr(memory_cache, 'cached'):
+        from lrucache import LRUCache
+        memory_cache.cached = LRUCache(max_size=MEMORY_CACHE_SIZE)
+    return memory_cache.cached
+
+
+def reset_memory_cache():
+    """Forget the parsed cache entries, so a plugin invocation does not depend on the previous one"""
+    memory_cache().clear()
+
+
+def cache_store(cache_dir=DEFAULT_CACHE_DIR):
+    """Return the SQLite cache store, or None to keep every cache entry in a separate file"""
+    if cache_dir != DEFAULT_CACHE_DIR or not get_setting_bool('usesqlitecache', default=True):
+        # Tokens are few and managed as files by the TokenResolver
+        return None
+    if not hasattr(cache_store, 'cached'):
+        import os
+        cache_store.cached = None
+        try:
+            from sqlite3 import Error as SQLiteError
+            from cachestore import SQLiteCache
+        except ImportError as exc:  # Some platforms ship Python without sqlite3
+            log_error('SQLite cache is not available, using cache files: {exc}', exc=exc)
+            return None
+        if not exists(addon_profile()):
+            mkdirs(addon_profile())
+        try:
+            cache_store.cached = SQLiteCache(os.path.join(addon_profile(), 'cache.db'))
+        except SQLiteError as exc:
+            log_error('SQLite cache is not available, using cache files: {exc}', exc=exc)
+    return cache_store.cached
 
 
 def update_timestamp(fullpath):
@@ -1071,11 +1755,124 @@ def ttl(kind='direct'):
         return get_setting_int('httpcachettldirect', default=5) * 60
     if kind == 'indirect':
         return get_setting_int('httpcachettlindirect', default=60) * 60
+    if kind == 'negative':
+        return get_setting_int('httpcachettlnegative', default=2) * 60
     return 5 * 60
 
 
+def connection_pool():
+    """Return the pool of persistent HTTP(S) connections, shared by all requests of this process"""
+    if not hasattr(connection_pool, 'cached'):
+        from connectionpool import ConnectionPool
+        connection_pool.cached = ConnectionPool(maxsize=max_parallel_requests())
+    return connection_pool.cached
+
+
+def max_parallel_requests():
+    """Return the maximum number of HTTP requests to run in parallel"""
+    return max(get_setting_int('max_parallel_requests', default=4), 1)
+
+
+def run_parallel(func, items, workers=None):
+    """Call func for every item using a bounded pool of worker threads, and return the results in the same order"""
+    from threading import Thread
+    try:  # Python 3
+        from queue import Empty, Queue
+    except ImportError:  # Python 2
+        from Queue import Empty, Queue
+
+    items = list(items)
+    workers = min(workers or max_parallel_requests(), len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    results = [None] * len(items)
+    todo = Queue()
+    for index, item in enumerate(items):
+        todo.put((index, item))
+
+    def worker():
+        """Process items until the queue is empty"""
+        while True:
+            try:
+                index, item = todo.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception as exc:  # pylint: disable=broad-except
+                log_error('Parallel call failed for {item}: {exc}', item=item, exc=exc)
+
+    threads = [Thread(target=inherit_deadline(worker)) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_concurrently(*calls):
+    """Run independent calls (functions without arguments) concurrently and return their results in the same order"""
+    try:  # Python 3
+        from asyncengine import gather
+        results = gather([inherit_deadline(call) for call in calls], workers=max_parallel_requests())
+    except ImportError:  # Python 2 has no asyncio, use threads instead
+        def capture(call):
+            """Return the result of a call, or the exception it raised"""
+            try:
+                return call()
+            except Exception as exc:  # pylint: disable=broad-except
+                return exc
+        results = run_parallel(capture, calls)
+    # Raise errors like sequential calls would
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return list(results)
+
+
+def log_http_stats():
+    """Log how often persistent HTTP(S) connections were reused, how many bytes compression saved and where time was spent"""
+    if hasattr(connection_pool, 'cached'):
+        log(2, 'HTTP connections: {requests} requests, {created} new, {reused} reused ({reuse_ratio:.0%}), {discarded} discarded',
+            **connection_pool().stats())
+    import httpstats
+    stats = httpstats.summary()
+    for host, counters in sorted(stats.get('hosts').items()):
+        log(2, 'HTTP transfers for {route} from {host}: {responses} responses, {wire_bytes} bytes received, {body_bytes} bytes decoded',
+            route=stats.get('route'), host=host, **counters)
+    if stats.get('requests'):
+        log(2, 'HTTP timings for {route}: {requests} requests, {dns:.3f}s dns, {connect:.3f}s connect, {ttfb:.3f}s waiting, '
+            '{body:.3f}s receiving, {decode:.3f}s decoding', route=stats.get('route'), requests=stats.get('requests'), **stats.get('phases'))
+    if stats.get('totals').get('hedged'):
+        log(2, 'Hedged requests for {route}: {hedged} sent, {wins} won', route=stats.get('route'),
+            hedged=stats.get('totals').get('hedged'), wins=stats.get('totals').get('hedge_wins', 0))
+    if stats.get('counters').get('jsonrpc_saved'):
+        log(2, 'Network configuration for {route}: {saved} JSON-RPC calls saved', route=stats.get('route'),
+            saved=stats.get('counters').get('jsonrpc_saved'))
+    cache = stats.get('cache')
+    if cache:
+        log(2, 'Cache lookups for {route}: {hit} hits ({memory} parsed before, {snapshot} from snapshots), {miss} misses, {stale} stale, '
+            '{negative} negative (kept {negative_ttl}s)', route=stats.get('route'), hit=cache.get('hit', 0),
+            memory=stats.get('counters').get('memory_hits', 0), snapshot=stats.get('counters').get('snapshot_hits', 0),
+            miss=cache.get('miss', 0), stale=cache.get('stale', 0), negative=cache.get('negative', 0),
+            negative_ttl=stats.get('settings').get('negative_ttl', ttl('negative')))
+
+
+def save_http_stats():
+    """Append the HTTP statistics of this invocation to a JSON lines file in the profile"""
+    import os
+    import httpstats
+    stats_dir = get_cache_dir('stats')
+    if not exists(stats_dir):
+        mkdirs(stats_dir)
+    httpstats.save(os.path.join(stats_dir, 'httpstats.jsonl'))
+
+
 def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_redirects=True, raise_errors=None):
     """Return a urllib http response"""
+    REQUESTS.skipped = None
     try:  # Python 3
         from urllib.error import HTTPError, URLError
         from urllib.parse import unquote
@@ -1083,7 +1880,11 @@ def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_r
     except ImportError:  # Python 2
         from urllib2 import build_opener, HTTPError, HTTPCookieProcessor, ProxyHandler, Request, URLError, unquote
 
-    opener_args = []
+    import httpstats
+    from time import time
+    from connectionpool import PooledHTTPHandler, PooledHTTPSHandler
+    pool = connection_pool()
+    opener_args = [PooledHTTPHandler(pool), PooledHTTPSHandler(pool)]
     if not follow_redirects:
         opener_args.append(NoRedirection)
     if cookiejar is not None:
@@ -1112,63 +1913,413 @@ def open_url(url, data=None, headers=None, method=None, cookiejar=None, follow_r
 
     if raise_errors is None:
         raise_errors = []
-    try:
-        return opener.open(req)
-    except HTTPError as exc:
-        if isinstance(raise_errors, list) and 401 in raise_errors or raise_errors == 'all':
-            raise
-        if hasattr(req, 'selector'):  # Python 3.4+
-            url_length = len(req.selector)
-        else:  # Python 2.7
-            url_length = len(req.get_selector())
-        if exc.code == 400 and 7600 <= url_length <= 8192:
-            ok_dialog(heading='HTTP Error 400', message=localize(30967))
-            log_error('HTTP Error 400: Probably exceeded maximum url length: '
-                      'VRT Search API url has a length of {length} characters.', length=url_length)
-            return None
-        if exc.code == 413 and url_length > 8192:
-            ok_dialog(heading='HTTP Error 413', message=localize(30967))
-            log_error('HTTP Error 413: Exceeded maximum url length: '
-                      'VRT Search API url has a length of {length} characters.', length=url_length)
+
+    host = req.host if hasattr(req, 'host') else req.get_host()  # Python 3 / Python 2
+    if circuit_is_open(host):
+        log_error('Host {host} keeps failing, skipping request: {url}', host=host, url=unquote(url))
+        REQUESTS.skipped = 'circuit open'
+        return None
+
+    # Only retry requests that are safe to repeat, and never skip a write (e.g. following a program) to stay within the latency budget
+    idempotent = data is None and method in (None, 'GET', 'HEAD')
+    attempts = RETRY_ATTEMPTS if idempotent else 1
+    for attempt in range(1, attempts + 1):
+        timeout_seconds = request_timeout() if idempotent else HTTP_TIMEOUT
+        if timeout_seconds <= 0:
+            log_error('Latency budget is spent, skipping request: {url}', url=unquote(url))
+            REQUESTS.skipped = 'latency budget spent'
             return None
-        if exc.code == 431:
-            ok_dialog(heading='HTTP Error 431', message=localize(30967))
-            log_error('HTTP Error 431: Request header fields too large: '
-                      'VRT Search API url has a length of {length} characters.', length=url_length)
+        if not rate_limit(host, use_budget=idempotent):
+            log_error('Too many requests to {host}, skipping request: {url}', host=host, url=unquote(url))
+            REQUESTS.skipped = 'rate limited'
             return None
-        if exc.code == 401:
-            ok_dialog(heading='HTTP Error {code}'.format(code=exc.code), message='{}\n{}'.format(url, exc.reason))
+        try:
+            start = time()
+            response = opener.open(req, timeout=timeout_seconds)
+            response.httpstats = httpstats.record(url, status=response.getcode(), **getattr(response, 'timings', {}))
+            record_latency(host, time() - start)
+            circuit_success(host)
+            return response
+        except HTTPError as exc:
+            httpstats.record(url, status=exc.code)
+            if isinstance(raise_errors, list) and 401 in raise_errors or raise_errors == 'all':
+                raise
+            if hasattr(req, 'selector'):  # Python 3.4+
+                url_length = len(req.selector)
+            else:  # Python 2.7
+                url_length = len(req.get_selector())
+            if exc.code == 400 and 7600 <= url_length <= 8192:
+                ok_dialog(heading='HTTP Error 400', message=localize(30967))
+                log_error('HTTP Error 400: Probably exceeded maximum url length: '
+                          'VRT Search API url has a length of {length} characters.', length=url_length)
+                return None
+            if exc.code == 413 and url_length > 8192:
+                ok_dialog(heading='HTTP Error 413', message=localize(30967))
+                log_error('HTTP Error 413: Exceeded maximum url length: '
+                          'VRT Search API url has a length of {length} characters.', length=url_length)
+                return None
+            if exc.code == 431:
+                ok_dialog(heading='HTTP Error 431', message=localize(30967))
+                log_error('HTTP Error 431: Request header fields too large: '
+                          'VRT Search API url has a length of {length} characters.', length=url_length)
+                return None
+            if exc.code == 304:  # Not Modified, a conditional request confirmed our cached copy
+                circuit_success(host)
+                return exc
+            if exc.code == 401:
+                ok_dialog(heading='HTTP Error {code}'.format(code=exc.code), message='{}\n{}'.format(url, exc.reason))
+                log_error('HTTP Error {code}: {reason}', code=exc.code, reason=exc.reason)
+                return None
+            if exc.code in (400, 403) and exc.headers.get('Content-Type') and 'application/json' in exc.headers.get('Content-Type'):
+                return exc
+            if exc.code in RETRY_HTTP_CODES:
+                if attempt < attempts and retry_backoff(attempt, url, 'HTTP Error {code}'.format(code=exc.code)):
+                    continue
+                if circuit_failure(host):
+                    notification(heading=localize(30968), message=localize(30973, host=host, seconds=CIRCUIT_COOLDOWN), icon='error')
+                    log_error('HTTP Error {code}: {reason}', code=exc.code, reason=exc.reason)
+                    return None
+            notification(heading='HTTP Error {code}'.format(code=exc.code), message='{}\n{}'.format(url, exc.reason), icon='error')
             log_error('HTTP Error {code}: {reason}', code=exc.code, reason=exc.reason)
             return None
-        if exc.code in (400, 403) and exc.headers.get('Content-Type') and 'application/json' in exc.headers.get('Content-Type'):
-            return exc
-        ok_dialog(heading='HTTP Error {code}'.format(code=exc.code), message='{}\n{}'.format(url, exc.reason))
-        log_error('HTTP Error {code}: {reason}', code=exc.code, reason=exc.reason)
-        return None
-    except URLError as exc:
-        ok_dialog(heading=localize(30968), message=localize(30969))
-        log_error('URLError: {error}\nurl: {url}', error=exc.reason, url=url)
+        except URLError as exc:
+            httpstats.record(url)
+            if attempt < attempts and retry_backoff(attempt, url, exc.reason):
+                continue
+            network_error(host)
+            log_error('URLError: {error}\nurl: {url}', error=exc.reason, url=url)
+            return None
+        except SSLError as exc:
+            httpstats.record(url)
+            if attempt < attempts and retry_backoff(attempt, url, exc):
+                continue
+            # TODO: Include the error message in the notification window
+            network_error(host)
+            if hasattr(exc, 'reason'):  # Python 2.7.9+, but still failed on Python 2.7.16
+                log_error('SSLError: {error} ({library})\nurl: {url}', error=exc.reason, library=exc.library, url=url)
+            elif isinstance(exc, list):
+                log_error('SSLError: {error} ({errno})\nurl: {url}', errno=exc[0], error=exc[1], url=url)
+            else:
+                log_error('SSLError: {error}\nurl: {url}', error=str(exc), url=url)
+            return None
+        except timeout as exc:
+            httpstats.record(url)
+            if attempt < attempts and retry_backoff(attempt, url, exc):
+                continue
+            network_error(host)
+            log_error('Timeout: {error}\nurl: {url}', error=exc, url=url)
+            return None
+    return None
+
+
+def retry_backoff(attempt, url, error):
+    """Wait before retrying a failed request, using exponential backoff with full jitter, return False if there is no time left"""
+    from random import uniform
+    from time import sleep
+    delay = uniform(0, RETRY_BACKOFF * 2 ** (attempt - 1))
+    remaining = remaining_budget()
+    if remaining is not None and delay >= remaining:
+        return False
+    log(2, 'Retrying request in {delay:.2f}s after {error}: {url}', delay=delay, error=error, url=url)
+    sleep(delay)
+    return True
+
+
+def set_deadline(budget=None):
+    """Set the latency budget in seconds of the current route, requests fail fast once it is spent"""
+    from time import time
+    DEADLINE.deadline = time() + budget if budget else None
+
+
+@contextmanager
+def suspend_deadline():
+    """Stop the latency budget of the current route in this thread while the user is busy with a modal dialog"""
+    from time import time
+    remaining = remaining_budget()
+    DEADLINE.deadline = None
+    try:
+        yield
+    finally:
+        if remaining is not None:
+            DEADLINE.deadline = time() + remaining
+
+
+def remaining_budget():
+    """Return the remaining latency budget in seconds of the current route, or None without a budget"""
+    from time import time
+    deadline = getattr(DEADLINE, 'deadline', None)
+    if deadline is None:
         return None
-    except SSLError as exc:
-        # TODO: Include the error message in the notification window
-        ok_dialog(heading=localize(30968), message=localize(30969))
-        if hasattr(exc, 'reason'):  # Python 2.7.9+, but still failed on Python 2.7.16
-            log_error('SSLError: {error} ({library})\nurl: {url}', error=exc.reason, library=exc.library, url=url)
-        elif isinstance(exc, list):
-            log_error('SSLError: {error} ({errno})\nurl: {url}', errno=exc[0], error=exc[1], url=url)
-        else:
-            log_error('SSLError: {error}\nurl: {url}', error=str(exc), url=url)
+    return deadline - time()
+
+
+def inherit_deadline(func):
+    """Return a function that calls func with the latency budget of the calling thread, to run it in a worker thread"""
+    deadline = getattr(DEADLINE, 'deadline', None)
+
+    def call(*args, **kwargs):
+        """Call func with the deadline of the thread that created this function"""
+        DEADLINE.deadline = deadline
+        return func(*args, **kwargs)
+    return call
+
+
+def request_timeout():
+    """Return the socket timeout for a request, limited by the remaining latency budget"""
+    remaining = remaining_budget()
+    if remaining is None:
+        return HTTP_TIMEOUT
+    return min(HTTP_TIMEOUT, remaining)
+
+
+def set_background(background=False):
+    """Mark the requests of this process as background work, which gives way to requests the user is waiting for"""
+    set_background.background = background
+
+
+def rate_limit(host, use_budget=True):
+    """Wait until a request to a host fits in the rate limit, return False if the latency budget does not allow waiting
+
+    Without use_budget (e.g. for writes) this waits as long as it takes and never returns False
+    """
+    from ratelimiter import RateLimiter
+    limiter = RateLimiter('vrtnu_ratelimit_' + host, rate=RATE_LIMIT, burst=RATE_BURST)
+    reserve = RATE_RESERVE if getattr(set_background, 'background', False) else 0
+    if not use_budget:
+        return limiter.acquire(reserve=reserve)
+    remaining = remaining_budget()
+    return limiter.acquire(reserve=reserve, max_wait=HTTP_TIMEOUT if remaining is None else remaining)
+
+
+def network_error(host):
+    """Count a failed request to a host and notify the user, without blocking the menu with a dialog"""
+    if circuit_failure(host):
+        notification(heading=localize(30968), message=localize(30973, host=host, seconds=CIRCUIT_COOLDOWN), icon='error')
+    else:
+        notification(heading=localize(30968), message=localize(30969), icon='error')
+
+
+def get_circuit(host):
+    """Return the circuit breaker state of a host, shared by all add-on processes using a Window property"""
+    from json import loads
+    try:
+        return loads(get_property('vrtnu_circuit_' + host, default='{}'))
+    except ValueError:
+        return {}
+
+
+def set_circuit(host, circuit):
+    """Store the circuit breaker state of a host"""
+    from json import dumps
+    set_property('vrtnu_circuit_' + host, dumps(circuit))
+
+
+def circuit_is_open(host):
+    """Whether requests to a host should fail fast, because it kept failing recently"""
+    from time import time
+    circuit = get_circuit(host)
+    if not circuit.get('opened'):
+        return False
+    if time() - circuit.get('opened') < CIRCUIT_COOLDOWN:
+        return True
+    # Let a single request probe the host, other requests keep failing fast until it succeeds
+    set_circuit(host, dict(circuit, opened=time()))
+    return False
+
+
+def circuit_failure(host):
+    """Count a failed request to a host, return True if the host is now considered down"""
+    from time import time
+    circuit = get_circuit(host)
+    failures = circuit.get('failures', 0) + 1
+    opened = circuit.get('opened')
+    if failures >= CIRCUIT_FAILURES:
+        set_circuit(host, dict(failures=failures, opened=time()))
+        return not opened
+    set_circuit(host, dict(failures=failures))
+    return False
+
+
+def circuit_success(host):
+    """Reset the circuit breaker of a host after a successful request"""
+    if get_property('vrtnu_circuit_' + host):
+        clear_property('vrtnu_circuit_' + host)
+
+
+def get_latencies(host):
+    """Return the recent response times of a host, shared by all add-on processes using a Window property"""
+    from json import loads
+    try:
+        return loads(get_property('vrtnu_latency_' + host, default='[]'))
+    except ValueError:
+        return []
+
+
+def record_latency(host, seconds):
+    """Remember the response time of a request to a host"""
+    from json import dumps
+    latencies = get_latencies(host)
+    latencies.append(round(seconds, 3))
+    set_property('vrtnu_latency_' + host, dumps(latencies[-LATENCY_SAMPLES:]))
+
+
+def hedge_delay(host):
+    """Return how long to wait for a response before sending a hedged request to a host, or None to not hedge"""
+    if not get_setting_bool('usehedgedrequests', default=False):
         return None
-    except timeout as exc:
-        ok_dialog(heading=localize(30968), message=localize(30969))
-        log_error('Timeout: {error}\nurl: {url}', error=exc.reason, url=url)
+    latencies = sorted(get_latencies(host))
+    if len(latencies) < HEDGE_MIN_SAMPLES:
         return None
+    percentile = get_setting_int('hedgepercentile', default=95)
+    return latencies[min(len(latencies) * percentile // 100, len(latencies) - 1)]
+
+
+def acquire_hedge(host):
+    """Reserve one of the hedged requests a host may have in flight, return False if there are none left"""
+    with HEDGES.get('lock'):
+        inflight = HEDGES.get('inflight')
+        if inflight.get(host, 0) >= HEDGE_LIMIT:
+            return False
+        inflight[host] = inflight.get(host, 0) + 1
+        return True
+
+
+def release_hedge(host):
+    """Release a hedged request reserved for a host"""
+    with HEDGES.get('lock'):
+        HEDGES.get('inflight')[host] -= 1
+
+
+def hedged_open_url(url, headers=None):
+    """Return the first response of an idempotent GET request, sending a second identical request if the first one is slow"""
+    from threading import Event, Thread
+    try:  # Python 3
+        from urllib.parse import urlparse
+    except ImportError:  # Python 2
+        from urlparse import urlparse
+    import httpstats
+
+    host = urlparse(url).netloc
+    delay = hedge_delay(host)
+    if delay is None:
+        return open_url(url, headers=headers)
+
+    done = Event()
+    state = dict(started=0, finished=0, response=None, hedged=False, skipped=[])
+
+    def attempt(hedged):
+        """Send the request, the first response wins and later responses are discarded"""
+        try:
+            response = open_url(url, headers=headers)
+        except Exception as exc:  # pylint: disable=broad-except
+            log_error('Request failed: {exc}\nurl: {url}', exc=exc, url=url)
+            response = None
+        with HEDGES.get('lock'):
+            state['finished'] += 1
+            if response is None and request_skipped():
+                state.get('skipped').append(request_skipped())
+            won = response is not None and state.get('response') is None
+            if won:
+                state.update(response=response, hedged=hedged)
+            if won or state.get('finished') == state.get('started'):
+                done.set()
+        if response is not None and not won:
+            # Cancel the losing response instead of receiving it, its connection cannot be reused
+            connection_pool().discard(response)
+            response.close()
+        if hedged:
+            release_hedge(host)
+
+    def start(hedged):
+        """Run an attempt in a background thread, it must have been counted as started"""
+        thread = Thread(target=inherit_deadline(attempt), args=(hedged,))
+        thread.daemon = True
+        thread.start()
+
+    state['started'] = 1
+    start(False)
+    if not done.wait(delay):
+        with HEDGES.get('lock'):
+            # Count the hedge as started right away, so a first request failing in the meantime does not end the wait
+            hedge = not done.is_set()
+            if hedge:
+                state['started'] += 1
+        if hedge and acquire_hedge(host):
+            # The first request is slower than most, race it with a second one
+            log(2, 'No response after {delay:.3f}s, sending a hedged request: {url}', delay=delay, url=url)
+            httpstats.count(url, hedged=1)
+            start(True)
+        elif hedge:
+            with HEDGES.get('lock'):
+                state['started'] -= 1
+                if state.get('finished') == state.get('started'):
+                    done.set()
+    done.wait()
+    if state.get('hedged'):
+        httpstats.count(url, hedge_wins=1)
+    with HEDGES.get('lock'):
+        # The request was only skipped if no attempt was sent
+        skipped = state.get('skipped')
+        REQUESTS.skipped = skipped[-1] if state.get('response') is None and len(skipped) == state.get('finished') else None
+    return state.get('response')
+
+
+def request_skipped():
+    """Return why the last request of this thread was skipped before it was sent (e.g. the latency budget is spent), or None"""
+    return getattr(REQUESTS, 'skipped', None)
+
+
+def read_response(response, chunk_size=64 * 1024):
+    """Return the body of an HTTP response, decompressing gzip or deflate content while it is being received"""
+    import httpstats
+    from time import time
+    from zlib import MAX_WBITS, decompressobj, error as zlib_error
+    start = time()
+    encoding = (response.info().get('Content-Encoding') or '').lower()
+    if encoding not in ('deflate', 'gzip', 'x-gzip'):
+        body = response.read()
+        httpstats.count(response.geturl(), responses=1, wire_bytes=len(body), body_bytes=len(body))
+        httpstats.add(getattr(response, 'httpstats', None), body=time() - start, wire_bytes=len(body), body_bytes=len(body))
+        return body
+
+    # Some servers send raw deflate data instead of zlib wrapped deflate data
+    wbits = 16 + MAX_WBITS if 'gzip' in encoding else MAX_WBITS
+    decompressor = decompressobj(wbits)
+    chunks = []
+    wire_bytes = 0
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        try:
+            chunks.append(decompressor.decompress(chunk))
+        except zlib_error:
+            if wbits != MAX_WBITS or wire_bytes:
+                raise
+            wbits = -MAX_WBITS
+            decompressor = decompressobj(wbits)
+            chunks.append(decompressor.decompress(chunk))
+        wire_bytes += len(chunk)
+    chunks.append(decompressor.flush())
+    body = b''.join(chunks)
+    httpstats.count(response.geturl(), responses=1, wire_bytes=wire_bytes, body_bytes=len(body))
+    httpstats.add(getattr(response, 'httpstats', None), body=time() - start, wire_bytes=wire_bytes, body_bytes=len(body))
+    return body
 
 
 def get_json_data(response, fail=None):
     """Return json object from HTTP response"""
     from json import load, loads
+    from zlib import error as zlib_error
     try:
+        if hasattr(response, 'info'):  # An HTTP response, possibly compressed
+            import httpstats
+            from time import time
+            body = read_response(response)
+            start = time()
+            json_data = loads(to_unicode(body))
+            httpstats.add(getattr(response, 'httpstats', None), decode=time() - start)
+            return json_data
         if (3, 0, 0) <= version_info < (3, 6, 0):  # the JSON object must be str, not 'bytes'
             return loads(to_unicode(response.read()))
         return load(response)
@@ -1178,21 +2329,82 @@ def get_json_data(response, fail=None):
     except ValueError as exc:  # No JSON object could be decoded
         log_error('JSON ValueError: {exc}', exc=exc)
         return fail
+    except zlib_error as exc:  # Corrupt compressed data
+        log_error('JSON zlib error: {exc}', exc=exc)
+        return fail
+    except timeout as exc:  # The server stalled while sending the body
+        log_error('Timeout reading JSON: {exc}', exc=exc)
+        return fail
 
 
-def get_url_json(url, cache=None, headers=None, data=None, fail=None, raise_errors=None):
-    """Return HTTP data"""
-    response = open_url(url, headers=headers, data=data, raise_errors=raise_errors)
+def get_url_json(url, cache=None, headers=None, data=None, fail=None, raise_errors=None, tags=None, negative=False,
+                 ttl=None):  # pylint: disable=redefined-outer-name
+    """Return HTTP data, with negative=True a failed or empty response is not requested again until its negative cache entry expires"""
+    if negative:
+        entry = get_negative_cache(url)
+        if entry is not None:
+            return fail if entry.get('data') is None else entry.get('data')
+    headers = dict(headers or {})
+    if 'Accept-Encoding' not in headers:
+        headers['Accept-Encoding'] = 'gzip, deflate'
+    if data is None and raise_errors is None:
+        response = hedged_open_url(url, headers=headers)
+    else:
+        response = open_url(url, headers=headers, data=data, raise_errors=raise_errors)
     if response:
+        if cache and response.getcode() == 304:
+            log(3, "Cache '{cache}' was revalidated, extending its freshness.", cache=cache)
+            meta = dict(get_cache_meta(cache), **get_response_meta(response))
+            if ttl is not None:
+                meta['ttl'] = entry_ttl(meta.get('max_age'), ttl)
+            touch_cache(cache, ttl=meta.get('ttl'))
+            update_cache_meta(cache, meta)
+            json_data = get_cache(cache)
+            if json_data is not None:
+                return json_data
+            return get_url_json(url, cache=cache, headers=dict((key, value) for key, value in (headers or {}).items()
+                                                               if key not in ('If-None-Match', 'If-Modified-Since')), data=data, fail=fail, tags=tags,
+                                negative=negative, ttl=ttl)
         json_data = get_json_data(response, fail=fail)
+        if negative and json_data and is_empty_json(json_data):
+            update_negative_cache(url, 'returned nothing', json_data)
+            return json_data
         if json_data:
             if cache:
                 from json import dumps
-                update_cache(cache, dumps(json_data))
+                meta = get_response_meta(response)
+                if ttl is not None:
+                    meta['ttl'] = entry_ttl(meta.get('max_age'), ttl)
+                update_cache(cache, dumps(json_data), tags=tags, ttl=meta.get('ttl'))
+                update_cache_meta(cache, meta)
             return json_data
+    # A request that was never sent says nothing about the endpoint
+    if negative and not request_skipped():
+        update_negative_cache(url, 'failed')
     return fail
 
 
+def is_empty_json(json_data):
+    """Whether JSON data has nothing to show, e.g. a Search API response without results"""
+    if isinstance(json_data, dict) and 'results' in json_data:
+        return not json_data.get('results')
+    return not json_data
+
+
+def get_urls_json(urls, headers=None, fail=None):
+    """Return HTTP data of multiple urls, fetched in parallel and returned in the same order"""
+    results = run_parallel(lambda url: get_url_json(url, headers=headers), urls)
+    # Retry failed requests once, so a single hiccup does not make a listing incomplete
+    for index, url in enumerate(urls):
+        if results[index] is None:
+            log(2, 'Retrying failed request {url}', url=url)
+            results[index] = get_url_json(url, headers=headers)
+        if results[index] is None:
+            log_error('Request {url} failed twice, skipping it', url=url)
+            results[index] = fail
+    return results
+
+
 def generate_expiration_date(hours=2):
     """Return ISO 8601 formatted expirationDate"""
     from datetime import datetime, timedelta
@@ -1202,18 +2414,152 @@ def generate_expiration_date(hours=2):
 
 def delete_cache(cache_file, cache_dir=DEFAULT_CACHE_DIR):
     """Delete a cached file"""
-    path = get_cache_path(cache_file, cache_dir)
-    if exists(path):
-        delete(path)
+    memory_cache().pop((cache_dir, cache_file))
+    delete_snapshot(cache_file, cache_dir)
+    store = cache_store(cache_dir)
+    if store:
+        store.delete(cache_file)
+        return
+    for path in (get_cache_path(cache_file, cache_dir), get_cache_path(cache_file + '.hash', cache_dir)):
+        if exists(path):
+            delete(path)
+    delete_cache_meta(cache_file, cache_dir)
 
 
-def get_cached_url_json(url, cache, headers=None, ttl=None, fail=None):  # pylint: disable=redefined-outer-name
-    """Return data from cache, if any, else make an HTTP request"""
+def get_cached_url_json(url, cache, headers=None, ttl=None, fail=None, tags=None, negative=False):  # pylint: disable=redefined-outer-name
+    """Return data from cache, if any, else make an HTTP request and tag the new cache entry"""
+    # The response of the previous request may allow caching it for a longer or shorter time
+    default_ttl = ttl
+    ttl = cache_ttl(cache, ttl)
     # Get api data from cache if it is fresh
     json_data = get_cache(cache, ttl=ttl)
     if json_data is not None:
         return json_data
-    return get_url_json(url, cache=cache, headers=headers, fail=fail)
+    # Show a recently expired copy right away, and let the service refresh it
+    json_data = get_stale_cache(url, cache, headers=headers, ttl=ttl, tags=tags, default_ttl=default_ttl)
+    if json_data is not None:
+        return json_data
+    with single_flight(url, cache) as lock:
+        # Another process may have fetched it while we were waiting
+        if lock.waited:
+            json_data = get_cache(cache, ttl=ttl)
+            if json_data is not None:
+                return json_data
+        # Revalidate a stale cache, instead of downloading it again
+        json_data = get_url_json(url, cache=cache, headers=conditional_headers(cache, headers), tags=tags, negative=negative, ttl=default_ttl)
+        if json_data is None:
+            # Fall back to the stale cache when the request failed, e.g. the latency budget was spent
+            json_data = get_cache(cache)
+            if json_data is not None:
+                log(2, "Request failed, using stale cache '{cache}'", cache=cache)
+                return json_data
+            return fail
+        return json_data
+
+
+def get_stale_cache(url, cache, headers=None, ttl=None, tags=None, default_ttl=None):  # pylint: disable=redefined-outer-name
+    """Return a cache entry that expired less than the grace window ago, and ask the service to refresh it in the background"""
+    if ttl is None or getattr(set_background, 'background', False):
+        return None
+    grace = get_setting_int('stalegrace', default=60) * 60
+    if grace <= 0:
+        return None
+    # The lookup with the regular time-to-live already counted this one as stale
+    json_data = get_cache(cache, ttl=ttl + grace, count=False)
+    if json_data is None:
+        return None
+    if not notify(sender=addon_id(), message='revalidate_cache', data=dict(url=url, cache=cache, headers=headers, tags=tags, ttl=default_ttl)):
+        return None
+    import httpstats
+    httpstats.increment('stale_served')
+    log(2, "Using stale cache '{cache}', the service refreshes it in the background", cache=cache)
+    return json_data
+
+
+def revalidate_cache(url, cache, headers=None, tags=None, ttl=None):  # pylint: disable=redefined-outer-name
+    """Refresh a cache entry that was served stale"""
+    with single_flight(url, cache) as lock:
+        if lock.waited:
+            # Another process just refreshed it
+            return
+        get_url_json(url, cache=cache, headers=conditional_headers(cache, headers), tags=tags, ttl=ttl)
+
+
+def negative_cache_file(url):
+    """Return the name of the negative cache entry of a url"""
+    from hashlib import sha1
+    from utils import canonical_url
+    # Keep the fragment, it selects the channel on a livestream page
+    key = canonical_url(url) + '#' + url.partition('#')[2]
+    return sha1(key.encode('utf-8')).hexdigest() + '.json'
+
+
+def get_negative_cache(url):
+    """Return the negative cache entry of a url that recently failed or returned nothing, or None"""
+    negative_ttl = ttl('negative')
+    if negative_ttl <= 0 or not get_setting_bool('usehttpcaching', default=True):
+        return None
+    import httpstats
+    httpstats.setting('negative_ttl', negative_ttl)
+    cache_file = negative_cache_file(url)
+    age = get_cache_age(cache_file, NEGATIVE_CACHE_DIR)
+    if age is None or age >= negative_ttl:
+        return None
+    entry = load_cache(read_cache(get_cache_path(cache_file, NEGATIVE_CACHE_DIR)))
+    if not isinstance(entry, dict):
+        return None
+    httpstats.cache('negative')
+    log(2, 'Request {url} {reason} {age} seconds ago, not trying again for {wait} seconds', url=url, reason=entry.get('reason'),
+        age=int(age), wait=int(negative_ttl - age))
+    return entry
+
+
+def update_negative_cache(url, reason, json_data=None):
+    """Remember that a request failed or returned nothing, and with what empty data, until the negative time-to-live expires"""
+    if ttl('negative') <= 0 or not get_setting_bool('usehttpcaching', default=True):
+        return
+    from json import dumps
+    cache_dir = get_cache_dir(NEGATIVE_CACHE_DIR)
+    if not exists(cache_dir):
+        mkdirs(cache_dir)
+    try:
+        write_cache(get_cache_path(negative_cache_file(url), NEGATIVE_CACHE_DIR), dumps(dict(reason=reason, data=json_data)))
+    except (IOError, OSError) as exc:
+        log_error('Negative cache write error: {exc}', exc=exc)
+
+
+def clear_negative_cache(max_age=None, now=None):
+    """Delete the negative cache entries, or only those older than max_age seconds, return the number of deleted entries"""
+    import os
+    from time import time
+    cache_dir = get_cache_dir(NEGATIVE_CACHE_DIR)
+    if not exists(cache_dir):
+        return 0
+    now = time() if now is None else now
+    deleted = 0
+    _, files = listdir(cache_dir)
+    for filename in files:
+        fullpath = os.path.join(cache_dir, filename)
+        try:
+            if max_age is None or os.stat(fullpath).st_mtime < now - max_age:
+                os.remove(fullpath)
+                deleted += 1
+        except OSError:  # Deleted in the meantime
+            pass
+    return deleted
+
+
+def single_flight(url, cache_file=None, max_wait=10):
+    """Return a lock that lets only one process fetch a url, other processes wait and reuse its cache"""
+    import os
+    from hashlib import sha1
+    from filelock import FileLock
+    from utils import canonical_url
+    lock_dir = get_cache_dir('locks')
+    if not exists(lock_dir):
+        mkdirs(lock_dir)
+    key = '%s|%s' % (canonical_url(url), cache_file or '')
+    return FileLock(os.path.join(lock_dir, sha1(key.encode('utf-8')).hexdigest() + '.lock'), timeout=max_wait)
 
 
 def refresh_caches(cache_file=None):
@@ -1222,17 +2568,26 @@ def refresh_caches(cache_file=None):
     if cache_file and cache_file not in files:
         files.append(cache_file)
     invalidate_caches(*files)
+    clear_negative_cache()
     container_refresh()
     notification(message=localize(30981))
 
 
 def invalidate_caches(*caches):
     """Invalidate multiple cache files"""
+    memory_cache().clear()
+    store = cache_store()
+    if store:
+        store.delete(*caches)
+    if not exists(get_cache_dir()):
+        return
     import fnmatch
     _, files = listdir(get_cache_dir())
     # Invalidate caches related to menu list refreshes
     removes = set()
     for expr in caches:
         removes.update(fnmatch.filter(files, expr))
+    # Remove the metadata, content hashes and snapshots of these cache files as well
+    removes.update(filename + suffix for filename in list(removes) for suffix in CACHE_SIDECARS if filename + suffix in files)
     for filename in removes:
         delete(get_cache_path(filename))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements an in-memory cache of parsed cache entries"""
+
+from __future__ import absolute_import, division, unicode_literals
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """A thread-safe least recently used cache, bounded by the size of the data its entries were parsed from"""
+
+    def __init__(self, max_size=8 * 1024 * 1024):
+        """Initialize the LRUCache class"""
+        self._lock = Lock()
+        self._entries = OrderedDict()  # Least recently used first
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, validator):
+        """Return the value of an entry if its validator (e.g. the modification time and size of a file) still matches, or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] != validator:
+                if entry is not None:
+                    self.size -= entry[2]
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, validator, size):
+        """Add an entry, evicting the least recently used entries if the cache grows too large"""
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._entries[key] = (value, validator, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted[2]
+
+    def pop(self, key):
+        """Remove an entry"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[2]
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        """Return the number of entries"""
+        return len(self._entries)
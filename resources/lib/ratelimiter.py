@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements a token bucket rate limiter whose state is shared between Kodi processes"""
+
+from __future__ import absolute_import, division, unicode_literals
+from json import dumps, loads
+from threading import Lock
+from time import sleep, time
+
+from kodiutils import get_property, set_property
+
+
+class RateLimiter:
+    """A token bucket, stored in a Window property so it is shared by all Kodi processes without writing to disk"""
+
+    _lock = Lock()  # Window properties are shared by all processes, but this only serializes the threads of this process
+
+    def __init__(self, name, rate=10, burst=20):
+        """Initialize the RateLimiter class"""
+        self.name = name  # The Window property
+        self.rate = rate  # Tokens added per second
+        self.burst = burst  # Maximum number of tokens, the largest burst of requests
+
+    def _load(self, now):
+        """Return the number of tokens available now"""
+        try:
+            state = loads(get_property(self.name, default='{}'))
+            tokens, updated = float(state.get('tokens')), float(state.get('updated'))
+        except (TypeError, ValueError, AttributeError):
+            return self.burst
+        return min(self.burst, tokens + max(now - updated, 0) * self.rate)
+
+    def _save(self, tokens, now):
+        """Store the number of tokens available now"""
+        set_property(self.name, dumps(dict(tokens=round(tokens, 3), updated=round(now, 3))))
+
+    def try_acquire(self, reserve=0):
+        """Take a token if more than reserve tokens are left, return 0 on success or the seconds to wait before trying again"""
+        # Another process may take a token at the same time, the limit is approximate
+        with self._lock:
+            now = time()
+            tokens = self._load(now)
+            if tokens - 1 >= reserve:
+                self._save(tokens - 1, now)
+                return 0
+            return (reserve + 1 - tokens) / self.rate
+
+    def acquire(self, reserve=0, max_wait=None):
+        """Wait for a token, keeping reserve tokens for more important requests, return False if it takes longer than max_wait"""
+        deadline = time() + max_wait if max_wait is not None else None
+        while True:
+            wait = self.try_acquire(reserve=reserve)
+            if not wait:
+                return True
+            if deadline is not None and time() + wait > deadline:
+                return False
+            sleep(wait)
@@ -4,6 +4,7 @@
 """Implementation of ResumePoints class"""
 
 from __future__ import absolute_import, division, unicode_literals
+from functools import partial
 
 try:  # Python 3
     from urllib.error import HTTPError
@@ -12,7 +13,7 @@ except ImportError:  # Python 2
 
 from data import SECONDS_MARGIN
 from kodiutils import (container_refresh, get_cache, get_setting_bool, get_url_json, has_credentials, input_down,
-                       invalidate_caches, localize, log, log_error, notification, open_url, update_cache)
+                       invalidate_tags, localize, log, log_error, modify_cache, notification, open_url)
 
 
 class ResumePoints:
@@ -65,7 +66,7 @@ class ResumePoints:
             headers = self.watchlater_headers()
             if not headers:
                 return
-            watchlater_json = get_url_json(url=self.WATCHLATER_URL, cache=self.WATCHLATER_CACHE_FILE, headers=headers)
+            watchlater_json = get_url_json(url=self.WATCHLATER_URL, cache=self.WATCHLATER_CACHE_FILE, headers=headers, tags=['account'])
         if watchlater_json is not None:
             self._watchlater = watchlater_json
 
@@ -79,7 +80,7 @@ class ResumePoints:
             headers = self.resumepoints_headers()
             if not headers:
                 return
-            resumepoints_json = get_url_json(url=resumepoints_url, cache=self.RESUMEPOINTS_CACHE_FILE, headers=headers)
+            resumepoints_json = get_url_json(url=resumepoints_url, cache=self.RESUMEPOINTS_CACHE_FILE, headers=headers, tags=['account'])
         if resumepoints_json is not None:
             self._resumepoints = resumepoints_json
 
@@ -105,7 +106,7 @@ class ResumePoints:
         if video_id is None:
             return True
 
-        menu_caches = []
+        menu_tags = []
         self.refresh_resumepoints(ttl=5)
 
         # Add existing position and total if None
@@ -126,7 +127,7 @@ class ResumePoints:
                 # Resumepoint is not changed, nothing to do
                 return True
 
-            menu_caches.append('continue-*.json')
+            menu_tags.append('resumepoints')
 
             # Update online
             gdpr = '{asset_str} gekeken tot {at} seconden.'.format(asset_str=asset_str, at=position)
@@ -145,13 +146,11 @@ class ResumePoints:
                 return False
 
             # Update local
-            for idx, item in enumerate(self._resumepoints.get('items')):
-                if item.get('mediaId') == video_id:
-                    self._resumepoints.get('items')[idx] = resumepoint_json
-                    break
-            update_cache(self.RESUMEPOINTS_CACHE_FILE, dumps(self._resumepoints))
-            if menu_caches:
-                invalidate_caches(*menu_caches)
+            self._resumepoints = modify_cache(self.RESUMEPOINTS_CACHE_FILE, partial(self.replace_resumepoint, video_id=video_id,
+                                                                                    resumepoint_json=resumepoint_json),
+                                              default=self._resumepoints, tags=['account'])
+            if menu_tags:
+                invalidate_tags(*menu_tags)
         else:
 
             # Delete
@@ -164,7 +163,7 @@ class ResumePoints:
                 return True
 
             # Add menu caches
-            menu_caches.append('continue-*.json')
+            menu_tags.append('resumepoints')
 
             # Delete online
             try:
@@ -176,20 +175,29 @@ class ResumePoints:
                 return False
 
             # Delete local representation and cache
-            for item in self._resumepoints.get('items'):
-                if item.get('mediaId') == video_id:
-                    self._resumepoints.get('items').remove(item)
-                    break
-
-            update_cache(self.RESUMEPOINTS_CACHE_FILE, dumps(self._resumepoints))
-            if menu_caches:
-                invalidate_caches(*menu_caches)
+            self._resumepoints = modify_cache(self.RESUMEPOINTS_CACHE_FILE, partial(self.replace_resumepoint, video_id=video_id),
+                                              default=self._resumepoints, tags=['account'])
+            if menu_tags:
+                invalidate_tags(*menu_tags)
         return True
 
+    @staticmethod
+    def replace_resumepoint(resumepoints, video_id, resumepoint_json=None):
+        """Replace the resumepoint of a video, or remove it without a new resumepoint"""
+        items = resumepoints.get('items', [])
+        for idx, item in enumerate(items):
+            if item.get('mediaId') == video_id:
+                if resumepoint_json is None:
+                    del items[idx]
+                else:
+                    items[idx] = resumepoint_json
+                break
+        return resumepoints
+
     def update_watchlater(self, asset_id, title, url, watch_later=None):
         """Set program watchLater status and update local copy"""
 
-        menu_caches = []
+        menu_tags = []
         self.refresh_watchlater(ttl=5)
 
         # Update
@@ -212,10 +220,10 @@ class ResumePoints:
                 payload = dict(position=0, total=100, url=url)
 
             payload['watchLater'] = watch_later
-            menu_caches.append('watchlater-*.json')
+            menu_tags.append('watchlater')
 
             # First update watchLater status to a fast local cache because online watchLater status takes a longer time to take effect
-            self.update_watchlater_local(asset_id, dict(value=payload), menu_caches)
+            self.update_watchlater_local(asset_id, dict(value=payload), menu_tags)
 
             # Asynchronously update online
             from threading import Thread
@@ -232,10 +240,10 @@ class ResumePoints:
                 return True
 
             # Add menu caches
-            menu_caches.append('watchlater-*.json')
+            menu_tags.append('watchlater')
 
             # Delete local representation and cache
-            self.delete_watchlater_local(asset_id, menu_caches)
+            self.delete_watchlater_local(asset_id, menu_tags)
 
             # Asynchronously delete online
             from threading import Thread
@@ -255,22 +263,28 @@ class ResumePoints:
             return False
         return True
 
-    def update_watchlater_local(self, asset_id, resumepoint_json, menu_caches=None):
+    def update_watchlater_local(self, asset_id, resumepoint_json, menu_tags=None):
         """Update watchLater status locally and update cache"""
-        self._watchlater.update({asset_id: resumepoint_json})
-        from json import dumps
-        update_cache(self.WATCHLATER_CACHE_FILE, dumps(self._watchlater))
-        if menu_caches:
-            invalidate_caches(*menu_caches)
+        def update_asset(watchlater):
+            """Update the watchLater status of this asset, keeping the changes other processes made in the meantime"""
+            watchlater[asset_id] = resumepoint_json
+            return watchlater
 
-    def delete_watchlater_local(self, asset_id, menu_caches=None):
+        self._watchlater = modify_cache(self.WATCHLATER_CACHE_FILE, update_asset, default=self._watchlater, tags=['account'])
+        if menu_tags:
+            invalidate_tags(*menu_tags)
+
+    def delete_watchlater_local(self, asset_id, menu_tags=None):
         """Delete watchLater status locally and update cache"""
         if asset_id in self._watchlater:
-            del self._watchlater[asset_id]
-            from json import dumps
-            update_cache(self.WATCHLATER_CACHE_FILE, dumps(self._watchlater))
-            if menu_caches:
-                invalidate_caches(*menu_caches)
+            def delete_asset(watchlater):
+                """Delete the watchLater status of this asset, keeping the changes other processes made in the meantime"""
+                watchlater.pop(asset_id, None)
+                return watchlater
+
+            self._watchlater = modify_cache(self.WATCHLATER_CACHE_FILE, delete_asset, default=self._watchlater, tags=['account'])
+            if menu_tags:
+                invalidate_tags(*menu_tags)
 
     def delete_watchlater_online(self, asset_id):
         """Delete watchLater status online"""
@@ -6,30 +6,68 @@ from __future__ import absolute_import, division, unicode_literals
 from xbmc import Monitor
 from apihelper import ApiHelper
 from favorites import Favorites
-from kodiutils import container_refresh, invalidate_caches, log
+from kodiutils import (addon_id, collect_cache_garbage, container_refresh, invalidate_tags, log, reset_network_config, revalidate_cache,
+                       set_background)
 from playerinfo import PlayerInfo
 from resumepoints import ResumePoints
 from tokenresolver import TokenResolver
 from utils import to_unicode
 
+CACHE_GC_INTERVAL = 60 * 60  # Seconds between cache garbage collections
+WARMUP_INTERVAL = 60  # Seconds between checks for cache entries that expire soon
+
 
 class VrtMonitor(Monitor, object):  # pylint: disable=useless-object-inheritance
     """This is the class that monitors Kodi for the VRT NU video plugin"""
 
     def __init__(self):
         """VRT Monitor initialisation"""
+        set_background(True)
         self._resumepoints = ResumePoints()
         self._playerinfo = None
         self._favorites = None
         self._apihelper = None
+        self._revalidating = set()
+        self._warmer = None
+        self._warming_up = False
         self.init_watching_activity()
         super(VrtMonitor, self).__init__()
 
     def run(self):
         """Main loop"""
+        from time import time
+        next_gc = time() + 60  # Leave Kodi some time to start up
+        next_warmup = time() + 30
         while not self.abortRequested():
             if self.waitForAbort(10):
                 break
+            if time() >= next_gc:
+                collect_cache_garbage()
+                next_gc = time() + CACHE_GC_INTERVAL
+            if time() >= next_warmup:
+                self.warm_up()
+                next_warmup = time() + WARMUP_INTERVAL
+
+    def warm_up(self):
+        """Refresh the caches of the main menus in a background thread, unless that is still running"""
+        if self._warming_up:
+            return
+        if not self._warmer:
+            from warmup import CacheWarmer
+            self._warmer = CacheWarmer()
+        self._warming_up = True
+
+        def warm_up():
+            """Refresh the cache entries that expire soon"""
+            try:
+                self._warmer.warm_up(self.abortRequested)
+            finally:
+                self._warming_up = False
+
+        from threading import Thread
+        thread = Thread(target=warm_up, name='CacheWarmUp')
+        thread.daemon = True
+        thread.start()
 
     def init_watching_activity(self):
         """Only load components for watching activity when needed"""
@@ -48,6 +86,12 @@ class VrtMonitor(Monitor, object):  # pylint: disable=useless-object-inheritance
         """Handler for notifications"""
         # log(2, '[Notification] sender={sender}, method={method}, data={data}', sender=sender, method=method, data=to_unicode(data))
 
+        # Refresh caches that a plugin invocation served stale
+        if sender == addon_id() and method.endswith('revalidate_cache'):
+            from json import loads
+            self.revalidate_cache(**loads(data))
+            return
+
         # Handle play_action events from upnextprovider
         if sender.startswith('upnextprovider') and method.endswith('plugin.video.vrt.nu_play_action'):
             from json import loads
@@ -62,13 +106,32 @@ class VrtMonitor(Monitor, object):  # pylint: disable=useless-object-inheritance
             log(2, '[Up Next notification] sender={sender}, method={method}, data={data}', sender=sender, method=method, data=to_unicode(data))
             self._playerinfo.add_upnext(data.get('video_id'))
 
+    def revalidate_cache(self, url, cache, headers=None, tags=None, ttl=None):
+        """Refresh a cache entry in a background thread, unless it is being refreshed already"""
+        if cache in self._revalidating:
+            return
+        self._revalidating.add(cache)
+
+        def revalidate():
+            """Refresh the cache entry"""
+            try:
+                revalidate_cache(url, cache, headers, tags, ttl)
+            finally:
+                self._revalidating.discard(cache)
+
+        from threading import Thread
+        thread = Thread(target=revalidate)
+        thread.daemon = True
+        thread.start()
+
     def onSettingsChanged(self):  # pylint: disable=invalid-name
         """Handler for changes to settings"""
 
         log(1, 'Settings changed')
+        reset_network_config()
         TokenResolver().refresh_login()
 
-        invalidate_caches('continue-*.json', 'favorites.json', 'my-offline-*.json', 'my-recent-*.json', 'resume_points.json', 'watchlater-*.json')
+        invalidate_tags('account', 'favorites', 'resumepoints', 'watchlater')
 
         # Init watching activity again when settings change
         self.init_watching_activity()
@@ -13,7 +13,7 @@ except ImportError:  # Python 2
 
 from helperobjects import ApiData, StreamURLS
 from kodiutils import (addon_profile, can_play_drm, container_reload, exists, end_of_directory, generate_expiration_date, get_cache,
-                       get_max_bandwidth, get_setting_bool, get_url_json, has_inputstream_adaptive, invalidate_caches, kodi_version_major,
+                       get_max_bandwidth, get_setting_bool, get_url_json, has_inputstream_adaptive, invalidate_tags, kodi_version_major,
                        localize, log, log_error, mkdir, ok_dialog, open_settings, open_url, supports_drm, to_unicode, update_cache)
 
 
@@ -308,8 +308,8 @@ class StreamService:
             message = localize(30964)  # Geoblock error: Cannot be played, need Belgian phone number validation
             return self._handle_stream_api_error(message, stream_json)
         if stream_json.get('code') == 'VIDEO_NOT_FOUND':
-            # Refresh listing
-            invalidate_caches('*.json')
+            # Refresh episode listings, the video may have been removed from the catalog
+            invalidate_tags('episodes')
             container_reload()
             message = localize(30987)  # No stream found
             return self._handle_stream_api_error(message, stream_json)
@@ -4,9 +4,9 @@
 
 from __future__ import absolute_import, division, unicode_literals
 from kodiutils import (addon_profile, delete, delete_cache, exists, get_cache, get_cache_dir, get_setting, open_url,
-                       get_url_json, has_credentials, invalidate_caches, listdir,
+                       get_url_json, has_credentials, invalidate_tags, listdir,
                        localize, log, log_error, notification, ok_dialog,
-                       open_settings, set_setting, update_cache)
+                       open_settings, set_setting, single_flight, update_cache)
 from utils import from_unicode
 
 try:  # Python 3
@@ -213,6 +213,17 @@ class TokenResolver:
             token = get_cache(cache_file, cache_dir=self._TOKEN_CACHE_DIR)
             if token:
                 return token.get(name)
+            # Let only one process get a new token, other processes wait for it
+            with single_flight(self._TOKEN_GATEWAY_URL, cache_file) as lock:
+                if lock.waited:
+                    token = get_cache(cache_file, cache_dir=self._TOKEN_CACHE_DIR)
+                    if token:
+                        return token.get(name)
+                return self._get_uncached_token(name, variant, url, roaming)
+        return self._get_uncached_token(name, variant, url, roaming)
+
+    def _get_uncached_token(self, name, variant=None, url=None, roaming=False):
+        """Refresh a token or get a new token"""
         # Try to refresh a token
         if variant != 'roaming' and name in ('X-VRT-Token', 'vrtlogin-at', 'vrtlogin-rt'):
             cache_file = self._get_token_filename('vrtlogin-rt')
@@ -304,7 +315,7 @@ class TokenResolver:
         self.delete_tokens()
 
         # Delete user-related caches
-        invalidate_caches('continue-*.json', 'favorites.json', 'my-offline-*.json', 'my-recent-*.json', 'resume_points.json', 'watchlater-*.json')
+        invalidate_tags('account', 'favorites', 'resumepoints', 'watchlater')
 
     def logged_in(self):
         """Whether there is an active login"""
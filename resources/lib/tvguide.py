@@ -5,6 +5,7 @@
 
 from __future__ import absolute_import, division, unicode_literals
 from datetime import datetime, timedelta
+from functools import partial
 import dateutil.parser
 import dateutil.tz
 
@@ -12,7 +13,7 @@ from data import CHANNELS, RELATIVE_DATES
 from favorites import Favorites
 from helperobjects import TitleItem
 from kodiutils import (colour, get_cached_url_json, get_url_json, has_addon, localize,
-                       localize_datelong, show_listing, themecolour, ttl, url_for)
+                       localize_datelong, run_concurrently, show_listing, themecolour, ttl, url_for)
 from metadata import Metadata
 from resumepoints import ResumePoints
 from utils import add_https_proto, find_entry, html_to_kodi, url_to_program
@@ -154,14 +155,18 @@ class TVGuide:
         epg = self.parse(date, now)
         epg_url = epg.strftime(self.VRT_TVGUIDE)
 
-        self._favorites.refresh(ttl=ttl('indirect'))
-        self._resumepoints.refresh(ttl=ttl('indirect'))
-
         cache_file = 'schedule.{date}.json'.format(date=date)
         if date in ('today', 'yesterday', 'tomorrow'):
-            schedule = get_cached_url_json(url=epg_url, cache=cache_file, ttl=ttl('indirect'), fail={})
+            get_schedule = partial(get_cached_url_json, url=epg_url, cache=cache_file, ttl=ttl('indirect'), fail={}, tags=['epg:' + date])
         else:
-            schedule = get_url_json(url=epg_url, fail={})
+            get_schedule = partial(get_url_json, url=epg_url, fail={})
+
+        # Get the schedule while refreshing favorites and resumepoints
+        _, _, schedule = run_concurrently(
+            partial(self._favorites.refresh, ttl=ttl('indirect')),
+            partial(self._resumepoints.refresh, ttl=ttl('indirect')),
+            get_schedule,
+        )
 
         entry = find_entry(CHANNELS, 'name', channel)
         if entry:
@@ -247,20 +252,23 @@ class TVGuide:
                     ))
         return epg_data
 
-    def playing_now(self, channel):
-        """Return the EPG information for what is playing now"""
-        now = datetime.now(dateutil.tz.tzlocal())
-        epg = now
+    def get_today_schedule(self):
+        """Return the EPG information of today for all channels"""
+        epg = datetime.now(dateutil.tz.tzlocal())
         # Daily EPG information shows information from 6AM until 6AM
         if epg.hour < 6:
             epg += timedelta(days=-1)
+        epg_url = epg.strftime(self.VRT_TVGUIDE)
+        return get_cached_url_json(url=epg_url, cache='schedule.today.json', ttl=ttl('indirect'), fail={}, tags=['epg:today'])
 
+    def playing_now(self, channel):
+        """Return the EPG information for what is playing now"""
+        now = datetime.now(dateutil.tz.tzlocal())
         entry = find_entry(CHANNELS, 'name', channel)
         if not entry:
             return ''
 
-        epg_url = epg.strftime(self.VRT_TVGUIDE)
-        schedule = get_cached_url_json(url=epg_url, cache='schedule.today.json', ttl=ttl('indirect'), fail={})
+        schedule = self.get_today_schedule()
         episodes = iter(schedule.get(entry.get('id'), []))
 
         while True:
@@ -282,17 +290,11 @@ class TVGuide:
     def live_description(self, channel):
         """Return the EPG information for current and next live program"""
         now = datetime.now(dateutil.tz.tzlocal())
-        epg = now
-        # Daily EPG information shows information from 6AM until 6AM
-        if epg.hour < 6:
-            epg += timedelta(days=-1)
-
         entry = find_entry(CHANNELS, 'name', channel)
         if not entry:
             return ''
 
-        epg_url = epg.strftime(self.VRT_TVGUIDE)
-        schedule = get_cached_url_json(url=epg_url, cache='schedule.today.json', ttl=ttl('indirect'), fail={})
+        schedule = self.get_today_schedule()
         episodes = iter(schedule.get(entry.get('id'), []))
 
         description = ''
@@ -7,8 +7,10 @@ import re
 
 try:  # Python 3
     from html import unescape
+    from urllib.parse import urlsplit, urlunsplit
 except ImportError:  # Python 2
     from HTMLParser import HTMLParser
+    from urlparse import urlsplit, urlunsplit
 
     def unescape(string):
         """Expose HTMLParser's unescape"""
@@ -247,3 +249,32 @@ def youtube_to_plugin_url(url):
     if not url.endswith('/'):
         url += '/'
     return url
+
+
+def merge_sorted(lists, key, reverse=False):
+    """Merge lists that are each sorted by key into one sorted list, keeping the order within every list"""
+    merged = []
+    positions = [0] * len(lists)
+    while True:
+        best = None
+        for index, items in enumerate(lists):
+            if positions[index] >= len(items):
+                continue
+            if best is None:
+                best = index
+                continue
+            candidate, current = key(items[positions[index]]), key(lists[best][positions[best]])
+            # On equal keys the earlier list goes first
+            if (candidate > current) if reverse else (candidate < current):
+                best = index
+        if best is None:
+            return merged
+        merged.append(lists[best][positions[best]])
+        positions[best] += 1
+
+
+def canonical_url(url):
+    """Normalize a URL, so identical requests have identical URLs"""
+    scheme, netloc, path, query, _ = urlsplit(url)
+    query = '&'.join(sorted(param for param in query.split('&') if param))
+    return urlunsplit((scheme.lower(), netloc.lower(), path or '/', query, ''))
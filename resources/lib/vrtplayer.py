@@ -3,13 +3,14 @@
 """Implements a VRTPlayer class"""
 
 from __future__ import absolute_import, division, unicode_literals
+from functools import partial
 from apihelper import ApiHelper
 from favorites import Favorites
 from helperobjects import TitleItem
 from kodiutils import (colour, delete_cached_thumbnail, end_of_directory, get_addon_info,
                        get_setting, get_setting_bool, get_setting_int, has_credentials,
                        has_inputstream_adaptive, localize, kodi_version_major, log_error,
-                       ok_dialog, play, set_setting, show_listing, ttl, url_for,
+                       ok_dialog, play, run_concurrently, set_setting, show_listing, ttl, url_for,
                        wait_for_resumepoints)
 from resumepoints import ResumePoints
 from utils import find_entry, realpage
@@ -25,6 +26,10 @@ class VRTPlayer:
         self._apihelper = ApiHelper(self._favorites, self._resumepoints)
         wait_for_resumepoints()
 
+    def refresh_userdata(self, kind='indirect'):
+        """Refresh favorites and resumepoints concurrently"""
+        run_concurrently(partial(self._favorites.refresh, ttl=ttl(kind)), partial(self._resumepoints.refresh, ttl=ttl(kind)))
+
     def show_main_menu(self):
         """The VRT NU add-on main menu"""
         # self._favorites.refresh(ttl=ttl('indirect'))
@@ -185,31 +190,27 @@ class VRTPlayer:
 
     def show_favorites_docu_menu(self):
         """The VRT NU add-on 'My documentaries' listing menu"""
-        self._favorites.refresh(ttl=ttl('indirect'))
-        self._resumepoints.refresh(ttl=ttl('indirect'))
+        self.refresh_userdata(kind='indirect')
         episode_items, sort, ascending, content = self._apihelper.list_episodes(category='docu', season='allseasons', programtype='oneoff')
         show_listing(episode_items, category=30044, sort=sort, ascending=ascending, content=content, cache=False)
 
     def show_favorites_music_menu(self):
         """The VRT NU add-on 'My music' listing menu"""
-        self._favorites.refresh(ttl=ttl('indirect'))
-        self._resumepoints.refresh(ttl=ttl('indirect'))
+        self.refresh_userdata(kind='indirect')
         episode_items, sort, ascending, content = self._apihelper.list_episodes(category='muziek', season='allseasons', programtype='oneoff')
         show_listing(episode_items, category=30046, sort=sort, ascending=ascending, content=content, cache=False)
 
     def show_tvshow_menu(self, use_favorites=False):
         """The VRT NU add-on 'All programs' listing menu"""
         # My favorites menus may need more up-to-date favorites
-        self._favorites.refresh(ttl=ttl('direct' if use_favorites else 'indirect'))
-        self._resumepoints.refresh(ttl=ttl('direct' if use_favorites else 'indirect'))
+        self.refresh_userdata(kind='direct' if use_favorites else 'indirect')
         tvshow_items = self._apihelper.list_tvshows(use_favorites=use_favorites)
         show_listing(tvshow_items, category=30440, sort='label', content='tvshows')  # A-Z
 
     def show_category_menu(self, category=None):
         """The VRT NU add-on 'Categories' listing menu"""
         if category:
-            self._favorites.refresh(ttl=ttl('indirect'))
-            self._resumepoints.refresh(ttl=ttl('indirect'))
+            self.refresh_userdata(kind='indirect')
             tvshow_items = self._apihelper.list_tvshows(category=category)
             from data import CATEGORIES
             category_msgctxt = find_entry(CATEGORIES, 'id', category).get('msgctxt')
@@ -222,8 +223,7 @@ class VRTPlayer:
         """The VRT NU add-on 'Channels' listing menu"""
         if channel:
             from tvguide import TVGuide
-            self._favorites.refresh(ttl=ttl('indirect'))
-            self._resumepoints.refresh(ttl=ttl('indirect'))
+            self.refresh_userdata(kind='indirect')
             channel_items = self._apihelper.list_channels(channels=[channel])  # Live TV
             channel_items.extend(TVGuide().get_channel_items(channel=channel))  # TV guide
             channel_items.extend(self._apihelper.list_youtube(channels=[channel]))  # YouTube
@@ -238,14 +238,16 @@ class VRTPlayer:
     def show_featured_menu(self, feature=None):
         """The VRT NU add-on 'Featured content' listing menu"""
         if feature:
-            self._favorites.refresh(ttl=ttl('indirect'))
-            self._resumepoints.refresh(ttl=ttl('indirect'))
             programs = None
             sort = 'label'
             content = 'tvshows'
             ascending = True
             if feature.startswith('jcr_'):
-                media = self._apihelper.get_featured_media_from_web(feature.split('jcr_')[1])
+                _, _, media = run_concurrently(
+                    partial(self._favorites.refresh, ttl=ttl('indirect')),
+                    partial(self._resumepoints.refresh, ttl=ttl('indirect')),
+                    partial(self._apihelper.get_featured_media_from_web, feature.split('jcr_')[1]),
+                )
                 if media.get('mediatype') == 'episodes':
                     variety = 'featured.{name}'.format(name=media.get('name').strip().lower().replace(' ', '_'))
                     media_items, sort, ascending, content = self._apihelper.list_episodes(whatson_id=media.get('medialist'), variety=variety)
@@ -253,6 +255,7 @@ class VRTPlayer:
                     feature = None
                     media_items = self._apihelper.list_tvshows(feature=feature, programs=media.get('medialist'))
             else:
+                self.refresh_userdata(kind='indirect')
                 media_items = self._apihelper.list_tvshows(feature=feature, programs=programs)
             from data import FEATURED
             feature_msgctxt = None
@@ -271,8 +274,7 @@ class VRTPlayer:
 
     def show_episodes_menu(self, program, season=None):
         """The VRT NU add-on episodes listing menu"""
-        self._favorites.refresh(ttl=ttl('indirect'))
-        self._resumepoints.refresh(ttl=ttl('indirect'))
+        self.refresh_userdata(kind='indirect')
         episode_items, sort, ascending, content = self._apihelper.list_episodes(program=program, season=season)
         # FIXME: Translate program in Program Title
         show_listing(episode_items, category=program.title(), sort=sort, ascending=ascending, content=content, cache=False)
@@ -281,8 +283,7 @@ class VRTPlayer:
         """The VRT NU add-on 'Most recent' and 'My most recent' listing menu"""
 
         # My favorites menus may need more up-to-date favorites
-        self._favorites.refresh(ttl=ttl('direct' if use_favorites else 'indirect'))
-        self._resumepoints.refresh(ttl=ttl('direct' if use_favorites else 'indirect'))
+        self.refresh_userdata(kind='direct' if use_favorites else 'indirect')
         page = realpage(page)
         episode_items, sort, ascending, content = self._apihelper.list_episodes(page=page, use_favorites=use_favorites, variety='recent')
 
@@ -302,8 +303,7 @@ class VRTPlayer:
         """The VRT NU add-on 'Soon offline' and 'My soon offline' listing menu"""
 
         # My favorites menus may need more up-to-date favorites
-        self._favorites.refresh(ttl=ttl('direct' if use_favorites else 'indirect'))
-        self._resumepoints.refresh(ttl=ttl('direct' if use_favorites else 'indirect'))
+        self.refresh_userdata(kind='direct' if use_favorites else 'indirect')
         page = realpage(page)
         items_per_page = get_setting_int('itemsperpage', default=50)
         sort_key = 'assetOffTime'
@@ -326,8 +326,7 @@ class VRTPlayer:
         """The VRT NU add-on 'My watch later' listing menu"""
 
         # My watch later menu may need more up-to-date favorites
-        self._favorites.refresh(ttl=ttl('direct'))
-        self._resumepoints.refresh(ttl=ttl('direct'))
+        self.refresh_userdata(kind='direct')
         page = realpage(page)
         episode_items, sort, ascending, content = self._apihelper.list_episodes(page=page, variety='watchlater')
         show_listing(episode_items, category=30052, sort=sort, ascending=ascending, content=content, cache=False)
@@ -336,8 +335,7 @@ class VRTPlayer:
         """The VRT NU add-on 'Continue waching' listing menu"""
 
         # Continue watching menu may need more up-to-date favorites
-        self._favorites.refresh(ttl=ttl('direct'))
-        self._resumepoints.refresh(ttl=ttl('direct'))
+        self.refresh_userdata(kind='direct')
         page = realpage(page)
         episode_items, sort, ascending, content = self._apihelper.list_episodes(page=page, variety='continue')
         show_listing(episode_items, category=30054, sort=sort, ascending=ascending, content=content, cache=False)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Implements a scheduler that keeps the caches of the main menus fresh, so plugin invocations rarely wait for the network"""
+
+from __future__ import absolute_import, division, unicode_literals
+from time import time
+
+from kodiutils import cache_ttl, get_cache_age, get_cond_visibility, get_setting_bool, log, log_error, refresh_ahead, ttl
+
+WARMUP_MARGIN = 5 * 60  # Refresh cache entries this long before they expire
+WARMUP_RETRY = 15 * 60  # Do not try to refresh a cache entry again before this many seconds
+
+
+class CacheWarmer:
+    """Refreshes the cache entries every plugin invocation needs shortly before they expire, while no video is playing"""
+
+    def __init__(self):
+        """Initialize the CacheWarmer class"""
+        self._attempts = {}  # The last time a cache entry was refreshed
+
+    @staticmethod
+    def plan():
+        """Return the cache entries to keep fresh, with their time to live and the function that refreshes them"""
+        from apihelper import ApiHelper
+        from favorites import Favorites
+        from resumepoints import ResumePoints
+        from tvguide import TVGuide
+        favorites = Favorites()
+        resumepoints = ResumePoints()
+        apihelper = ApiHelper(favorites, resumepoints)
+        jobs = [
+            ('programs.json', ttl('indirect'), apihelper.get_tvshows),
+            ('categories.json', 7 * 24 * 60 * 60, apihelper.get_categories),
+            ('schedule.today.json', ttl('indirect'), TVGuide().get_today_schedule),
+        ]
+        if get_setting_bool('showoneoff', default=True):
+            jobs.append(('oneoff.json', ttl('indirect'), lambda: apihelper.get_episodes(variety='oneoff', cache_file='oneoff.json')))
+        if favorites.is_activated():
+            jobs.append(('favorites.json', ttl('indirect'), lambda: favorites.refresh(ttl=ttl('indirect'))))
+        if resumepoints.is_activated():
+            jobs.append(('resume_points_ddt.json', ttl('indirect'), lambda: resumepoints.refresh(ttl=ttl('indirect'))))
+        return jobs
+
+    def due(self, jobs, now=None):
+        """Return the jobs whose cache entry expires soon, leaving out cache entries that were never used"""
+        now = time() if now is None else now
+        due_jobs = []
+        for job in jobs:
+            cache_file, max_age, _ = job
+            age = get_cache_age(cache_file)
+            if age is None or age < cache_ttl(cache_file, max_age) - WARMUP_MARGIN:
+                continue
+            if now < self._attempts.get(cache_file, 0) + WARMUP_RETRY:
+                continue
+            due_jobs.append(job)
+        return due_jobs
+
+    @staticmethod
+    def is_idle():
+        """Whether Kodi is not playing a video, refreshing large cache entries should never make playback stutter"""
+        return not get_cond_visibility('Player.HasVideo')
+
+    def warm_up(self, abort_requested):
+        """Refresh the cache entries that expire soon, one at a time, stopping when playback starts or Kodi exits"""
+        if not get_setting_bool('usecachewarmup', default=True) or not self.is_idle():
+            return
+        jobs = self.due(self.plan())
+        for cache_file, _, refresh in jobs:
+            if abort_requested() or not self.is_idle():
+                return
+            self._attempts[cache_file] = time()
+            log(2, "Warming up cache '{cache}'", cache=cache_file)
+            try:
+                # The entry is still fresh, make it count as stale so it is refreshed now
+                with refresh_ahead(WARMUP_MARGIN):
+                    refresh()
+            except Exception as exc:  # pylint: disable=broad-except
+                log_error("Warming up cache '{cache}' failed: {exc}", cache=cache_file, exc=exc)
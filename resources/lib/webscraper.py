@@ -9,7 +9,7 @@ try:  # Python 3
 except ImportError:  # Python 2
     from urllib2 import HTTPError
 
-from kodiutils import get_cache, log_error, open_url, ttl, update_cache
+from kodiutils import get_cache, get_negative_cache, log_error, modify_cache, open_url, request_skipped, ttl, update_negative_cache
 from utils import assetpath_to_id
 
 
@@ -24,7 +24,29 @@ def get_video_attributes(vrtnu_url):
     if vrtnu_url in video_attrs_multi:
         return video_attrs_multi[vrtnu_url]
 
-    # Scrape video attributes
+    # Do not scrape a page again that could not be scraped a moment ago
+    if get_negative_cache(vrtnu_url) is not None:
+        return None
+    video_attrs = scrape_video_attributes(vrtnu_url)
+    if video_attrs is None:
+        # A request that was never sent says nothing about the web page
+        if not request_skipped():
+            update_negative_cache(vrtnu_url, 'failed')
+        return None
+
+    # Update cache, keeping the video attributes other processes added in the meantime
+    def add_video_attributes(attrs_multi):
+        """Add or update the video attributes of this url"""
+        attrs_multi[vrtnu_url] = video_attrs
+        return attrs_multi
+
+    modify_cache(cache_file, add_video_attributes, default={}, ttl=ttl('indirect'))
+
+    return video_attrs
+
+
+def scrape_video_attributes(vrtnu_url):
+    """Return a dictionary with video attributes scraped from a VRT NU web page, or None"""
     from bs4 import BeautifulSoup, SoupStrainer
     try:
         response = open_url(vrtnu_url, raise_errors='all')
@@ -50,17 +72,6 @@ def get_video_attributes(vrtnu_url):
     except AttributeError as exc:
         log_error('Web scraping video attributes failed: {error}', error=exc)
         return None
-
-    # Update cache
-    if vrtnu_url in video_attrs_multi:
-        # Update existing
-        video_attrs_multi[vrtnu_url] = video_attrs
-    else:
-        # Create new
-        video_attrs_multi.update({vrtnu_url: video_attrs})
-    from json import dumps
-    update_cache(cache_file, dumps(video_attrs_multi))
-
     return video_attrs
 
 
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Compare reading and parsing plain, compressed and snapshot cache files of different sizes"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+from json import dumps, loads
+from timeit import default_timer
+
+# Add current working directory to import paths
+CWD = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(os.path.realpath(__file__))), os.pardir, 'resources/lib'))
+sys.path.insert(0, CWD)
+import cachecodec  # noqa: E402  pylint: disable=wrong-import-position
+import cachesnapshot  # noqa: E402  pylint: disable=wrong-import-position
+import kodiutils  # noqa: E402  pylint: disable=wrong-import-position
+
+try:  # Python 3
+    import lzma
+except ImportError:  # Python 2
+    lzma = None
+
+ROUNDS = 20
+FLASH_SPEED = 20 * 1024 * 1024  # Bytes per second read from a slow SD card, the files below are read from the page cache
+# Cache entries read by menus, with their typical number of items
+ROUTES = [
+    ('search page', 'search-300.json', 300),
+    ('oneoffs', 'oneoff.json', 1500),
+    ('tvshows A-Z', 'programs.json', 6000),
+]
+
+
+def catalog(items):
+    """Return a Search API like document with a number of episodes"""
+    return dumps(dict(
+        meta=dict(total_results=items, pages=dict(total=1, current=1, size=items)),
+        results=[dict(
+            videoId='vid-%08d' % index,
+            program='programma-%d' % (index % 150),
+            title='Aflevering %d van programma %d' % (index, index % 150),
+            description='Een beschrijving van aflevering %d, met wat meer tekst zoals in de VRT NU catalogus.' % index,
+            assetOnTime='2020-03-%02dT20:00:00+01:00' % (index % 28 + 1),
+            duration=index % 60 + 10,
+            url='//www.vrt.be/vrtnu/a-z/programma-%d/2020/aflevering-%d/' % (index % 150, index),
+            videoThumbnailUrl='//images.vrt.be/orig/2020/03/%08d.jpg' % index,
+        ) for index in range(items)],
+    ))
+
+
+def encoders():
+    """Return the ways to store a cache entry"""
+    options = [
+        ('plain', lambda text: text.encode('utf-8')),
+        ('zlib', lambda text: zlib.compress(text.encode('utf-8'), 6)),
+    ]
+    if lzma:
+        options.append(('lzma', lambda text: lzma.compress(text.encode('utf-8'), preset=1)))
+    options.append(('auto', cachecodec.encode))
+    return options
+
+
+def measure(func):
+    """Return the average duration of a call in milliseconds"""
+    start = default_timer()
+    for _ in range(ROUNDS):
+        func()
+    return (default_timer() - start) * 1000 / ROUNDS
+
+
+def read_and_parse(path):
+    """Read a cache file and parse it, as get_cache() does"""
+    with open(path, 'rb') as fdesc:
+        return loads(cachecodec.decode(fdesc.read()))
+
+
+def benchmark():
+    """Print the size, write time and read time of every way to store entries of different sizes"""
+    tempdir = tempfile.mkdtemp()
+    try:
+        print('%-8s %-6s %10s %10s %10s %10s' % ('items', 'format', 'bytes', 'write ms', 'read ms', 'flash ms'))
+        for items in (10, 200, 2000, 10000):
+            text = catalog(items)
+            for name, encode in encoders():
+                path = os.path.join(tempdir, '%s-%d.json' % (name, items))
+                data = encode(text)
+                if not isinstance(data, bytes):
+                    data = data.encode('utf-8')
+
+                def write(path=path, encode=encode, text=text):
+                    """Encode and write a cache file"""
+                    data = encode(text)
+                    with open(path, 'wb') as fdesc:
+                        fdesc.write(data if isinstance(data, bytes) else data.encode('utf-8'))
+
+                write_time = measure(write)
+                read_time = measure(lambda path=path: read_and_parse(path))
+                flash_time = read_time + len(data) * 1000 / FLASH_SPEED
+                print('%-8d %-6s %10d %10.2f %10.2f %10.2f' % (items, name, len(data), write_time, read_time, flash_time))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def read_snapshot(path, version):
+    """Read a snapshot and load it, as get_cache() does"""
+    with open(path, 'rb') as fdesc:
+        return cachesnapshot.loads(fdesc.read(), version)
+
+
+def benchmark_snapshots():
+    """Print the parse time saved per route by loading a snapshot instead of the JSON"""
+    tempdir = tempfile.mkdtemp()
+    try:
+        print('%-12s %-16s %10s %10s %10s %10s %10s' % ('route', 'cache', 'json ms', 'snap ms', 'saved ms', 'json flash', 'snap flash'))
+        for route, cache_file, items in ROUTES:
+            text = catalog(items)
+            json_path = os.path.join(tempdir, cache_file)
+            with open(json_path, 'wb') as fdesc:
+                fdesc.write(text.encode('utf-8'))
+            # Snapshots are valid for the content hash and size of the JSON entry, as in get_cache()
+            version = (kodiutils.content_hash(text), os.path.getsize(json_path))
+            snapshot = cachesnapshot.dumps(loads(text), version)
+            snapshot_path = json_path + '.snap'
+            with open(snapshot_path, 'wb') as fdesc:
+                fdesc.write(snapshot)
+            assert read_snapshot(snapshot_path, version) == read_and_parse(json_path)
+            json_time = measure(lambda path=json_path: read_and_parse(path))
+            snapshot_time = measure(lambda path=snapshot_path, version=version: read_snapshot(path, version))
+            print('%-12s %-16s %10.2f %10.2f %10.2f %10.2f %10.2f' % (
+                route, cache_file, json_time, snapshot_time, json_time - snapshot_time,
+                json_time + version[1] * 1000 / FLASH_SPEED, snapshot_time + len(snapshot) * 1000 / FLASH_SPEED))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    benchmark()
+    print()
+    benchmark_snapshots()
@@ -98,6 +98,17 @@ class TestApiHelper(unittest.TestCase):
         episode_items = self._apihelper.list_episodes(whatson_id=['922554855527', '922554851527'], variety='featured.episodes')
         self.assertTrue(episode_items)
 
+    def test_search_url_sharding(self):
+        """Test splitting long facet lists over multiple Search API urls"""
+        video_ids = ['vid-%08d-0000-0000-0000-000000000000' % number for number in range(500)]
+        params = {'i': 'video', 'size': '300', 'facets[videoId]': '[%s]' % ','.join(video_ids)}
+        search_urls = self._apihelper.get_search_urls(params)
+        self.assertTrue(len(search_urls) > 1)
+        self.assertTrue(all(len(url) <= ApiHelper._VRTNU_SEARCH_URL_MAX_LENGTH for url in search_urls))  # pylint: disable=protected-access
+        self.assertEqual(sum(url.count('vid-') for url in search_urls), len(video_ids))
+        params['facets[videoId]'] = '[%s]' % ','.join(video_ids[:10])
+        self.assertEqual(len(self._apihelper.get_search_urls(params)), 1)
+
     def test_get_tvshows(self):
         """Test get tvshows (humor)"""
         category = 'humor'
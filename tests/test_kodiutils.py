@@ -5,9 +5,22 @@
 # pylint: disable=invalid-name,line-too-long
 
 from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import os
 import unittest
+from gzip import GzipFile
+from io import BytesIO
+from threading import Event, Thread
+from time import sleep, time
 import kodiutils
 
+try:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
 xbmc = __import__('xbmc')
 xbmcaddon = __import__('xbmcaddon')
 xbmcgui = __import__('xbmcgui')
@@ -17,12 +30,126 @@ xbmcvfs = __import__('xbmcvfs')
 addon = xbmcaddon.Addon()
 
 
+def age_cache(cache_file, age):
+    """Make a cache entry look like it was fetched age seconds ago, in either cache store"""
+    fetched = time() - age
+    store = kodiutils.cache_store()
+    if store:
+        with store.transaction() as cursor:
+            cursor.execute('UPDATE entries SET fetched = ? WHERE key = ?', (fetched, cache_file))
+    else:
+        os.utime(kodiutils.get_cache_path(cache_file), (fetched, fetched))
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """A local HTTP/1.1 server with persistent connections"""
+
+    protocol_version = 'HTTP/1.1'
+    unavailable = 0
+    hedge = 0
+    empty = 0
+    cacheable = 0
+
+    def do_GET(self):
+        """Return a small JSON document"""
+        if self.path.startswith('/slow'):
+            sleep(1)
+        if self.path.startswith('/hedge'):
+            LocalHandler.hedge += 1
+            if LocalHandler.hedge == 1:
+                sleep(1)
+        if self.path.startswith('/empty'):
+            LocalHandler.empty += 1
+        if self.path.startswith('/cacheable'):
+            LocalHandler.cacheable += 1
+        if self.path.startswith('/unavailable'):
+            LocalHandler.unavailable += 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path.startswith('/etag') and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps(dict(path=self.path)).encode()
+        if self.path.startswith('/empty'):
+            body = json.dumps(dict(results=[])).encode()
+        if self.path.startswith('/gzip'):
+            body = json.dumps(dict(path=self.path, items=['item'] * 1000)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if self.path.startswith('/gzip') and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            fileobj = BytesIO()
+            with GzipFile(fileobj=fileobj, mode='wb') as fdesc:
+                fdesc.write(body)
+            body = fileobj.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path.startswith('/etag'):
+            self.send_header('ETag', '"v1"')
+        if self.path.startswith('/cacheable/max-age'):
+            self.send_header('Cache-Control', 'public, max-age=86400')
+            self.send_header('Age', '600')
+        if self.path.startswith('/cacheable/no-cache'):
+            self.send_header('Cache-Control', 'no-cache')
+        if self.path.startswith('/cacheable/expires'):
+            from email.utils import formatdate
+            now = time()
+            self.send_header('Date', formatdate(now, usegmt=True))
+            self.send_header('Expires', formatdate(now + 1800, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        """Return the path of a write"""
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps(dict(path=self.path)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the test output clean"""
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+    """A threaded local HTTP server"""
+
+    daemon_threads = True
+
+
 class TestKodiUtils(unittest.TestCase):
     """TestCase class"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Start a local HTTP server"""
+        cls.server = LocalServer(('127.0.0.1', 0), LocalHandler)
+        cls.url = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        cls.thread = Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the local HTTP server"""
+        kodiutils.connection_pool().close()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """Remember the add-on settings, tests change them"""
+        self.settings = dict(addon.settings)
+
     def tearDown(self):
         """Clean up function for TestCase class"""
         xbmc.settings['debug.showloginfo'] = True
+        addon.settings.clear()
+        addon.settings.update(self.settings)
         addon.settings['max_log_level'] = '3'
 
     def test_localize(self):
@@ -94,6 +221,646 @@ class TestKodiUtils(unittest.TestCase):
         self.assertTrue(isinstance(ret, list))
         self.assertEqual(len(ret), 2)
 
+    def test_connection_pool(self):
+        """Test reusing persistent HTTP connections"""
+        stats = kodiutils.connection_pool().stats()
+        for path in ('/one', '/two', '/three'):
+            self.assertEqual(kodiutils.get_url_json(self.url + path), dict(path=path))
+        new_stats = kodiutils.connection_pool().stats()
+        self.assertEqual(new_stats.get('requests') - stats.get('requests'), 3)
+        self.assertGreaterEqual(new_stats.get('reused') - stats.get('reused'), 2)
+        kodiutils.log_http_stats()
+
+    def test_connection_pool_overflow(self):
+        """Test that a full pool does not close connections whose response is still being read"""
+        from connectionpool import ConnectionPool
+        try:  # Python 3
+            from http.client import HTTPConnection
+        except ImportError:  # Python 2
+            from httplib import HTTPConnection
+        pool = ConnectionPool(maxsize=1)
+        key = ('HTTPConnection', self.server.server_address, None)
+        responses = []
+        for path in ('/one', '/two'):
+            conn = HTTPConnection(*self.server.server_address)
+            conn.request('GET', path)
+            responses.append(conn.getresponse())
+            pool.release(key, conn, responses[-1])
+        self.assertEqual([json.loads(response.read().decode()) for response in responses], [dict(path='/one'), dict(path='/two')])
+        conn = pool.acquire(key)
+        self.assertIsNotNone(conn)
+        self.assertEqual(pool.stats().get('discarded'), 1)
+        conn.close()
+        pool.close()
+
+    def test_cache_revalidation(self):
+        """Test revalidating a stale cache using HTTP validators"""
+        cache_file = 'test_revalidation.json'
+        for usesqlitecache in (False, True):
+            kodiutils.set_setting_bool('usesqlitecache', usesqlitecache)
+            kodiutils.delete_cache(cache_file)
+            self.assertEqual(kodiutils.get_cached_url_json(self.url + '/etag', cache_file, ttl=0), dict(path='/etag'))
+            self.assertEqual(kodiutils.get_cache_meta(cache_file), dict(etag='"v1"', ttl=0))
+            self.assertEqual(kodiutils.conditional_headers(cache_file), {'If-None-Match': '"v1"'})
+            # A 304 Not Modified response returns the cached copy and extends its freshness
+            age_cache(cache_file, 60)
+            self.assertEqual(kodiutils.get_cached_url_json(self.url + '/etag', cache_file, ttl=30), dict(path='/etag'))
+            self.assertLess(kodiutils.get_cache_age(cache_file), 30)
+            # New content drops the validators
+            kodiutils.update_cache(cache_file, json.dumps(dict(path='/other')))
+            self.assertEqual(kodiutils.get_cache_meta(cache_file), {})
+            kodiutils.delete_cache(cache_file)
+            self.assertEqual(kodiutils.get_cache_meta(cache_file), {})
+        self.assertFalse(kodiutils.exists(kodiutils.get_cache_path(cache_file + '.meta')))
+
+    def test_compressed_transfer(self):
+        """Test negotiating and decompressing gzip responses"""
+        import httpstats
+        httpstats.start(route='/test')
+        self.assertEqual(kodiutils.get_url_json(self.url + '/gzip'), dict(path='/gzip', items=['item'] * 1000))
+        totals = httpstats.summary().get('totals')
+        self.assertEqual(totals.get('responses'), 1)
+        self.assertLess(totals.get('wire_bytes'), totals.get('body_bytes'))
+        kodiutils.log_http_stats()
+
+    def test_parallel_requests(self):
+        """Test fetching multiple urls in parallel, in order"""
+        paths = ['/page%d' % page for page in range(10)]
+        results = kodiutils.get_urls_json([self.url + path for path in paths])
+        self.assertEqual(results, [dict(path=path) for path in paths])
+        self.assertEqual(kodiutils.run_parallel(lambda item: item * 2, range(5), workers=3), [0, 2, 4, 6, 8])
+
+    def test_single_flight(self):
+        """Test waiting for another process fetching the same url"""
+        leader = kodiutils.single_flight(self.url + '/lock', 'test_lock.json')
+        self.assertTrue(leader.acquire())
+        follower = kodiutils.single_flight(self.url + '/lock', 'test_lock.json', max_wait=0.2)
+        self.assertFalse(follower.acquire())
+        self.assertTrue(follower.waited)
+        leader.release()
+        self.assertTrue(follower.acquire())
+        follower.release()
+        # A lock file left behind by a crashed process is broken
+        leader.acquire()
+        os.utime(leader.path, (time() - 60, time() - 60))
+        with kodiutils.single_flight(self.url + '/lock', 'test_lock.json', max_wait=0.2) as lock:
+            self.assertTrue(lock.locked)
+            # The process that held the lock too long does not release the lock that was taken over
+            leader.release()
+            self.assertTrue(os.path.exists(lock.path))
+        self.assertFalse(os.path.exists(lock.path))
+
+    def test_modify_cache_locked(self):
+        """Test not writing a cache entry that another process keeps locked"""
+        cache_file = 'test_modify_locked.json'
+        kodiutils.update_cache(cache_file, json.dumps(dict(count=1)))
+        lock = kodiutils.cache_lock(cache_file)
+        self.assertTrue(lock.acquire())
+        self.assertEqual(kodiutils.modify_cache(cache_file, lambda data: dict(count=data.get('count') + 1)), dict(count=2))
+        # The cache entry is dropped, so the next read fetches the changes of both processes
+        self.assertIsNone(kodiutils.get_cache(cache_file))
+        lock.release()
+        self.assertEqual(kodiutils.modify_cache(cache_file, lambda data: dict(count=data.get('count', 0) + 1), default={}), dict(count=1))
+        kodiutils.delete_cache(cache_file)
+
+    def test_http_instrumentation(self):
+        """Test recording timing phases, cache lookups and saving a route summary"""
+        import httpstats
+        httpstats.start(route='/test')
+        kodiutils.connection_pool().close()
+        cache_file = 'test_instrumentation.json'
+        kodiutils.delete_cache(cache_file)
+        self.assertEqual(kodiutils.get_cached_url_json(self.url + '/stats?token=secret', cache_file, ttl=60), dict(path='/stats?token=secret'))
+        self.assertEqual(kodiutils.get_cached_url_json(self.url + '/stats?token=secret', cache_file, ttl=60), dict(path='/stats?token=secret'))
+        stats = httpstats.summary()
+        self.assertEqual(stats.get('requests'), 1)
+        self.assertEqual(stats.get('statuses'), {'200': 1})
+        self.assertEqual(stats.get('cache'), dict(hit=1, miss=1))
+        request = stats.get('slowest')[0]
+        self.assertNotIn('secret', request.get('url'))
+        for phase in ('connect', 'ttfb', 'body', 'decode'):
+            self.assertIn(phase, request)
+        kodiutils.log_http_stats()
+        kodiutils.delete_cache(cache_file)
+        # The statistics file is rotated when it grows too large
+        path = kodiutils.get_cache_path('test_httpstats.jsonl')
+        for _ in range(3):
+            httpstats.save(path, max_size=1)
+        self.assertTrue(os.path.exists(path + '.2'))
+        with open(path) as fdesc:
+            self.assertEqual(json.loads(fdesc.readline()).get('route'), '/test')
+        for filename in (path, path + '.1', path + '.2'):
+            os.remove(filename)
+        # A long-running process, like the service, keeps only the most recent requests
+        for _ in range(httpstats.MAX_REQUESTS + 10):
+            httpstats.record(self.url + '/stats')
+        self.assertEqual(httpstats.summary().get('requests'), httpstats.MAX_REQUESTS)
+
+    def test_run_concurrently(self):
+        """Test running independent calls concurrently"""
+        from functools import partial
+        results = kodiutils.run_concurrently(
+            partial(kodiutils.get_url_json, self.url + '/programs'),
+            partial(kodiutils.get_url_json, self.url + '/oneoffs'),
+        )
+        self.assertEqual(results, [dict(path='/programs'), dict(path='/oneoffs')])
+        with self.assertRaises(ZeroDivisionError):
+            kodiutils.run_concurrently(lambda: 1, lambda: 1 / 0)
+
+    def test_circuit_breaker(self):
+        """Test retrying failed requests and failing fast once a host keeps failing"""
+        host = self.url.split('//')[1]
+        backoff, kodiutils.RETRY_BACKOFF = kodiutils.RETRY_BACKOFF, 0.01
+        LocalHandler.unavailable = 0
+        for _ in range(kodiutils.CIRCUIT_FAILURES):
+            self.assertIsNone(kodiutils.get_url_json(self.url + '/unavailable'))
+        self.assertEqual(LocalHandler.unavailable, kodiutils.CIRCUIT_FAILURES * kodiutils.RETRY_ATTEMPTS)
+        self.assertTrue(kodiutils.circuit_is_open(host))
+        # Requests fail fast without reaching the host
+        self.assertIsNone(kodiutils.get_url_json(self.url + '/available'))
+        self.assertEqual(LocalHandler.unavailable, kodiutils.CIRCUIT_FAILURES * kodiutils.RETRY_ATTEMPTS)
+        # After the cooldown a successful request closes the circuit
+        kodiutils.set_circuit(host, dict(kodiutils.get_circuit(host), opened=time() - kodiutils.CIRCUIT_COOLDOWN))
+        self.assertEqual(kodiutils.get_url_json(self.url + '/available'), dict(path='/available'))
+        self.assertFalse(kodiutils.circuit_is_open(host))
+        self.assertEqual(kodiutils.get_circuit(host), {})
+        kodiutils.RETRY_BACKOFF = backoff
+
+    def test_latency_budget(self):
+        """Test failing fast and falling back to a stale cache once the latency budget is spent"""
+        cache_file = 'test_budget.json'
+        for usesqlitecache in (False, True):
+            kodiutils.set_setting_bool('usesqlitecache', usesqlitecache)
+            kodiutils.update_cache(cache_file, json.dumps(dict(path='/cached')))
+            kodiutils.set_deadline(0.3)
+            start = time()
+            self.assertEqual(kodiutils.get_cached_url_json(self.url + '/slow', cache_file, ttl=0), dict(path='/cached'))
+            self.assertLess(time() - start, 0.9)
+            self.assertIsNone(kodiutils.get_url_json(self.url + '/slow'))
+            kodiutils.delete_cache(cache_file)
+        # Writes are never skipped
+        self.assertEqual(kodiutils.get_url_json(self.url + '/write', data=b'{}'), dict(path='/write'))
+        # Time spent in modal dialogs does not count
+        kodiutils.set_deadline(0.3)
+        with kodiutils.suspend_deadline():
+            self.assertEqual(kodiutils.request_timeout(), kodiutils.HTTP_TIMEOUT)
+            sleep(0.4)
+        self.assertGreater(kodiutils.remaining_budget(), 0.2)
+        # Worker threads get the latency budget of the route, a dialog in one worker does not stop it for other threads
+        budgets = kodiutils.run_concurrently(kodiutils.remaining_budget, kodiutils.remaining_budget)
+        self.assertTrue(all(0 < budget <= 0.3 for budget in budgets))
+        suspended, resume = Event(), Event()
+
+        def dialog():
+            """Keep the latency budget suspended until the main thread checked its own budget"""
+            with kodiutils.suspend_deadline():
+                suspended.set()
+                resume.wait(5)
+        thread = Thread(target=kodiutils.inherit_deadline(dialog))
+        thread.start()
+        suspended.wait(5)
+        self.assertIsNotNone(kodiutils.remaining_budget())
+        resume.set()
+        thread.join()
+        kodiutils.set_deadline(None)
+        self.assertEqual(kodiutils.request_timeout(), kodiutils.HTTP_TIMEOUT)
+        kodiutils.circuit_success(self.url.split('//')[1])
+
+    def test_network_config(self):
+        """Test resolving the Kodi proxy settings only once"""
+        import httpstats
+        httpstats.start(route='/test')
+        xbmc.settings['network.usehttpproxy'] = True
+        xbmc.settings['network.httpproxytype'] = 0
+        xbmc.settings['network.httpproxyserver'] = 'localhost'
+        xbmc.settings['network.httpproxyport'] = '8899'
+        kodiutils.reset_network_config()
+        proxies = dict(http='http://localhost:8899', https='http://localhost:8899')
+        self.assertEqual(kodiutils.get_proxies(), proxies)
+        xbmc.settings['network.usehttpproxy'] = False
+        self.assertEqual(kodiutils.get_proxies(), proxies)
+        self.assertEqual(httpstats.summary().get('counters'), dict(jsonrpc_saved=6))
+        kodiutils.reset_network_config()
+        self.assertIsNone(kodiutils.get_proxies())
+
+    def test_hedged_requests(self):
+        """Test sending a second request when the first one is slower than usual"""
+        import httpstats
+        httpstats.start(route='/test')
+        host = self.url.split('//')[1]
+        LocalHandler.hedge = 0
+        kodiutils.set_property('vrtnu_latency_' + host, json.dumps([0.05] * kodiutils.HEDGE_MIN_SAMPLES))
+        kodiutils.set_setting_bool('usehedgedrequests', True)
+        discarded = kodiutils.connection_pool().stats().get('discarded')
+        start = time()
+        self.assertEqual(kodiutils.get_url_json(self.url + '/hedge'), dict(path='/hedge'))
+        self.assertLess(time() - start, 0.9)
+        self.assertEqual(LocalHandler.hedge, 2)
+        counters = httpstats.summary().get('hosts').get(host)
+        self.assertEqual((counters.get('hedged'), counters.get('hedge_wins')), (1, 1))
+        # The losing response is cancelled, its connection is not reused
+        sleep(1.2)
+        self.assertGreater(kodiutils.connection_pool().stats().get('discarded'), discarded)
+        kodiutils.set_setting_bool('usehedgedrequests', False)
+        kodiutils.clear_property('vrtnu_latency_' + host)
+
+    def test_rate_limit(self):
+        """Test limiting the request rate to a host and keeping part of it for the user"""
+        from ratelimiter import RateLimiter
+        kodiutils.clear_property('vrtnu_ratelimit_test')
+        limiter = RateLimiter('vrtnu_ratelimit_test', rate=10, burst=2)
+        start = time()
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertLess(time() - start, 0.1)
+        # The bucket is empty, background work gives way while user requests wait for the next token
+        self.assertFalse(limiter.acquire(reserve=1, max_wait=0.05))
+        self.assertTrue(limiter.acquire())
+        self.assertGreater(time() - start, 0.05)
+        # The state is kept in memory, nothing is written to disk
+        self.assertFalse(os.path.exists(kodiutils.get_cache_dir('ratelimit')))
+        # Writes wait for a token, even when the latency budget is spent
+        kodiutils.set_deadline(0.001)
+        sleep(0.01)
+        self.assertTrue(kodiutils.rate_limit('test', use_budget=False))
+        kodiutils.set_deadline(None)
+        kodiutils.clear_property('vrtnu_ratelimit_test')
+
+    def test_sqlite_cache(self):
+        """Test keeping the HTTP cache in a single SQLite database"""
+        cache_file = 'test_sqlite.json'
+        kodiutils.set_setting_bool('usesqlitecache', True)
+        kodiutils.delete_cache(cache_file)
+        self.assertIsNone(kodiutils.get_cache(cache_file))
+        self.assertEqual(kodiutils.get_cached_url_json(self.url + '/etag', cache_file, ttl=0), dict(path='/etag'))
+        self.assertFalse(kodiutils.exists(kodiutils.get_cache_path(cache_file)))
+        self.assertEqual(kodiutils.get_cache_meta(cache_file), dict(etag='"v1"', ttl=0))
+        # A 304 Not Modified response extends the freshness of the cached copy
+        with kodiutils.cache_store().transaction() as cursor:
+            cursor.execute('UPDATE entries SET fetched = ? WHERE key = ?', (time() - 60, cache_file))
+        self.assertIsNone(kodiutils.get_cache(cache_file, ttl=30))
+        self.assertEqual(kodiutils.get_cached_url_json(self.url + '/etag', cache_file, ttl=30), dict(path='/etag'))
+        self.assertEqual(kodiutils.get_cache(cache_file, ttl=30), dict(path='/etag'))
+        # Entries expire after their time-to-live, the stale grace period and the time kept for revalidation
+        with kodiutils.cache_store().transaction() as cursor:
+            expires = cursor.execute('SELECT expires FROM entries WHERE key = ?', (cache_file,)).fetchone()[0]
+        self.assertGreater(expires, time() + 30 + kodiutils.CACHE_KEEP_EXPIRED - 1)
+        self.assertGreaterEqual(kodiutils.collect_cache_garbage(now=expires + 1).get('expired'), 1)
+        self.assertIsNone(kodiutils.get_cache(cache_file))
+        kodiutils.get_cached_url_json(self.url + '/etag', cache_file, ttl=30)
+        # New content drops the validators, invalidation uses the same patterns as cache files
+        kodiutils.update_cache(cache_file, json.dumps(dict(path='/other')))
+        self.assertEqual(kodiutils.get_cache_meta(cache_file), {})
+        kodiutils.invalidate_caches('test_sql*.json')
+        self.assertIsNone(kodiutils.get_cache(cache_file))
+        kodiutils.set_setting_bool('usesqlitecache', False)
+
+    def test_sqlite_cache_store(self):
+        """Test tags and expiry of the SQLite cache store"""
+        from cachestore import SQLiteCache
+        store = SQLiteCache(':memory:')
+        store.put('a.json', '{}', expires=time() - 1, tags=['programs'])
+        store.put('b.json', '{}', tags=['programs', 'favorites'])
+        store.put('c.json', '{}', expires=time() + 60)
+        self.assertEqual(store.purge_expired(), 1)
+        self.assertTrue(store.touch('c.json', expires=time() - 1))
+        self.assertEqual(store.collect_garbage(max_size=1024, max_entries=10, max_idle=60).get('expired'), 1)
+        store.put('c.json', '{}', expires=time() + 60)
+        self.assertEqual(store.invalidate_tags('favorites'), 1)
+        self.assertIsNone(store.get('b.json'))
+        self.assertEqual(store.get('c.json')[0], '{}')
+        store.close()
+
+    def test_memory_cache(self):
+        """Test parsing a cache entry only once while it does not change"""
+        import httpstats
+        from lrucache import LRUCache
+        httpstats.start(route='/test')
+        cache_file = 'test_memory.json'
+        kodiutils.reset_memory_cache()
+        kodiutils.update_cache(cache_file, json.dumps(dict(path='/memory')))
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/memory'))
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/memory'))
+        self.assertEqual(httpstats.summary().get('counters').get('memory_hits'), 1)
+        # Changing the content a lookup returned does not change the cached content
+        json_data = kodiutils.get_cache(cache_file)
+        json_data['path'] = '/mutated'
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/memory'))
+        self.assertEqual(httpstats.summary().get('counters').get('memory_hits'), 3)
+        # Another process changed the cache file
+        with open(kodiutils.get_cache_path(cache_file), 'w') as fdesc:
+            fdesc.write(json.dumps(dict(path='/changed')))
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/changed'))
+        # Another process replaced the cache file within the same second with content of the same size
+        stat = os.stat(kodiutils.get_cache_path(cache_file))
+        with open(kodiutils.get_cache_path(cache_file), 'w') as fdesc:
+            fdesc.write(json.dumps(dict(path='/replace')))
+        with open(kodiutils.get_cache_path(cache_file + '.hash'), 'w') as fdesc:
+            fdesc.write(kodiutils.content_hash(json.dumps(dict(path='/replace'))))
+        os.utime(kodiutils.get_cache_path(cache_file), (stat.st_atime, stat.st_mtime))
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/replace'))
+        kodiutils.delete_cache(cache_file)
+        # The least recently used entries are evicted when the cache grows too large
+        lru = LRUCache(max_size=10)
+        lru.put('a', 1, 'v1', 4)
+        lru.put('b', 2, 'v1', 4)
+        self.assertEqual(lru.get('a', 'v1'), 1)
+        lru.put('c', 3, 'v1', 4)
+        self.assertIsNone(lru.get('b', 'v1'))
+        self.assertIsNone(lru.get('a', 'v2'))
+        self.assertEqual((len(lru), lru.size), (1, 4))
+
+    def test_stale_while_revalidate(self):
+        """Test serving a recently expired cache entry and refreshing it later"""
+        import httpstats
+        cache_file = 'test_stale.json'
+        kodiutils.set_setting_int('stalegrace', 5)
+        for usesqlitecache in (False, True):
+            kodiutils.set_setting_bool('usesqlitecache', usesqlitecache)
+            httpstats.start(route='/test')
+            kodiutils.update_cache(cache_file, json.dumps(dict(path='/stale')))
+            age_cache(cache_file, 60)
+            self.assertEqual(kodiutils.get_cached_url_json(self.url + '/fresh', cache_file, ttl=30), dict(path='/stale'))
+            self.assertEqual(httpstats.summary().get('counters').get('stale_served'), 1)
+            # A stale cache entry served within the grace window is not a cache hit as well
+            self.assertEqual(httpstats.summary().get('cache'), dict(stale=1))
+            kodiutils.revalidate_cache(self.url + '/fresh', cache_file)
+            self.assertEqual(kodiutils.get_cache(cache_file, ttl=30), dict(path='/fresh'))
+            # Beyond the grace window the user waits for fresh content
+            kodiutils.update_cache(cache_file, json.dumps(dict(path='/stale')))
+            age_cache(cache_file, 400)
+            self.assertEqual(kodiutils.get_cached_url_json(self.url + '/fresh', cache_file, ttl=30), dict(path='/fresh'))
+            kodiutils.delete_cache(cache_file)
+
+    def test_compressed_cache(self):
+        """Test compressing large cache entries and recognizing them when reading"""
+        import cachecodec
+        cache_file = 'test_compressed.json'
+        data = dict(items=['item %d' % index for index in range(1000)])
+        kodiutils.set_setting_bool('compresscache', True)
+        kodiutils.update_cache(cache_file, json.dumps(data))
+        with open(kodiutils.get_cache_path(cache_file), 'rb') as fdesc:
+            self.assertTrue(cachecodec.is_zlib(fdesc.read()))
+        kodiutils.reset_memory_cache()
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        kodiutils.set_setting_bool('usesqlitecache', True)
+        kodiutils.update_cache(cache_file, json.dumps(data))
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        kodiutils.delete_cache(cache_file)
+        kodiutils.set_setting_bool('usesqlitecache', False)
+        # Compressed entries can still be read after disabling compression
+        kodiutils.set_setting_bool('compresscache', False)
+        kodiutils.reset_memory_cache()
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        kodiutils.delete_cache(cache_file)
+        self.assertEqual(cachecodec.decode(cachecodec.encode('{}')), '{}')
+
+    def test_cache_snapshot(self):
+        """Test loading large cache entries from a binary snapshot, and ignoring outdated snapshots"""
+        import cachesnapshot
+        cache_file = 'test_snapshot.json'
+        data = dict(items=['item %d' % index for index in range(10000)])
+        kodiutils.set_setting_bool('usecachesnapshots', True)
+        kodiutils.update_cache(cache_file, json.dumps(data))
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        snapshot = kodiutils.get_cache_path(cache_file + '.snap')
+        self.assertTrue(os.path.exists(snapshot))
+        kodiutils.reset_memory_cache()
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        # Refreshing unchanged content keeps the snapshot valid
+        import httpstats
+        httpstats.start(route='/test')
+        os.utime(kodiutils.get_cache_path(cache_file), (time() - 60, time() - 60))
+        kodiutils.update_cache(cache_file, json.dumps(data))
+        kodiutils.reset_memory_cache()
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        self.assertEqual(httpstats.summary().get('counters').get('snapshot_hits'), 1)
+        # New content is never served from the snapshot of the previous content
+        data = dict(items=['item %d' % index for index in range(10001)])
+        kodiutils.update_cache(cache_file, json.dumps(data))
+        self.assertFalse(os.path.exists(snapshot))
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        # A corrupt snapshot is ignored
+        with open(snapshot, 'r+b') as fdesc:
+            fdesc.seek(-1, os.SEEK_END)
+            fdesc.write(b'\x00')
+        kodiutils.reset_memory_cache()
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        kodiutils.invalidate_caches('test_snapshot.*')
+        self.assertFalse(os.path.exists(snapshot))
+        # Snapshots of entries the SQLite store dropped are garbage
+        kodiutils.set_setting_bool('usesqlitecache', True)
+        kodiutils.update_cache(cache_file, json.dumps(data), tags=['catalog'])
+        kodiutils.reset_memory_cache()
+        self.assertEqual(kodiutils.get_cache(cache_file), data)
+        self.assertTrue(os.path.exists(snapshot))
+        kodiutils.invalidate_tags('catalog')
+        kodiutils.collect_cache_garbage()
+        self.assertFalse(os.path.exists(snapshot))
+        kodiutils.set_setting_bool('usesqlitecache', False)
+        kodiutils.set_setting_bool('usecachesnapshots', False)
+        self.assertIsNone(cachesnapshot.loads(cachesnapshot.dumps(data, ('a' * 40, 2)), ('b' * 40, 2)))
+
+    def test_write_elision(self):
+        """Test skipping the write of unchanged cache entries without reading them back"""
+        cache_file = 'test_elision.json'
+        fullpath = kodiutils.get_cache_path(cache_file)
+        kodiutils.delete_cache(cache_file)
+        kodiutils.update_cache(cache_file, json.dumps(dict(path='/elision')))
+        self.assertEqual(kodiutils.get_cache_hash(cache_file), kodiutils.content_hash(json.dumps(dict(path='/elision'))))
+        # Unchanged content only touches the cache file, so the file itself is never read or written
+        with open(fullpath, 'w') as fdesc:
+            fdesc.write('{"path": "/untouched"}')
+        os.utime(fullpath, (time() - 60, time() - 60))
+        kodiutils.update_cache(cache_file, json.dumps(dict(path='/elision')))
+        self.assertGreater(os.stat(fullpath).st_mtime, time() - 30)
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/untouched'))
+        # New content is written together with its hash
+        kodiutils.update_cache(cache_file, json.dumps(dict(path='/changed')))
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/changed'))
+        self.assertEqual(kodiutils.get_cache_hash(cache_file), kodiutils.content_hash(json.dumps(dict(path='/changed'))))
+        kodiutils.delete_cache(cache_file)
+        self.assertIsNone(kodiutils.get_cache_hash(cache_file))
+        # The SQLite store keeps the hashes in the database
+        kodiutils.set_setting_bool('usesqlitecache', True)
+        kodiutils.update_cache(cache_file, json.dumps(dict(path='/elision')))
+        self.assertTrue(kodiutils.cache_store().touch(cache_file, content_hash=kodiutils.content_hash(json.dumps(dict(path='/elision')))))
+        self.assertFalse(kodiutils.cache_store().touch(cache_file, content_hash=kodiutils.content_hash('{}')))
+        kodiutils.update_cache(cache_file, json.dumps(dict(path='/changed')))
+        self.assertEqual(kodiutils.get_cache(cache_file), dict(path='/changed'))
+        kodiutils.delete_cache(cache_file)
+        kodiutils.set_setting_bool('usesqlitecache', False)
+
+    def test_cache_tags(self):
+        """Test invalidating only the cache entries that depend on a tag"""
+        for usesqlitecache in (False, True):
+            kodiutils.set_setting_bool('usesqlitecache', usesqlitecache)
+            kodiutils.update_cache('test_tags_my.json', '{}', tags=['episodes', 'favorites'])
+            kodiutils.update_cache('test_tags_recent.json', '{}', tags=['episodes'])
+            kodiutils.update_cache('test_tags_favorites.json', '{}', tags=['account'])
+            kodiutils.invalidate_tags('favorites')
+            self.assertIsNone(kodiutils.get_cache('test_tags_my.json'))
+            self.assertEqual(kodiutils.get_cache('test_tags_recent.json'), {})
+            self.assertEqual(kodiutils.get_cache('test_tags_favorites.json'), {})
+            # Entries can lose a tag
+            kodiutils.update_cache('test_tags_recent.json', '{}', tags=['catalog'])
+            kodiutils.invalidate_tags('episodes', 'account')
+            self.assertEqual(kodiutils.get_cache('test_tags_recent.json'), {})
+            self.assertIsNone(kodiutils.get_cache('test_tags_favorites.json'))
+            kodiutils.invalidate_tags('catalog')
+            self.assertIsNone(kodiutils.get_cache('test_tags_recent.json'))
+        self.assertFalse([files for files in kodiutils.get_tag_index().values() if 'test_tags_recent.json' in files])
+        kodiutils.set_setting_bool('usesqlitecache', False)
+
+    def test_cache_quota(self):
+        """Test evicting the least recently used cache entries and collecting unused cache entries"""
+        now = time()
+        for index, cache_file in enumerate(('test_quota_1.json', 'test_quota_2.json', 'test_quota_3.json')):
+            kodiutils.update_cache(cache_file, json.dumps(dict(index=index)))
+            # More recently used than any other cache file
+            os.utime(kodiutils.get_cache_path(cache_file), (now + 1000 * (index + 1), now))
+        with open(kodiutils.get_cache_path('test_quota_orphan.json.meta'), 'w') as fdesc:
+            fdesc.write('{}')
+        kodiutils.set_setting_int('cacheentrylimit', 2)
+        kodiutils.set_setting_int('cachesizelimit', 50)
+        stats = kodiutils.collect_cache_garbage(now=now)
+        self.assertEqual(stats.get('entries'), 2)
+        self.assertGreaterEqual(stats.get('evicted'), 1)
+        self.assertFalse(os.path.exists(kodiutils.get_cache_path('test_quota_1.json')))
+        self.assertFalse(os.path.exists(kodiutils.get_cache_path('test_quota_1.json.hash')))
+        self.assertFalse(os.path.exists(kodiutils.get_cache_path('test_quota_orphan.json.meta')))
+        self.assertEqual(kodiutils.get_cache('test_quota_3.json'), dict(index=2))
+        # Cache files that were not used for a long time are garbage
+        stats = kodiutils.collect_cache_garbage(now=now + 10000 + kodiutils.CACHE_MAX_IDLE)
+        self.assertEqual(stats.get('entries'), 0)
+        self.assertFalse(os.path.exists(kodiutils.get_cache_path('test_quota_3.json')))
+        kodiutils.set_setting_int('cacheentrylimit', 1000)
+        # Cache files are garbage once their time-to-live, the stale grace period and the time kept for revalidation passed
+        kodiutils.update_cache('test_quota_ttl.json', '{}', ttl=60)
+        kodiutils.update_cache('test_quota_no_ttl.json', '{}')
+        stats = kodiutils.collect_cache_garbage(now=time() + 60 + kodiutils.cache_grace() + 1)
+        self.assertFalse(os.path.exists(kodiutils.get_cache_path('test_quota_ttl.json')))
+        self.assertFalse(os.path.exists(kodiutils.get_cache_path('test_quota_ttl.json.meta')))
+        self.assertEqual(kodiutils.get_cache('test_quota_no_ttl.json'), {})
+        kodiutils.delete_cache('test_quota_no_ttl.json')
+
+        from cachestore import SQLiteCache
+        store = SQLiteCache(':memory:')
+        for index, key in enumerate(('a.json', 'b.json', 'c.json', 'd.json')):
+            store.put(key, 'x' * 100, expires=now - 1 if key == 'd.json' else None)
+            with store.transaction() as cursor:
+                cursor.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now - 100 + index, key))
+        self.assertEqual(store.collect_garbage(max_size=250, max_entries=10, max_idle=3600, now=now),
+                         dict(entries=2, size=200, expired=1, evicted=1))
+        self.assertIsNone(store.get('a.json'))
+        store.access('b.json')
+        self.assertEqual(store.collect_garbage(max_size=1000, max_entries=1, max_idle=3600, now=now).get('evicted'), 1)
+        self.assertIsNotNone(store.get('b.json'))
+        store.close()
+
+    def test_concurrent_cache_access(self):
+        """Test that concurrent readers never see partial cache files, and concurrent modifications are never lost"""
+        cache_file = 'test_stress.json'
+        documents = [dict(version=version, items=['item %d' % index for index in range(20000)]) for version in range(2)]
+        kodiutils.update_cache(cache_file, json.dumps(documents[0]))
+        fullpath = kodiutils.get_cache_path(cache_file)
+        failures = []
+
+        def write(offset):
+            """Alternate between two versions of the cache entry"""
+            for index in range(20):
+                kodiutils.update_cache(cache_file, json.dumps(documents[(index + offset) % 2]))
+
+        def read():
+            """Read the cache file while it is being replaced"""
+            for _ in range(50):
+                if kodiutils.load_cache(kodiutils.read_cache(fullpath)) not in documents:
+                    failures.append(fullpath)
+
+        def modify(name):
+            """Add keys to a shared cache entry"""
+            for index in range(10):
+                kodiutils.modify_cache('test_stress_rmw.json', lambda data, index=index: dict(data, **{'%s-%d' % (name, index): index}), default={})
+
+        kodiutils.delete_cache('test_stress_rmw.json')
+        threads = [Thread(target=write, args=(offset,)) for offset in range(4)]
+        threads += [Thread(target=read) for _ in range(4)]
+        threads += [Thread(target=modify, args=('thread%d' % index,)) for index in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        # The content hash belongs to the content that was written last
+        self.assertEqual(kodiutils.get_cache_hash(cache_file), kodiutils.content_hash(json.dumps(kodiutils.get_cache(cache_file))))
+        self.assertEqual(len(kodiutils.get_cache('test_stress_rmw.json')), 60)
+        self.assertFalse([filename for filename in os.listdir(kodiutils.get_cache_dir()) if filename.endswith('.tmp')])
+        kodiutils.delete_cache(cache_file)
+        kodiutils.delete_cache('test_stress_rmw.json')
+
+    def test_negative_cache(self):
+        """Test not repeating a request that returned nothing until its negative cache entry expires"""
+        import httpstats
+        kodiutils.set_setting_int('httpcachettlnegative', 2)
+        for usesqlitecache in (False, True):
+            kodiutils.set_setting_bool('usesqlitecache', usesqlitecache)
+            httpstats.start(route='/test')
+            kodiutils.clear_negative_cache()
+            LocalHandler.empty = 0
+            url = self.url + '/empty?q=test'
+            for _ in range(3):
+                self.assertEqual(kodiutils.get_cached_url_json(url, cache='test_negative.json', ttl=60, negative=True), dict(results=[]))
+            self.assertEqual(LocalHandler.empty, 1)
+            # Empty responses do not become cache entries
+            self.assertIsNone(kodiutils.get_cache('test_negative.json'))
+            self.assertEqual(httpstats.summary().get('cache').get('negative'), 2)
+            self.assertEqual(httpstats.summary().get('settings').get('negative_ttl'), 120)
+            # Expired negative cache entries are requested again, and collected
+            fullpath = kodiutils.get_cache_path(kodiutils.negative_cache_file(url), kodiutils.NEGATIVE_CACHE_DIR)
+            os.utime(fullpath, (time() - 200, time() - 200))
+            self.assertEqual(kodiutils.get_url_json(url, negative=True), dict(results=[]))
+            self.assertEqual(LocalHandler.empty, 2)
+            os.utime(fullpath, (time() - 200, time() - 200))
+            self.assertEqual(kodiutils.clear_negative_cache(max_age=kodiutils.ttl('negative')), 1)
+            # Invalidating cache entries invalidates negative cache entries as well
+            kodiutils.get_url_json(url, negative=True)
+            kodiutils.invalidate_tags('episodes')
+            kodiutils.get_url_json(url, negative=True)
+            self.assertEqual(LocalHandler.empty, 4)
+            # A request skipped because the latency budget is spent is not a failure of the endpoint
+            kodiutils.clear_negative_cache()
+            kodiutils.set_deadline(0.001)
+            sleep(0.01)
+            self.assertIsNone(kodiutils.get_url_json(url, negative=True))
+            self.assertEqual(kodiutils.request_skipped(), 'latency budget spent')
+            kodiutils.set_deadline(None)
+            self.assertIsNone(kodiutils.get_negative_cache(url))
+            self.assertEqual(kodiutils.get_url_json(url, negative=True), dict(results=[]))
+            self.assertIsNone(kodiutils.request_skipped())
+
+    def test_cache_control(self):
+        """Test using the freshness of HTTP responses as the time-to-live of their cache entries, limited by the settings"""
+        kodiutils.set_setting_int('httpcachettldirect', 5)
+        kodiutils.set_setting_int('httpcachettlmaximum', 2)
+        for usesqlitecache in (False, True):
+            kodiutils.set_setting_bool('usesqlitecache', usesqlitecache)
+            LocalHandler.cacheable = 0
+            for path, max_age, cache_ttl in (('max-age', 86400 - 600, 2 * 60 * 60), ('no-cache', 0, 5 * 60), ('expires', 1800, 1800), ('none', None, 3600)):
+                cache_file = 'test_cache_control_%s.json' % path
+                kodiutils.get_cached_url_json(self.url + '/cacheable/' + path, cache=cache_file, ttl=3600)
+                self.assertEqual(kodiutils.get_cache_meta(cache_file).get('max_age'), max_age)
+                self.assertEqual(kodiutils.cache_ttl(cache_file, 3600), cache_ttl)
+            self.assertEqual(LocalHandler.cacheable, 4)
+            # Older than the default time-to-live, but still fresh according to the response
+            age_cache('test_cache_control_max-age.json', 5400)
+            kodiutils.get_cached_url_json(self.url + '/cacheable/max-age', cache='test_cache_control_max-age.json', ttl=3600)
+            self.assertEqual(LocalHandler.cacheable, 4)
+            # Younger than the default time-to-live, but stale according to the response
+            age_cache('test_cache_control_expires.json', 2400)
+            kodiutils.get_cached_url_json(self.url + '/cacheable/expires', cache='test_cache_control_expires.json', ttl=3600)
+            self.assertEqual(LocalHandler.cacheable, 5)
+            kodiutils.invalidate_caches('test_cache_control_*.json')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -9,6 +9,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import sys
 import unittest
 import addon
+from kodiutils import reset_network_config
 
 xbmc = __import__('xbmc')
 xbmcaddon = __import__('xbmcaddon')
@@ -28,10 +29,12 @@ class TestProxy(unittest.TestCase):
         xbmc.settings['network.httpproxytype'] = 0
         xbmc.settings['network.httpproxyserver'] = 'localhost'
         xbmc.settings['network.httpproxyport'] = '8899'
+        reset_network_config()
 
     def tearDown(self):
         """Clean up function for TestCase class"""
         xbmc.settings['network.usehttpproxy'] = False
+        reset_network_config()
 
     # Delete tokens method: '/tokens/delete'
     def test_clear_cookies_route(self):
@@ -163,6 +163,20 @@ class TestUtils(unittest.TestCase):
         self.assertEqual('plugin://plugin.video.youtube/foo/bar/', utils.youtube_to_plugin_url('https://www.youtube.com/foo/bar'))
         self.assertEqual('plugin://plugin.video.youtube/foo/bar/baz/', utils.youtube_to_plugin_url('https://www.youtube.com/foo/bar/baz/'))
 
+    def test_canonical_url(self):
+        """canonical_url"""
+        self.assertEqual('https://search.vrt.be/search?i=video&size=300', utils.canonical_url('HTTPS://Search.VRT.be/search?size=300&i=video#top'))
+        self.assertEqual('https://www.vrt.be/', utils.canonical_url('https://www.vrt.be'))
+
+    def test_merge_sorted(self):
+        """merge_sorted"""
+        shards = [[dict(id='a', date='3'), dict(id='b', date='1'), dict(id='c', date='2')], [dict(id='d', date='2'), dict(id='e', date='0')]]
+        merged = utils.merge_sorted(shards, key=lambda episode: episode.get('date'), reverse=True)
+        # The order within every shard is kept, even where it does not match the key
+        self.assertEqual(['a', 'd', 'b', 'c', 'e'], [episode.get('id') for episode in merged])
+        merged = utils.merge_sorted([[1, 4], [], [2, 3, 5]], key=lambda number: number)
+        self.assertEqual([1, 2, 3, 4, 5], merged)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0 (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+"""Unit tests for the cache warm-up scheduler"""
+
+# pylint: disable=invalid-name
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import unittest
+from time import time
+
+import kodiutils
+from warmup import CacheWarmer, WARMUP_MARGIN, WARMUP_RETRY
+
+xbmcaddon = __import__('xbmcaddon')
+
+addon = xbmcaddon.Addon()
+
+
+def age_cache(cache_file, age):
+    """Make a cache entry look like it was fetched age seconds ago"""
+    fetched = time() - age
+    os.utime(kodiutils.get_cache_path(cache_file), (fetched, fetched))
+
+
+class TestWarmUp(unittest.TestCase):
+    """TestCase class"""
+
+    def setUp(self):
+        """Create cache entries of different ages"""
+        self.settings = dict(addon.settings)
+        kodiutils.set_setting_bool('usecachewarmup', True)
+        self.refreshed = []
+        for cache_file, age in (('test_warmup_fresh.json', 60), ('test_warmup_expiring.json', 3540), ('test_warmup_expired.json', 7200)):
+            kodiutils.update_cache(cache_file, '{}')
+            age_cache(cache_file, age)
+        self.jobs = [(cache_file, 3600, lambda cache_file=cache_file: self.refreshed.append(cache_file))
+                     for cache_file in ('test_warmup_fresh.json', 'test_warmup_expiring.json', 'test_warmup_expired.json', 'test_warmup_unused.json')]
+
+    def tearDown(self):
+        """Remove the cache entries and restore the add-on settings"""
+        kodiutils.invalidate_caches('test_warmup_*.json')
+        addon.settings.clear()
+        addon.settings.update(self.settings)
+
+    def test_due(self):
+        """Test selecting only cache entries that were used before and expire soon"""
+        warmer = CacheWarmer()
+        self.assertEqual([job[0] for job in warmer.due(self.jobs)], ['test_warmup_expiring.json', 'test_warmup_expired.json'])
+
+    def test_retry(self):
+        """Test not refreshing a cache entry again right after an attempt"""
+        warmer = CacheWarmer()
+        warmer.plan = lambda: self.jobs
+        warmer.is_idle = lambda: True
+        warmer.warm_up(lambda: False)
+        self.assertEqual(self.refreshed, ['test_warmup_expiring.json', 'test_warmup_expired.json'])
+        self.assertEqual(warmer.due(self.jobs), [])
+        self.assertEqual(len(warmer.due(self.jobs, now=time() + WARMUP_RETRY)), 2)
+
+    def test_abort(self):
+        """Test stopping when Kodi exits or a video is playing"""
+        warmer = CacheWarmer()
+        warmer.plan = lambda: self.jobs
+        warmer.is_idle = lambda: False
+        warmer.warm_up(lambda: False)
+        self.assertEqual(self.refreshed, [])
+        warmer.is_idle = lambda: True
+        warmer.warm_up(lambda: True)
+        self.assertEqual(self.refreshed, [])
+
+    def test_refresh_ahead(self):
+        """Test that cache entries count as stale shortly before they expire while refreshing ahead"""
+        self.assertEqual(kodiutils.get_cache('test_warmup_expiring.json', ttl=3600), {})
+        with kodiutils.refresh_ahead(WARMUP_MARGIN):
+            self.assertIsNone(kodiutils.get_cache('test_warmup_expiring.json', ttl=3600))
+            self.assertEqual(kodiutils.get_cache('test_warmup_fresh.json', ttl=3600), {})
+        self.assertEqual(kodiutils.get_cache('test_warmup_expiring.json', ttl=3600), {})
+
+    def test_refresh_ahead_thread(self):
+        """Test that refreshing ahead leaves the cache lookups of other threads alone"""
+        from threading import Thread
+        results = []
+        with kodiutils.refresh_ahead(WARMUP_MARGIN):
+            thread = Thread(target=lambda: results.append(kodiutils.get_cache('test_warmup_expiring.json', ttl=3600)))
+            thread.start()
+            thread.join()
+        self.assertEqual(results, [{}])
+
+
+if __name__ == '__main__':
+    unittest.main()
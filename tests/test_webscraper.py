@@ -6,6 +6,8 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 import unittest
+from time import sleep
+import kodiutils
 from webscraper import get_video_attributes
 
 
@@ -37,6 +39,18 @@ class TestWebScraper(unittest.TestCase):
             video_attrs = get_video_attributes(bad_url)
             self.assertEqual(None, video_attrs)
 
+    def test_get_video_attributes_skipped(self):
+        """Test not remembering a failure when the request was never sent"""
+        vrtnu_url = 'https://www.vrt.be/vrtnu/a-z/de-ideale-wereld/2019-nj/de-ideale-wereld-d20191217/'
+        kodiutils.set_setting_int('httpcachettlnegative', 2)
+        kodiutils.clear_negative_cache()
+        kodiutils.set_deadline(0.001)
+        sleep(0.01)
+        self.assertIsNone(get_video_attributes(vrtnu_url))
+        kodiutils.set_deadline(None)
+        self.assertIsNone(kodiutils.get_negative_cache(vrtnu_url))
+        kodiutils.set_setting_int('httpcachettlnegative', 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,6 +10,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import sys
 from xbmcextra import kodi_to_ansi
 
+WINDOW_PROPERTIES = {}
+
 
 class Control:
     """A reimplementation of the xbmcgui Control class"""
@@ -360,17 +362,17 @@ class Window:
     @staticmethod
     def getProperty(key):
         """A stub implementation for the xbmcgui Window class getProperty() method"""
-        return ''
+        return WINDOW_PROPERTIES.get(key, '')
 
     @staticmethod
     def setProperty(key, value):
         """A stub implementation for the xbmcgui Window class setProperty() method"""
-        return
+        WINDOW_PROPERTIES[key] = value
 
     @staticmethod
     def clearProperty(key):
         """A stub implementation for the xbmcgui Window class clearProperty() method"""
-        return
+        WINDOW_PROPERTIES.pop(key, None)
 
     @staticmethod
     def setFocus(pControl):